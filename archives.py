@@ -0,0 +1,65 @@
+###############################################################################
+#
+#    Corpora packed in archives. Submissions usually arrive as .zip or .tar(.gz)
+#    files; rather than extracting hundreds of thousands of small XML files to
+#    disk first, the members of an archive are read one at a time straight
+#    into StandoffAnnotation parsing (or the track 2 score reader).
+#
+#    Only the base name of each member is used, so documents are paired with
+#    the gold standard by file name exactly as they are in directories,
+#    whatever folders they were packed in. Tar archives are read as a stream,
+#    which never seeks and suits networked storage.
+
+import os
+import tarfile
+import zipfile
+from io import BytesIO
+
+from classes import StandoffAnnotation
+from instrument import profiler
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2")
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _wanted(name):
+    # Resource forks macOS adds to zip files are not documents
+    return name.endswith("xml") and not name.startswith("__MACOSX/")
+
+
+def archive_members(path):
+    """ Yields the (base name, content) of every XML file in the archive at
+    path, in the order they are stored.
+    """
+    if path.lower().endswith(".zip"):
+        archive = zipfile.ZipFile(path)
+        try:
+            for info in archive.infolist():
+                if not info.filename.endswith("/") and _wanted(info.filename):
+                    yield os.path.basename(info.filename), \
+                        archive.read(info)
+        finally:
+            archive.close()
+    else:
+        archive = tarfile.open(path, "r|*")
+        try:
+            for member in archive:
+                if member.isfile() and _wanted(member.name):
+                    yield os.path.basename(member.name), \
+                        archive.extractfile(member).read()
+        finally:
+            archive.close()
+
+
+def parse_member(name, content):
+    """ Returns the StandoffAnnotation of an archive member, as
+    StandoffAnnotation(file_name) would read it from a file called name.
+    """
+    sa = StandoffAnnotation()
+    sa.parse_file_name(name)
+    with profiler.stage("xml parsing"):
+        sa.set_text_and_tags(*StandoffAnnotation.read_file(BytesIO(content)))
+    return sa
@@ -0,0 +1,276 @@
+###############################################################################
+#
+#   Times the stages of both evaluation tracks on synthetic corpora (see
+# corpus.py) and keeps the results in a JSON baseline, so that the effect of
+# a change can be measured against an earlier commit.
+#
+# $> python benchmarks/bench_evaluate.py --output before.json
+# $> git checkout my-branch
+# $> python benchmarks/bench_evaluate.py --compare before.json
+#
+#   Track 1 stages are timed separately: parsing the gold and system XML,
+# building the tag/token rows and filter masks of every configuration,
+# matching them, the full PHITrackEvaluation (all of the above but parsing),
+# the older set based EvaluatePHI and EvaluateTokenizedPHI classes and
+# printing the verbose report. Track 2 times evaluate_rdoc() as a whole.
+# Each stage is run --repeat times and the best and median wall times are
+# kept. With --compare, the exit status is 1 if any stage got slower than
+# the baseline by more than --tolerance.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus
+from classes import EvaluatePHI, EvaluateTokenizedPHI, PHITrackEvaluation
+from classes import _DocumentRows
+from evaluate import evaluate_rdoc, load_annotations
+
+BASELINE_VERSION = 1
+
+
+class quiet(object):
+    """ Swallows everything printed to stdout, warnings and reports alike. """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def __exit__(self, *exc_info):
+        sys.stdout = self.stdout
+
+
+def timed(repeat, fn, *args):
+    """ Runs fn(*args) repeat times and returns the list of wall times and
+    the result of the last run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        with quiet():
+            result = fn(*args)
+        times.append(time.time() - start)
+    return times, result
+
+
+def summary(times):
+    ordered = sorted(times)
+    return {"best": ordered[0],
+            "median": ordered[len(ordered) // 2],
+            "runs": times}
+
+
+def listing(directory):
+    return [os.path.join(directory, fn) for fn in sorted(os.listdir(directory))]
+
+
+def parse(gold_dir, system_dir):
+    gold = dict((sa.id, sa) for sa in load_annotations(listing(gold_dir)))
+    system = dict((sa.id, sa) for sa in load_annotations(listing(system_dir)))
+    return gold, system
+
+
+def tagsets(system_sas, gold_sas, configurations):
+    selected = []
+    for doc_id in sorted(system_sas):
+        gold = _DocumentRows(gold_sas[doc_id])
+        system = _DocumentRows(system_sas[doc_id])
+        selected.append([(gold.select(c)[0], system.select(c)[0])
+                         for c in configurations])
+    return selected
+
+
+def matching(selected, configurations):
+    matcher = PHITrackEvaluation.matcher
+    for document in selected:
+        for c, (gold_rows, system_rows) in zip(configurations, document):
+            distance = PHITrackEvaluation.relaxed_distance \
+                if c.mode == "relaxed" else 0
+            matcher.match(gold_rows, system_rows, distance=distance)
+
+
+def cold(repeat, gold_dir, system_dir, fn, *args):
+    """ timed() for stages using parsed annotations. Annotations cache their
+    tokens, so the corpus is parsed again (untimed) before each run and
+    fn(system, gold, *args) starts cold every time.
+    """
+    times = []
+    for _ in range(repeat):
+        with quiet():
+            gold, system = parse(gold_dir, system_dir)
+        run_times, result = timed(1, fn, system, gold, *args)
+        times.extend(run_times)
+    return times, result
+
+
+def bench_track1(directory, repeat):
+    gold_dir = os.path.join(directory, "gold")
+    system_dir = os.path.join(directory, "system")
+    configurations = PHITrackEvaluation.get_configurations()
+    stages = {}
+
+    times, _ = timed(repeat, parse, gold_dir, system_dir)
+    stages["track1 parse"] = summary(times)
+
+    times, selected = cold(repeat, gold_dir, system_dir,
+                           tagsets, configurations)
+    stages["track1 tagsets"] = summary(times)
+
+    times, _ = timed(repeat, matching, selected, configurations)
+    stages["track1 matching"] = summary(times)
+
+    times, evaluation = cold(repeat, gold_dir, system_dir, PHITrackEvaluation)
+    stages["track1 evaluate"] = summary(times)
+
+    times, _ = cold(repeat, gold_dir, system_dir, EvaluatePHI)
+    stages["track1 EvaluatePHI"] = summary(times)
+
+    times, _ = cold(repeat, gold_dir, system_dir, EvaluateTokenizedPHI)
+    stages["track1 EvaluateTokenizedPHI"] = summary(times)
+
+    times, _ = timed(repeat, evaluation.print_report, True)
+    stages["track1 report"] = summary(times)
+
+    return stages
+
+
+def bench_track2(directory, repeat):
+    gold_dir = os.path.join(directory, "gold")
+    system_dir = os.path.join(directory, "system")
+
+    times, _ = timed(repeat, evaluate_rdoc, gold_dir, system_dir)
+    stages = {"track2 evaluate": summary(times)}
+
+    times, _ = timed(repeat, evaluate_rdoc, gold_dir, system_dir, True)
+    stages["track2 verbose"] = summary(times)
+
+    return stages
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, tolerance):
+    """ Prints the best times of results next to those of baseline and
+    returns the stages that got slower by more than tolerance.
+    """
+    if baseline["parameters"] != results["parameters"]:
+        print("WARNING: the baseline was run with different parameters, "
+              "times are not comparable")
+
+    str_fmt = "{:<30}{:>12}{:>12}{:>10}"
+    print(str_fmt.format("Stage", "Baseline", "Current", "Ratio"))
+    print("{:-<64}".format(""))
+
+    slower = []
+    for stage in sorted(results["stages"]):
+        current = results["stages"][stage]["best"]
+        if stage not in baseline["stages"]:
+            print(str_fmt.format(stage, "-", "{:.4f}".format(current), "-"))
+            continue
+
+        before = baseline["stages"][stage]["best"]
+        ratio = current / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            slower.append(stage)
+            flag = " slower"
+        elif ratio < 1 - tolerance:
+            flag = " faster"
+        print(str_fmt.format(stage, "{:.4f}".format(before),
+                             "{:.4f}".format(current),
+                             "{:.2f}".format(ratio)) + flag)
+
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluation benchmarks")
+    parser.add_argument("--track", choices=["track1", "track2", "both"],
+                        default="both")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--accuracy", type=float, default=0.6,
+                        help="track 2 rate of correct system scores")
+    parser.add_argument("--corpus-dir",
+                        help="write the corpora here and keep them, "
+                             "a temporary directory is used otherwise")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compare the results against a baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown allowed by --compare")
+    corpus.add_track1_arguments(parser)
+    args = parser.parse_args()
+
+    noise = corpus.noise_from_args(args)
+    parameters = {"docs": args.docs, "words": args.words,
+                  "phi_density": args.phi_density, "mix": args.mix,
+                  "noise": noise.as_dict(), "accuracy": args.accuracy,
+                  "seed": args.seed, "repeat": args.repeat,
+                  "track": args.track}
+
+    directory = args.corpus_dir or tempfile.mkdtemp(prefix="cegs-bench-")
+    stages = {}
+    try:
+        if args.track in ("track1", "both"):
+            track1_dir = os.path.join(directory, "track1")
+            corpus.generate_track1(track1_dir, docs=args.docs,
+                                   words=args.words,
+                                   phi_density=args.phi_density,
+                                   mix=args.mix, noise=noise, seed=args.seed)
+            stages.update(bench_track1(track1_dir, args.repeat))
+
+        if args.track in ("track2", "both"):
+            track2_dir = os.path.join(directory, "track2")
+            corpus.generate_track2(track2_dir, docs=args.docs,
+                                   words=args.words, accuracy=args.accuracy,
+                                   seed=args.seed)
+            stages.update(bench_track2(track2_dir, args.repeat))
+    finally:
+        if not args.corpus_dir:
+            shutil.rmtree(directory)
+
+    results = {"version": BASELINE_VERSION,
+               "commit": current_commit(),
+               "python": platform.python_version(),
+               "parameters": parameters,
+               "stages": stages}
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, "r") as handle:
+            baseline = json.load(handle)
+        assert baseline.get("version") == BASELINE_VERSION, \
+            "{} is not a baseline of this version!".format(args.compare)
+        sys.exit(1 if compare(baseline, results, args.tolerance) else 0)
+
+    str_fmt = "{:<30}{:>12}{:>12}"
+    print(str_fmt.format("Stage", "Best (s)", "Median (s)"))
+    print("{:-<54}".format(""))
+    for stage in sorted(stages):
+        print(str_fmt.format(stage, "{:.4f}".format(stages[stage]["best"]),
+                             "{:.4f}".format(stages[stage]["median"])))
+
+
+if __name__ == "__main__":
+    main()
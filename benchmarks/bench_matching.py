@@ -0,0 +1,115 @@
+###############################################################################
+#
+#   Benchmarks SpanMatcher against the set based matching it replaced, where
+# PHITag objects are put into Python sets and relaxed matching is done by
+# switching PHITag to AnnotatorTag.fuzzy_end_equality().
+#
+# $> python benchmarks/bench_matching.py [--docs N] [--tags N] [--seed N]
+#
+#   Both paths are timed on the same synthetic documents and the number of
+# documents where their tp/fp/fn counts disagree is reported. Strict counts
+# must always agree; relaxed counts may differ on documents with several
+# spans within reach of each other since SpanMatcher pairs spans one-to-one.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classes import SpanMatcher
+from tags import PHITag
+
+
+def synthetic_document(n_tags, rng):
+    """ Returns a list of gold and a list of system PHITag objects. """
+    names = sorted(t for t in PHITag.tag_types.keys() if t != "PHI")
+    gold, system = [], []
+    position = 0
+    for i in range(n_tags):
+        position += rng.randint(1, 40)
+        name = rng.choice(names)
+        cls = PHITag.tag_types[name]
+        TYPE = rng.choice(cls.valid_TYPE if isinstance(cls.valid_TYPE, list)
+                          else [cls.valid_TYPE])
+        start, end = position, position + rng.randint(1, 20)
+        gold.append((name, start, end, TYPE))
+
+        r = rng.random()
+        if r < 0.1:
+            continue
+        elif r < 0.25:
+            end = max(start + 1, end + rng.choice([-3, -2, -1, 1, 2, 3]))
+        elif r < 0.3:
+            TYPE = TYPE.lower()
+        system.append((name, start, end, TYPE))
+
+    def make(values):
+        tags = []
+        for i, (name, start, end, TYPE) in enumerate(values):
+            element = etree.Element(name, id="P%d" % i, start=str(start),
+                                    end=str(end), TYPE=TYPE, text="")
+            tags.append(PHITag.tag_types[name](element))
+        return tags
+
+    return make(gold), make(system)
+
+
+def set_counts(gold, system):
+    gold, system = set(gold), set(system)
+    return len(gold.intersection(system)), len(system - gold), len(gold - system)
+
+
+def rows(tags):
+    return SpanMatcher.rows([(t.name_code, t.TYPE_code, t.start, t.end)
+                             for t in tags])
+
+
+def timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpanMatcher benchmark")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = [synthetic_document(args.tags, rng) for _ in range(args.docs)]
+
+    row_time, document_rows = timed(lambda: [(rows(g), rows(s))
+                                             for g, s in documents])
+    matcher = SpanMatcher()
+
+    print("{:<10}{:>12}{:>18}{:>10}".format("Mode", "Sets (s)",
+                                            "SpanMatcher (s)", "Disagree"))
+    for mode, distance in (("Strict", 0), ("Relaxed", 2)):
+        if distance:
+            PHITag.fuzzy_end_equality(distance)
+        set_time, expected = timed(lambda: [set_counts(g, s)
+                                            for g, s in documents])
+        PHITag.strict_equality()
+
+        span_time, results = timed(
+            lambda: [matcher.match(g, s, distance=distance)
+                     for g, s in document_rows])
+        counts = [(len(tp), len(fp), len(fn)) for tp, fp, fn in results]
+
+        print("{:<10}{:>12.4f}{:>18.4f}{:>10d}".format(
+            mode, set_time, span_time,
+            sum(a != b for a, b in zip(expected, counts))))
+
+    print("\nBuilding rows for {} documents: {:.4f}s".format(args.docs,
+                                                            row_time))
+
+
+if __name__ == "__main__":
+    main()
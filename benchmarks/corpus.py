@@ -0,0 +1,288 @@
+###############################################################################
+#
+#   Synthetic i2b2 style corpora for the benchmarks. Track 1 corpora are pairs
+# of gold and system deIdi2b2 XML files whose system PHI tags are derived from
+# the gold ones with tunable noise, track 2 corpora are pairs of files with a
+# POSITIVE_VALENCE severity score.
+#
+# $> python benchmarks/corpus.py track1 OUT_DIR [--docs N] [--words N] ...
+# $> python benchmarks/corpus.py track2 OUT_DIR [--docs N] [--words N] ...
+#
+#   Both write OUT_DIR/gold/ and OUT_DIR/system/ with files named XXX-YY.xml,
+# which evaluate.py can be run on directly.
+
+import argparse
+import os
+import random
+from xml.sax.saxutils import quoteattr
+
+WORDS = ("the patient was seen at clinic on with history of pain and fever "
+         "denies chest shortness breath follow up in weeks mg daily "
+         "discharged home stable").split()
+
+# Words used for the text of PHI spans
+PHI_WORDS = ("john smith boston 02115 555-1234 12/03/2090 mercy st 44 "
+             "nurse mrn-8812 jones").split()
+
+SEPARATORS = [" ", " ", " ", "\n", ", ", ". "]
+
+# Tag names and the TYPE values they are generated with
+TYPES = {"NAME": ["PATIENT", "DOCTOR", "USERNAME"],
+         "PROFESSION": ["PROFESSION"],
+         "LOCATION": ["HOSPITAL", "ORGANIZATION", "STREET", "CITY", "STATE",
+                      "COUNTRY", "ZIP"],
+         "AGE": ["AGE"],
+         "DATE": ["DATE"],
+         "CONTACT": ["PHONE", "FAX", "EMAIL"],
+         "ID": ["SSN", "MEDICALRECORD", "HEALTHPLAN", "IDNUM", "DEVICE"],
+         "OTHER": ["OTHER"]}
+
+SEVERITIES = ["ABSENT", "MILD", "MODERATE", "SEVERE"]
+
+
+class Noise(object):
+    """ Rates at which the system annotation of a gold PHI tag is changed.
+    Each gold tag is changed in at most one way:
+
+    missed    the tag is left out
+    near      the end offset is moved by 1 or 2 characters, still a match
+              in relaxed mode
+    far       the end offset is moved by 3 to 6 characters
+    type      the TYPE is replaced by another TYPE of the same tag name
+    name      the tag name (and TYPE) is replaced by another one
+
+    spurious is the number of extra system tags per 100 words.
+    """
+    def __init__(self, missed=0.05, near=0.1, far=0.03, type=0.03, name=0.02,
+                 spurious=1.0):
+        self.missed = missed
+        self.near = near
+        self.far = far
+        self.type = type
+        self.name = name
+        self.spurious = spurious
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def parse_mix(value):
+    """ Parses a 'NAME=3,DATE=1' tag name mix into a {name: weight} dict. """
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().upper()
+        assert name in TYPES, "Unknown tag name {}".format(name)
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def weighted_choice(rng, weights):
+    total = sum(weights.values())
+    r = rng.uniform(0, total)
+    for key in sorted(weights.keys()):
+        r -= weights[key]
+        if r <= 0:
+            return key
+    return sorted(weights.keys())[-1]
+
+
+def file_names(docs):
+    """ XXX-YY.xml file names, three records per patient. """
+    return ["{:03d}-{:02d}.xml".format(100 + i // 3, i % 3 + 1)
+            for i in range(docs)]
+
+
+def synthetic_text(rng, words, phi_density):
+    """ Returns the text of a document of about 'words' words and the
+    (start, end) offsets of the spans PHI tags are put on.
+    """
+    text = "Record date: 2090-03-12\n\n"
+    spans = []
+    i = 0
+    while i < words:
+        if rng.random() < phi_density:
+            length = rng.randint(1, 3)
+            start = len(text)
+            text += " ".join(rng.choice(PHI_WORDS) for _ in range(length))
+            spans.append((start, len(text)))
+            i += length
+        else:
+            text += rng.choice(WORDS)
+            i += 1
+        text += rng.choice(SEPARATORS)
+    return text, spans
+
+
+def system_tags(rng, text, spans, gold, noise, mix):
+    system = []
+    for name, start, end, TYPE in gold:
+        r = rng.random()
+        if r < noise.missed:
+            continue
+        r -= noise.missed
+        if r < noise.near:
+            end = min(len(text), max(start + 1,
+                                     end + rng.choice([-2, -1, 1, 2])))
+        elif r - noise.near < noise.far:
+            end = min(len(text), end + rng.randint(3, 6))
+        elif r - noise.near - noise.far < noise.type:
+            TYPE = rng.choice(TYPES[name])
+        elif r - noise.near - noise.far - noise.type < noise.name:
+            name = weighted_choice(rng, mix)
+            TYPE = rng.choice(TYPES[name])
+        system.append((name, start, end, TYPE))
+
+    words = len(text.split())
+    for _ in range(int(round(words * noise.spurious / 100.0))):
+        start = rng.randint(0, max(0, len(text) - 2))
+        end = min(len(text), start + rng.randint(1, 12))
+        name = weighted_choice(rng, mix)
+        system.append((name, start, end, rng.choice(TYPES[name])))
+
+    rng.shuffle(system)
+    return system
+
+
+def write_phi_document(path, text, tags):
+    with open(path, "w") as handle:
+        handle.write('<?xml version="1.0" encoding="UTF-8" ?>\n'
+                     '<deIdi2b2>\n<TEXT><![CDATA[')
+        handle.write(text)
+        handle.write(']]></TEXT>\n<TAGS>\n')
+        for i, (name, start, end, TYPE) in enumerate(tags):
+            handle.write('<{} id="P{}" start="{}" end="{}" text={} '
+                         'TYPE="{}" comment="" />\n'.format(
+                             name, i, start, end,
+                             quoteattr(text[start:end]), TYPE))
+        handle.write('</TAGS>\n</deIdi2b2>\n')
+
+
+def generate_track1(directory, docs=100, words=600, phi_density=0.05,
+                    mix=None, noise=None, seed=0):
+    """ Writes a track 1 corpus of 'docs' documents of about 'words' words to
+    directory/gold and directory/system. phi_density is the fraction of words
+    starting a PHI span, mix a {tag name: weight} dict (all names equally
+    likely by default) and noise a Noise instance.
+    """
+    rng = random.Random(seed)
+    mix = mix or dict((name, 1.0) for name in TYPES)
+    noise = noise or Noise()
+
+    for sub in ("gold", "system"):
+        if not os.path.exists(os.path.join(directory, sub)):
+            os.makedirs(os.path.join(directory, sub))
+
+    for file_name in file_names(docs):
+        text, spans = synthetic_text(rng, rng.randint(words // 2,
+                                                      words * 3 // 2),
+                                     phi_density)
+        gold = []
+        for start, end in spans:
+            name = weighted_choice(rng, mix)
+            gold.append((name, start, end, rng.choice(TYPES[name])))
+
+        write_phi_document(os.path.join(directory, "gold", file_name),
+                           text, gold)
+        write_phi_document(os.path.join(directory, "system", file_name),
+                           text, system_tags(rng, text, spans, gold,
+                                             noise, mix))
+
+
+def write_rdoc_document(path, text, score):
+    with open(path, "w") as handle:
+        handle.write('<?xml version="1.0" encoding="UTF-8" ?>\n'
+                     '<RDoCi2b2>\n<TEXT><![CDATA[')
+        handle.write(text)
+        handle.write(']]></TEXT>\n<TAGS>\n')
+        handle.write('<POSITIVE_VALENCE score={} annotated_by="0" />\n'.format(
+            quoteattr(score)))
+        handle.write('</TAGS>\n</RDoCi2b2>\n')
+
+
+def generate_track2(directory, docs=100, words=600, accuracy=0.6, seed=0):
+    """ Writes a track 2 corpus of 'docs' documents to directory/gold and
+    directory/system. Gold severities are drawn uniformly, the system
+    severity is the gold one with probability accuracy and otherwise another
+    level, the closer to the gold one the likelier.
+    """
+    rng = random.Random(seed)
+
+    for sub in ("gold", "system"):
+        if not os.path.exists(os.path.join(directory, sub)):
+            os.makedirs(os.path.join(directory, sub))
+
+    for file_name in file_names(docs):
+        text = " ".join(rng.choice(WORDS) for _ in
+                        range(rng.randint(words // 2, words * 3 // 2)))
+        gold = rng.randint(0, len(SEVERITIES) - 1)
+        system = gold
+        if rng.random() > accuracy:
+            system = weighted_choice(rng, dict(
+                (level, 1.0 / abs(level - gold))
+                for level in range(len(SEVERITIES)) if level != gold))
+
+        write_rdoc_document(os.path.join(directory, "gold", file_name),
+                            text, SEVERITIES[gold])
+        write_rdoc_document(os.path.join(directory, "system", file_name),
+                            text, SEVERITIES[system])
+
+
+def add_track1_arguments(parser):
+    parser.add_argument("--docs", type=int, default=100,
+                        help="number of documents")
+    parser.add_argument("--words", type=int, default=600,
+                        help="average number of words per document")
+    parser.add_argument("--phi-density", type=float, default=0.05,
+                        help="fraction of words starting a PHI span")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="tag name weights, eg. NAME=3,DATE=2,AGE")
+    parser.add_argument("--missed", type=float, default=0.05,
+                        help="rate of gold tags the system leaves out")
+    parser.add_argument("--near", type=float, default=0.1,
+                        help="rate of end offsets moved within relaxed reach")
+    parser.add_argument("--far", type=float, default=0.03,
+                        help="rate of end offsets moved beyond relaxed reach")
+    parser.add_argument("--type-swap", type=float, default=0.03,
+                        help="rate of tags given another TYPE")
+    parser.add_argument("--name-swap", type=float, default=0.02,
+                        help="rate of tags given another tag name")
+    parser.add_argument("--spurious", type=float, default=1.0,
+                        help="spurious system tags per 100 words")
+
+
+def noise_from_args(args):
+    return Noise(missed=args.missed, near=args.near, far=args.far,
+                 type=args.type_swap, name=args.name_swap,
+                 spurious=args.spurious)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic corpus generator")
+    subparsers = parser.add_subparsers(dest="track")
+
+    one = subparsers.add_parser("track1", help="PHI corpus")
+    one.add_argument("directory")
+    one.add_argument("--seed", type=int, default=0)
+    add_track1_arguments(one)
+
+    two = subparsers.add_parser("track2", help="RDoC corpus")
+    two.add_argument("directory")
+    two.add_argument("--seed", type=int, default=0)
+    two.add_argument("--docs", type=int, default=100)
+    two.add_argument("--words", type=int, default=600)
+    two.add_argument("--accuracy", type=float, default=0.6,
+                     help="rate of system scores equal to the gold score")
+
+    args = parser.parse_args()
+    if args.track == "track1":
+        generate_track1(args.directory, docs=args.docs, words=args.words,
+                        phi_density=args.phi_density, mix=args.mix,
+                        noise=noise_from_args(args), seed=args.seed)
+    else:
+        generate_track2(args.directory, docs=args.docs, words=args.words,
+                        accuracy=args.accuracy, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
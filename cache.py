@@ -0,0 +1,121 @@
+###############################################################################
+#
+#    On disk cache of parsed annotations. Parsing XML with lxml dominates the
+#    time it takes to load a corpus, and gold standard directories rarely
+#    change between runs. AnnotationCache keeps the root tag, text and PHI tag
+#    attributes of each parsed file in a marshal encoded entry so that later
+#    runs can rebuild the StandoffAnnotation without touching lxml.
+#
+#    Entries are named after the absolute path of the file they cache and
+#    record its size and SHA-1 digest, an entry is only used if both still
+#    match the file. Whenever the cache directory grows over its size limit
+#    the least recently used entries are removed (see evict()).
+
+import hashlib
+import marshal
+import os
+from io import BytesIO
+
+from classes import StandoffAnnotation
+from tags import TagElement
+
+
+class AnnotationCache(object):
+    # Bump whenever the entry layout changes so old entries are ignored
+    version = 1
+
+    suffix = ".annotation"
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def entry_path(self, file_name):
+        key = hashlib.sha1(os.path.abspath(file_name)).hexdigest()
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _read_entry(self, file_name, size, digest):
+        """ Returns the (root, text, phi elements) stored for file_name or None
+        if there is no entry or the entry is stale.
+        """
+        path = self.entry_path(file_name)
+        try:
+            with open(path, "rb") as handle:
+                entry = marshal.load(handle)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+
+        if entry[:4] != (self.version, os.path.abspath(file_name),
+                         size, digest):
+            return None
+
+        # Mark the entry as recently used for evict(), if the cache directory
+        # can be written to
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        root, text, phi = entry[4:]
+        return root, text, [TagElement(t, a) for t, a in phi]
+
+    def _write_entry(self, file_name, size, digest, root, text, phi_elements):
+        path = self.entry_path(file_name)
+        entry = (self.version, os.path.abspath(file_name), size, digest,
+                 root, text, [(e.tag, e.attrib) for e in phi_elements])
+
+        # Write to a temporary file first so that concurrent readers never
+        # see a partially written entry.
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as handle:
+            marshal.dump(entry, handle)
+        os.rename(tmp_path, path)
+
+    def load(self, file_name):
+        """ Returns the StandoffAnnotation for file_name, from the cache if
+        there is an up to date entry for it and by parsing the file (and
+        caching the result) otherwise.
+        """
+        with open(file_name, "rb") as handle:
+            content = handle.read()
+        size = len(content)
+        digest = hashlib.sha1(content).hexdigest()
+
+        parsed = self._read_entry(file_name, size, digest)
+        if parsed is None:
+            parsed = StandoffAnnotation.read_file(BytesIO(content))
+            self._write_entry(file_name, size, digest, *parsed)
+
+        sa = StandoffAnnotation()
+        sa.parse_file_name(file_name)
+        sa.set_text_and_tags(*parsed)
+        sa.file_name = file_name
+
+        return sa
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is no
+        larger than max_size bytes.
+        """
+        entries = []
+        for fn in os.listdir(self.directory):
+            if fn.endswith(self.suffix):
+                path = os.path.join(self.directory, fn)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
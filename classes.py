@@ -1,9 +1,18 @@
 import re
 from lxml import etree
+import hashlib
 import os
 import numpy
 from collections import defaultdict
+from collections import namedtuple
+from filters import Equals
+from filters import Filter
+from filters import PairLookup
+from filters import TagColumns
+from instrument import profiler
+from resampling import bootstrap_intervals
 from tags import PHITag
+from tags import TagElement
 
 
 class Token(object):
@@ -122,6 +131,7 @@ class TokenSequence(object):
     def __init__(self, text, tokenizer=None, start=0):
 
         tokenizer = self.tokenizer if tokenizer is None else tokenizer
+        self._offsets = None
 
         if hasattr(text, "__iter__"):
             self.text = ''.join(t.to_string() for t in text)
@@ -166,9 +176,32 @@ class TokenSequence(object):
     def next(self):
         return self.tokens.next()
 
+    def index(self, token):
+        """ Returns the position of the first token in the sequence equal to
+        token (ie. with the same start and end offsets), raises ValueError if
+        there is none. The offset index is built the first time it is needed,
+        so tokens should not be changed after that.
+        """
+        if self._offsets is None:
+            self._offsets = {}
+            for i, t in enumerate(self.tokens):
+                self._offsets.setdefault((t.start, t.end), i)
+
+        try:
+            return self._offsets[(token.start, token.end)]
+        except KeyError:
+            raise ValueError("{} is not in sequence".format(token))
+
+    def __contains__(self, token):
+        try:
+            self.index(token)
+            return True
+        except ValueError:
+            return False
+
     def subseq(self, other):
         """Test if we are a subsequence of other"""
-        return all([t in other.tokens for t in self.tokens])
+        return all([t in other for t in self.tokens])
 
 
 class PHIToken(Token):
@@ -180,6 +213,17 @@ class PHIToken(Token):
         self.name = ""
         self.TYPE = ""
 
+    @classmethod
+    def from_token(cls, token, phi_tag):
+        """ Returns a PHIToken copy of token carrying the name and TYPE of
+        phi_tag.
+        """
+        t = cls(token.token, token.pre_ws, token.post_ws,
+                token.index, token.start, token.end)
+        t.name = phi_tag.name
+        t.TYPE = phi_tag.TYPE
+        return t
+
     def __repr__(self):
         fstr = "<{}: {}, {}, {}, {}, {}, i:{}, s:{}, e:{}>"
         return fstr.format(self.__class__.__name__,
@@ -222,14 +266,23 @@ class StandoffAnnotation(object):
         self.record_id = ''
         self.sys_id = ''
         self.file_name = None
-        self.raw = None
+        self._raw = None
         self.text = None
         self.root = root
         self.doc_tags = []
         self.tags = []
         self.phi = []
         self._tokens = None
+        self._span_tokens = {}
 
+        self.parse_file_name(file_name)
+
+        if file_name is not None:
+            self.parse_file(file_name)
+            self.file_name = file_name
+
+    def parse_file_name(self, file_name):
+        """ Set patient, record and system ids from the name of the file. """
         if file_name:
             if self.id_parser.match(os.path.basename(file_name)):
                 self.patient_id = '0'
@@ -241,11 +294,6 @@ class StandoffAnnotation(object):
         else:
             self.patient_id = None
 
-        if file_name is not None:
-            with open(file_name, 'r') as handle:
-                self.parse_text_and_tags(handle.read().decode('utf8'))
-                self.file_name = file_name
-
     @property
     def id(self):
         return self.patient_id + "-" + self.record_id
@@ -254,6 +302,35 @@ class StandoffAnnotation(object):
     def id(self, value):
         self.patient_id, self.record_id = value.split("-")
 
+    @property
+    def raw(self):
+        """ The raw XML of the annotation. Annotations parsed from a file do
+        not keep it around, it is read again from the file on every access.
+        """
+        if self._raw is None and self.file_name is not None:
+            with open(self.file_name, 'r') as handle:
+                return handle.read().decode('utf8')
+        return self._raw
+
+    @raw.setter
+    def raw(self, value):
+        self._raw = value
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        # The digest is taken once as the text is set, so that documents are
+        # compared in O(1) however often they are (see Evaluate.validate_text)
+        self._text = value
+        if value is None:
+            self.text_digest = None
+        else:
+            self.text_digest = hashlib.sha1(value.encode("utf8")).digest()
+        self.invalidate_tokens()
+
     @property
     def token_sequence(self):
         if self._tokens is None:
@@ -262,12 +339,31 @@ class StandoffAnnotation(object):
 
         return self._tokens
 
+    def span_tokens(self, start, end):
+        """ Returns the tokens of text[start:end]. Each span is tokenized only
+        once,  later calls return the cached list, which must not be modified.
+        See invalidate_tokens().
+        """
+        try:
+            return self._span_tokens[(start, end)]
+        except KeyError:
+            with profiler.stage("tokenization"):
+                tokens = self.ts_cls.tokenizer(self.text[start:end],
+                                               start=start)
+            self._span_tokens[(start, end)] = tokens
+            return tokens
+
+    def invalidate_tokens(self):
+        """ Drop cached tokens, the text setter calls this. """
+        self._tokens = None
+        self._span_tokens = {}
+
     def tag_to_token_sequence(self, tag):
         try:
             seq = self.ts_cls(tag.text, start=int(tag.start))
             for token in seq:
                 try:
-                    token.index = self.token_sequence.tokens.index(token)
+                    token.index = self.token_sequence.index(token)
                 except ValueError:
                     token.index = None
             return seq
@@ -500,80 +596,184 @@ class StandoffAnnotation(object):
                 for element in soup.find("TAGS").findall(t):
                     self.phi.append(cls(element))
 
+    @staticmethod
+    def read_file(source):
+        """ Read the root tag name,  the text and the PHI elements of an
+        annotation from source (a file name or file object) with iterparse.
+        Each element is freed as soon as it has been read, so neither the raw
+        XML nor the whole tree are held in memory at any point. PHI elements
+        are returned as TagElement tuples grouped by tag name, the order
+        parse_text_and_tags() builds tags in.
+        """
+        root = None
+        tags = None
+        text = None
+        found_text = False
+        phi_elements = defaultdict(list)
+
+        for event, element in etree.iterparse(source,
+                                              events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                elif tags is None and element.tag == "TAGS" and \
+                        element.getparent() is root:
+                    tags = element
+                continue
+
+            parent = element.getparent()
+            if parent is None:
+                break
+            elif parent is root:
+                if element.tag == "TEXT" and not found_text:
+                    text = element.text
+                    found_text = True
+            elif parent is tags:
+                if element.tag in PHITag.tag_types:
+                    phi_elements[element.tag].append(
+                        TagElement(element.tag, dict(element.attrib)))
+            else:
+                continue
+
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+
+        return (root.tag, text,
+                [e for t in PHITag.tag_types.keys() for e in phi_elements[t]])
+
+    def set_text_and_tags(self, root, text, phi_elements):
+        """ Set the root tag name and text and build PHI tags out of
+        phi_elements, as returned by read_file().
+        """
+        self.root = root
+        self.text = text
+        self.phi = [PHITag.tag_types[e.tag](e) for e in phi_elements]
+
+    def parse_file(self, file_name):
+        with profiler.stage("xml parsing"):
+            self.set_text_and_tags(*self.read_file(file_name))
+
 
 class Evaluate(object):
+    # Every field of the records written by write_report(), see output.py
+    record_fields = ["record", "system", "label", "doc_id", "documents",
+                     "tp", "fp", "fn", "precision", "recall", "F1",
+                     "macro_precision", "macro_precision_std",
+                     "macro_recall", "macro_recall_std", "confidence",
+                     "precision_lower", "precision_upper",
+                     "recall_lower", "recall_upper", "F1_lower", "F1_upper"]
+
     def __init__(self, s_sas, g_sas,
-                 filters=None, conjunctive=False, invert=False):
-        self.tp = []
-        self.fp = []
-        self.fn = []
-        self.doc_ids = []
+                 filters=None, conjunctive=False, invert=False,
+                 counts_only=False):
+        """ With counts_only only the number of true positives, false
+        positives and false negatives of each document is kept, not the tags
+        themselves; tp, fp and fn are then None.
+        """
+        self._reset(counts_only)
         self.invert = invert
         self.conjunctive = conjunctive
         self.verbose = False
-
-        if filters is None:
-            self.filters = []
-        else:
-            self.filters = filters
+        self.filters = filters
 
         assert len(set([a.sys_id for a in s_sas.values()])) == 1, \
             "More than one annotator ID in this set of Annotations!"
 
         self.sys_id = s_sas.values()[0].sys_id
+        self.system_id = self.sys_id
 
         for doc_id in list(set(s_sas.keys()) & set(g_sas.keys())):
 
-            self.validate_text(g_sas[doc_id].text, s_sas[doc_id].text, doc_id)
-
-            if filters is not None:
-                # Get all doc tags for each tag that passes all the
-                # predicate functions in filters
-                if conjunctive:
-                    if invert:
-                        gold = set([t for t in self.get_tagset(g_sas[doc_id])
-                                    if not all([f(t) for f in self.filters])])
-                        sys = set([t for t in self.get_tagset(s_sas[doc_id])
-                                   if not all([f(t) for f in self.filters])])
-                    else:
-                        gold = set([t for t in self.get_tagset(g_sas[doc_id])
-                                    if all([f(t) for f in self.filters])])
-                        sys = set([t for t in self.get_tagset(s_sas[doc_id])
-                                   if all([f(t) for f in self.filters])])
-                else:
-                    if invert:
-                        gold = set([t for t in self.get_tagset(g_sas[doc_id])
-                                    if not any([f(t) for f in self.filters])])
-                        sys = set([t for t in self.get_tagset(s_sas[doc_id])
-                                   if not any([f(t) for f in self.filters])])
-                    else:
-                        gold = set([t for t in self.get_tagset(g_sas[doc_id])
-                                    if any([f(t) for f in self.filters])])
-                        sys = set([t for t in self.get_tagset(s_sas[doc_id])
-                                   if any([f(t) for f in self.filters])])
+            self.validate_text(g_sas[doc_id], s_sas[doc_id], doc_id)
 
-            else:
-                gold = set(self.get_tagset(g_sas[doc_id]))
-                sys = set(self.get_tagset(s_sas[doc_id]))
+            gold = self.filter_tagset(self.get_tagset(g_sas[doc_id]))
+            sys = self.filter_tagset(self.get_tagset(s_sas[doc_id]))
 
-            self.tp.append(gold.intersection(sys))
-            self.fp.append(sys - gold)
-            self.fn.append(gold - sys)
-            self.doc_ids.append(doc_id)
+            with profiler.stage("set operations"):
+                self.add_document(doc_id, gold.intersection(sys),
+                                  sys - gold, gold - sys)
+
+    def filter_tagset(self, tags):
+        """ Returns the set of tags passing the filters: any of them, or all
+        of them if conjunctive, or neither if invert.
+        """
+        if self.filters is None:
+            return set(tags)
+
+        combine = all if self.conjunctive else any
+        return set([t for t in tags
+                    if combine([f(t) for f in self.filters]) != self.invert])
+
+    def _reset(self, counts_only):
+        self.counts_only = counts_only
+        self.tp = None if counts_only else []
+        self.fp = None if counts_only else []
+        self.fn = None if counts_only else []
+        self.doc_ids = []
+        # Sub-evaluation label given by CombinedEvaluation.add_eval()
+        self.label = ""
+        # Confidence intervals of the micro measures, see bootstrap()
+        self.confidence = None
+        self.intervals = None
+        # (tp, fp, fn) rows of the documents in doc_ids, grown by doubling
+        self._counts = numpy.zeros((16, 3), dtype=numpy.int64)
+
+    def _append_counts(self, doc_id, tp, fp, fn):
+        n = len(self.doc_ids)
+        if n == len(self._counts):
+            self._counts = numpy.concatenate([self._counts,
+                                              numpy.zeros_like(self._counts)])
+        self._counts[n] = (tp, fp, fn)
+        self.doc_ids.append(doc_id)
+
+    def add_document(self, doc_id, tp, fp, fn):
+        """ Add the true positives, false positives and false negatives of a
+        document. Unless counts_only is set they are kept in tp, fp and fn.
+        """
+        if not self.counts_only:
+            self.tp.append(tp)
+            self.fp.append(fp)
+            self.fn.append(fn)
+        self._append_counts(doc_id, len(tp), len(fp), len(fn))
+
+    def add_counts(self, doc_id, tp, fp, fn):
+        """ Add a document by its number of true positives, false positives
+        and false negatives. Its entries in tp, fp and fn are None.
+        """
+        if not self.counts_only:
+            self.tp.append(None)
+            self.fp.append(None)
+            self.fn.append(None)
+        self._append_counts(doc_id, tp, fp, fn)
+
+    def counts(self):
+        """ Returns an integer array with a (tp, fp, fn) row for each
+        document in doc_ids.
+        """
+        return self._counts[:len(self.doc_ids)]
 
     @staticmethod
-    def recall(tp, fn):
+    def _ratio(tp, other):
         try:
-            return len(tp) / float(len(fn) + len(tp))
+            return tp / float(other + tp)
         except ZeroDivisionError:
             return 0.0
 
+    @staticmethod
+    def _ratios(tp, other):
+        """ _ratio() of each element of the tp and other count arrays. """
+        total = tp + other
+        return numpy.where(total > 0,
+                           tp / numpy.maximum(total, 1).astype(float), 0.0)
+
+    @staticmethod
+    def recall(tp, fn):
+        return Evaluate._ratio(len(tp), len(fn))
+
     @staticmethod
     def precision(tp, fp):
-        try:
-            return len(tp) / float(len(fp) + len(tp))
-        except ZeroDivisionError:
-            return 0.0
+        return Evaluate._ratio(len(tp), len(fp))
 
     @staticmethod
     def F_beta(p, r, beta=1):
@@ -584,46 +784,35 @@ class Evaluate(object):
             return 0.0
 
     def macro_recall(self):
-        np = numpy.array([Evaluate.recall(tp, fn)
-                          for tp, fn in zip(self.tp, self.fn)])
+        counts = self.counts()
+        np = Evaluate._ratios(counts[:, 0], counts[:, 2])
         return (np.mean(), np.std())
 
     def macro_precision(self):
-        np = numpy.array([Evaluate.precision(tp, fp)
-                          for tp, fp in zip(self.tp, self.fp)])
+        counts = self.counts()
+        np = Evaluate._ratios(counts[:, 0], counts[:, 1])
         return (np.mean(), np.std())
 
     def micro_recall(self):
-        try:
-            return sum([len(t) for t in self.tp]) /  \
-                float(sum([len(t) for t in self.tp]) +
-                      sum([len(t) for t in self.fn]))
-        except ZeroDivisionError:
-            return 0.0
+        tp, fp, fn = self.counts().sum(axis=0).tolist()
+        return Evaluate._ratio(tp, fn)
 
     def micro_precision(self):
-        try:
-            return sum([len(t) for t in self.tp]) /  \
-                float(sum([len(t) for t in self.tp]) +
-                      sum([len(t) for t in self.fp]))
-        except ZeroDivisionError:
-            return 0.0
+        tp, fp, fn = self.counts().sum(axis=0).tolist()
+        return Evaluate._ratio(tp, fp)
 
     def _print_docs(self):
-        for i, doc_id in enumerate(self.doc_ids):
-            mp = Evaluate.precision(self.tp[i], self.fp[i])
-            mr = Evaluate.recall(self.tp[i], self.fn[i])
+        for doc_id, (tp, fp, fn) in zip(self.doc_ids,
+                                         self.counts().tolist()):
+            mp = Evaluate._ratio(tp, fp)
+            mr = Evaluate._ratio(tp, fn)
             str_fmt = "{:<25}{:<15}{:<15}{:<20}"
 
             print(str_fmt.format(doc_id,
                                  "Precision", "",
                                  "{:.4}".format(mp)))
 
-            print(str_fmt.format("[{}({}){}]".format(len(self.tp[i]) +
-                                                     len(self.fn[i]),
-                                                     len(self.tp[i]),
-                                                     len(self.tp[i]) +
-                                                     len(self.fp[i])),
+            print(str_fmt.format("[{}({}){}]".format(tp + fn, tp, tp + fp),
                                  "Recall",
                                  "",
                                  "{:.4}".format(mr)))
@@ -641,47 +830,169 @@ class Evaluate(object):
         mp = self.micro_precision()
         mr = self.micro_recall()
 
+        # The interval column is only printed once bootstrap() has been run,
+        # format() ignores the extra argument otherwise.
         str_fmt = "{:<35}{:<15}{:<20}"
+        rule = "{:-<35}{:-<15}{:-<20}".format("", "", "", "")
+        if self.intervals is None:
+            interval = lambda measure: ""
+            interval_header = ""
+        else:
+            str_fmt += "{:<20}"
+            rule += "-" * 20
+            interval = lambda measure: "[{:.4}, {:.4}]".format(
+                *self.intervals[measure])
+            interval_header = "{:.0%} CI".format(self.confidence)
 
         print(str_fmt.format(self.sys_id +
                              " ({})".format(len(self.doc_ids)),
-                             "Measure", "Micro (Primary)"))
+                             "Measure", "Micro (Primary)", interval_header))
 
-        print("{:-<35}{:-<15}{:-<20}".format("", "", "", ""))
+        print(rule)
 
         print(str_fmt.format("Total",
                              "Precision",
-                             "{:.4}".format(mp)))
+                             "{:.4}".format(mp),
+                             interval("precision")))
 
         print(str_fmt.format("",
                              "Recall",
-                             "{:.4}".format(mr)))
+                             "{:.4}".format(mr),
+                             interval("recall")))
 
         print(str_fmt.format("",
                              "F1",
-                             "{:.4}".format(Evaluate.F_beta(mr, mp))))
+                             "{:.4}".format(Evaluate.F_beta(mr, mp)),
+                             interval("F1")))
         print("\n")
 
+    def set_intervals(self, confidence, intervals, index=()):
+        """ Keep the intervals at index of the arrays returned by
+        resampling.bootstrap_intervals() for the report.
+        """
+        self.confidence = confidence
+        self.intervals = dict((measure, (float(lower[index]),
+                                         float(upper[index])))
+                              for measure, (lower, upper)
+                              in intervals.items())
+
+    def bootstrap(self, resamples=10000, confidence=0.95, seed=None):
+        """ Compute bootstrap confidence intervals of the micro precision,
+        recall and F1 over the documents, print_report() shows them from
+        then on.
+        """
+        if len(self.doc_ids) > 0:
+            self.set_intervals(confidence, bootstrap_intervals(
+                self.counts(), resamples=resamples, confidence=confidence,
+                seed=seed))
+
+    def document_record(self, index):
+        """ The counts and measures of the document at index in doc_ids. """
+        tp, fp, fn = self.counts()[index].tolist()
+        p = Evaluate._ratio(tp, fp)
+        r = Evaluate._ratio(tp, fn)
+        return {"record": "document",
+                "system": self.system_id,
+                "label": self.label,
+                "doc_id": self.doc_ids[index],
+                "tp": tp, "fp": fp, "fn": fn,
+                "precision": p, "recall": r, "F1": Evaluate.F_beta(p, r)}
+
+    def summary_record(self):
+        """ The summed counts, micro and macro measures and, once bootstrap()
+        has been run, confidence intervals of all documents.
+        """
+        tp, fp, fn = self.counts().sum(axis=0).tolist()
+        Mp, Mp_std = self.macro_precision()
+        Mr, Mr_std = self.macro_recall()
+        mp = self.micro_precision()
+        mr = self.micro_recall()
+        record = {"record": "summary",
+                  "system": self.system_id,
+                  "label": self.label,
+                  "documents": len(self.doc_ids),
+                  "tp": tp, "fp": fp, "fn": fn,
+                  "precision": mp, "recall": mr,
+                  "F1": Evaluate.F_beta(mr, mp),
+                  "macro_precision": float(Mp),
+                  "macro_precision_std": float(Mp_std),
+                  "macro_recall": float(Mr),
+                  "macro_recall_std": float(Mr_std)}
+
+        if self.intervals is not None:
+            record["confidence"] = self.confidence
+            for measure, (lower, upper) in self.intervals.items():
+                record[measure + "_lower"] = lower
+                record[measure + "_upper"] = upper
+        return record
+
+    def write_docs(self, writer):
+        for index in range(len(self.doc_ids)):
+            writer.write(self.document_record(index))
+
+    def write_report(self, writer, verbose=False):
+        """ Write the report to an output.ResultWriter instead of printing
+        it, with a record for each document if verbose.
+        """
+        if verbose:
+            self.write_docs(writer)
+
+        writer.write(self.summary_record())
+
     def print_docs(self):
         print("Report for {}:".format(self.sys_id))
         print("{:<35}{:<15}{:<20}".format("", "Measure", "Micro (Primary)"))
         print("{:-<35}{:-<15}{:-<20}".format("", "", ""))
         self._print_docs()
 
-    def print_report(self, verbose=False):
+    def print_errors(self):
+        """ List the false positives and false negatives of each document.
+        Nothing is listed for documents added by their counts only.
+        """
+        assert not self.counts_only, \
+            "No errors to list for {}, only counts were kept!".format(
+                self.sys_id)
+
+        print("Errors for {}:".format(self.sys_id))
+        for doc_id, fp, fn in zip(self.doc_ids, self.fp, self.fn):
+            for label, items in (("FP", fp), ("FN", fn)):
+                for item in sorted(items or [],
+                                   key=lambda t: (int(t.start), int(t.end))):
+                    print("{:<25}{:<5}{!r}".format(doc_id, label, item))
+        print("{:-<35}{:-<15}{:-<20}".format("", "", ""))
+
+    def print_report(self, verbose=False, errors=False):
         self.verbose = verbose
         if verbose:
             self.print_docs()
 
+        if errors:
+            self.print_errors()
+
         self._print_summary()
 
     def get_tagset(self, annotation):
         raise Exception("Must be implemented by Subclass!")
 
-    def validate_text(self, gold_text, system_text, doc_id):
-        assert gold_text == system_text, \
-            "Annotation text for document {}.xml differs!".format(doc_id)
+    @staticmethod
+    def validate_text(gold_sa, system_sa, doc_id):
+        """ Check that two StandoffAnnotations have the same text by their
+        text digests. The texts themselves are only compared to report the
+        offset of their first difference.
+        """
+        with profiler.stage("validate_text"):
+            assert gold_sa.text_digest == system_sa.text_digest, \
+                Evaluate.text_difference(gold_sa.text, system_sa.text, doc_id)
 
+    @staticmethod
+    def text_difference(gold_text, system_text, doc_id):
+        gold_text = gold_text or u""
+        system_text = system_text or u""
+        offset = len(os.path.commonprefix([gold_text, system_text]))
+        return "Annotation text for document {}.xml differs from offset {} " \
+            "on: gold {!r}, system {!r}".format(
+                doc_id, offset, gold_text[offset:offset + 20],
+                system_text[offset:offset + 20])
 
 
 class EvaluatePHI(Evaluate):
@@ -691,11 +1002,215 @@ class EvaluatePHI(Evaluate):
 
 class EvaluateTokenizedPHI(Evaluate):
     def get_tagset(self, annotation):
-        return [token for tag in annotation.get_phi()
-                for token in PHITokenSequence(
-                    annotation.text[int(tag.start):int(tag.end)],
-                    tag,
-                    start=int(tag.start))]
+        return [PHIToken.from_token(token, tag)
+                for tag in annotation.get_phi()
+                for token in annotation.span_tokens(int(tag.start),
+                                                    int(tag.end))]
+
+
+class EvaluationResult(Evaluate):
+    """ Evaluate subclass whose per document true positives, false positives
+    and false negatives are computed elsewhere (see PHITrackEvaluation) and
+    added one document at a time through add_document() or add_counts().
+    By default only the counts are kept.
+    """
+    def __init__(self, sys_id, counts_only=True):
+        self._reset(counts_only)
+        self.filters = []
+        self.invert = False
+        self.conjunctive = False
+        self.verbose = False
+        self.sys_id = sys_id
+        self.system_id = sys_id
+
+
+class SpanMatcher(object):
+    """ Matches gold and system annotations given as numpy arrays of
+    (name, TYPE, start, end) integer rows. Two rows match if they agree on
+    name, TYPE and start and their ends are no more than distance apart;
+    with distance=0 this is exact matching. Identical rows on the same side
+    are counted once, as they would be in a set.
+
+    Rows are paired one-to-one. Within a (name, TYPE, start) group gold rows
+    are taken in order of their end and paired with the first unpaired
+    system row within reach, which pairs as many rows as possible and does
+    not depend on the order the rows were given in.
+    """
+    @staticmethod
+    def rows(values):
+        return numpy.array(values, dtype=numpy.int64).reshape(-1, 4)
+
+    @staticmethod
+    def _keys(gold, system, distance):
+        """ Encode each row as a single int64 that sorts by (name, TYPE,
+        start, end) and keeps rows of different groups more than distance
+        apart.
+        """
+        rows = numpy.concatenate([gold, system])
+        order = numpy.lexsort(rows[:, ::-1].T)
+        ordered = rows[order, :3]
+
+        new_group = numpy.ones(len(rows), dtype=bool)
+        new_group[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+        groups = numpy.empty(len(rows), dtype=numpy.int64)
+        groups[order] = numpy.cumsum(new_group)
+
+        ends = rows[:, 3] - rows[:, 3].min()
+        keys = groups * (ends.max() + 2 * distance + 1) + ends + distance
+        return keys[:len(gold)], keys[len(gold):]
+
+    def match(self, gold, system, distance=0):
+        """ Returns (tp, fp, fn) arrays of row indices: the matched gold rows,
+        the unmatched system rows and the unmatched gold rows.
+        """
+        if len(gold) == 0 and len(system) == 0:
+            empty = numpy.array([], dtype=numpy.int64)
+            return empty, empty, empty
+
+        gold_keys, system_keys = self._keys(gold, system, distance)
+        gold_keys, gold_first = numpy.unique(gold_keys, return_index=True)
+        system_keys, system_first = numpy.unique(system_keys,
+                                                 return_index=True)
+
+        lo = numpy.searchsorted(system_keys, gold_keys - distance, "left")
+        hi = numpy.searchsorted(system_keys, gold_keys + distance, "right")
+        reach = numpy.flatnonzero(lo < hi)
+        picks = lo[reach]
+
+        # Two gold rows reaching for the same system row, pair greedily.
+        if len(picks) > 1 and (numpy.diff(picks) <= 0).any():
+            paired_gold, paired_system = [], []
+            last = -1
+            for i in reach:
+                j = max(lo[i], last + 1)
+                if j < hi[i]:
+                    paired_gold.append(i)
+                    paired_system.append(j)
+                    last = j
+            reach = numpy.array(paired_gold, dtype=numpy.int64)
+            picks = numpy.array(paired_system, dtype=numpy.int64)
+
+        gold_matched = numpy.zeros(len(gold_keys), dtype=bool)
+        gold_matched[reach] = True
+        system_matched = numpy.zeros(len(system_keys), dtype=bool)
+        system_matched[picks] = True
+
+        return (numpy.sort(gold_first[gold_matched]),
+                numpy.sort(system_first[~system_matched]),
+                numpy.sort(gold_first[~gold_matched]))
+
+
+class OverlapMatcher(object):
+    """ Matches gold and system rows, given as for SpanMatcher, that agree on
+    name and TYPE and whose spans share at least one character.
+
+    Rows are paired one-to-one so that as many of them as possible are
+    paired: gold rows are taken in order of their end and each is paired
+    with the unpaired overlapping system row that ends first, which no other
+    choice can improve on. System rows are kept in order of their end in a
+    _MinTree of their starts, so finding that row takes O(log m) and a
+    document O((n + m) log m) rather than comparing every pair of rows.
+    """
+    @staticmethod
+    def _spans(rows):
+        """ Returns the starts and ends of rows, shifted so that the spans of
+        rows with a different name or TYPE never overlap.
+        """
+        order = numpy.lexsort((rows[:, 1], rows[:, 0]))
+        ordered = rows[order, :2]
+
+        new_group = numpy.ones(len(rows), dtype=bool)
+        new_group[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+        groups = numpy.empty(len(rows), dtype=numpy.int64)
+        groups[order] = numpy.cumsum(new_group)
+
+        low = rows[:, 2:].min()
+        width = rows[:, 2:].max() - low + 1
+        return (groups * width + rows[:, 2] - low,
+                groups * width + rows[:, 3] - low)
+
+    def match(self, gold, system, distance=0):
+        """ Returns (tp, fp, fn) arrays of row indices like SpanMatcher.match().
+        distance is not used, any overlap counts.
+        """
+        if len(gold) == 0 and len(system) == 0:
+            empty = numpy.array([], dtype=numpy.int64)
+            return empty, empty, empty
+
+        # Identical rows on the same side are counted once
+        gold_keys, system_keys = SpanMatcher._keys(gold, system, 0)
+        gold_first = numpy.unique(gold_keys, return_index=True)[1]
+        system_first = numpy.unique(system_keys, return_index=True)[1]
+
+        starts, ends = self._spans(numpy.concatenate([gold[gold_first],
+                                                      system[system_first]]))
+        n = len(gold_first)
+        gold_starts, gold_ends = starts[:n], ends[:n]
+        by_end = numpy.lexsort((starts[n:], ends[n:]))
+        system_ends = ends[n:][by_end]
+        system_starts = _MinTree(starts[n:][by_end])
+
+        # System rows from lo[i] on end after gold row i starts, those of
+        # them starting before it ends overlap it
+        lo = numpy.searchsorted(system_ends, gold_starts, "right")
+        gold_matched = numpy.zeros(n, dtype=bool)
+        system_matched = numpy.zeros(len(system_first), dtype=bool)
+        for i in numpy.lexsort((gold_starts, gold_ends)):
+            j = system_starts.first_below(lo[i], gold_ends[i])
+            if j >= 0:
+                system_starts.remove(j)
+                gold_matched[i] = True
+                system_matched[by_end[j]] = True
+
+        return (numpy.sort(gold_first[gold_matched]),
+                numpy.sort(system_first[~system_matched]),
+                numpy.sort(gold_first[~gold_matched]))
+
+
+class _MinTree(object):
+    """ Segment tree over a list of integers that finds the first of them,
+    from a given index on, below a bound in O(log n). Removed values are
+    never found again.
+    """
+    def __init__(self, values):
+        self.size = 1
+        while self.size < len(values):
+            self.size *= 2
+        self.tree = [float("inf")] * (2 * self.size)
+        self.tree[self.size:self.size + len(values)] = [int(v) for v in values]
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = min(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def remove(self, index):
+        node = index + self.size
+        self.tree[node] = float("inf")
+        while node > 1:
+            node //= 2
+            self.tree[node] = min(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def first_below(self, lo, bound, node=1, node_lo=0, node_hi=None):
+        """ Returns the first index from lo on whose value is below bound, or
+        -1 if there is none.
+        """
+        if node_hi is None:
+            node_hi = self.size
+        if node_hi <= lo or self.tree[node] >= bound:
+            return -1
+        if node >= self.size:
+            return node - self.size
+        middle = (node_lo + node_hi) // 2
+        found = self.first_below(lo, bound, 2 * node, node_lo, middle)
+        if found < 0:
+            found = self.first_below(lo, bound, 2 * node + 1, middle, node_hi)
+        return found
+
+# A single sub-evaluation of the PHI track. 'mode' is one of 'strict',
+# 'relaxed', 'overlap' (any shared character, see OverlapMatcher) or 'binary'
+# (start/end only) and filters, conjunctive and invert
+# have the same meaning as the Evaluate keyword arguments.
+EvaluationConfiguration = namedtuple("EvaluationConfiguration",
+                                     ["label", "tokenized", "mode",
+                                      "filters", "conjunctive", "invert"])
 
 
 class CombinedEvaluation(object):
@@ -707,6 +1222,7 @@ class CombinedEvaluation(object):
         self.evaluations = []
 
     def add_eval(self, e, label=""):
+        e.label = label
         e.sys_id = e.sys_id
         e.sys_id += " " + label if e.sys_id and e.sys_id != '' else label
         self.evaluations.append(e)
@@ -715,12 +1231,29 @@ class CombinedEvaluation(object):
         for e in self.evaluations:
             e.print_docs()
 
-    def print_report(self, verbose=False):
+    def print_errors(self):
+        for e in self.evaluations:
+            e.print_errors()
+
+    def bootstrap(self, resamples=10000, confidence=0.95, seed=None):
+        for e in self.evaluations:
+            e.bootstrap(resamples=resamples, confidence=confidence, seed=seed)
+
+    def print_report(self, verbose=False, errors=False):
         for e in self.evaluations:
-            e.print_report(verbose=verbose)
+            e.print_report(verbose=verbose, errors=errors)
+
+    def write_report(self, writer, verbose=False):
+        for e in self.evaluations:
+            e.write_report(writer, verbose=verbose)
 
 
 class PHITrackEvaluation(CombinedEvaluation):
+    """ Runs every sub-evaluation of the PHI track (Strict, Relaxed, Token,
+    Binary, HIPAA and per tag name variants) in a single pass over the
+    documents. The tags of each document are read, tokenized and filtered
+    once and the results of every configuration are filled in from there.
+    """
 
     # list of Tuples of regular expressions for matching (TAG, TYPE)
     # That are considered to be HIPAA protected for the PHI Track evaluation
@@ -744,119 +1277,365 @@ class PHITrackEvaluation(CombinedEvaluation):
                      (re.compile("ID"), re.compile("IDNUM ")),
                      (re.compile("AGE"), re.compile(".*"))]
 
-    def __init__(self, annotator_cas, gold_cas, **kwargs):
-
+    # Number of characters the end offset may differ by in relaxed matching
+    relaxed_distance = 2
+
+    matcher = SpanMatcher()
+    overlap_matcher = OverlapMatcher()
+
+    def __init__(self, annotator_cas=None, gold_cas=None,
+                 filters=None, conjunctive=False, invert=False, sys_id=None,
+                 counts_only=True, gold_rows=None, writer=None, overlap=False):
+        """ Evaluate the annotator_cas against the gold_cas annotation id
+        indexed dicts. If both are left out an empty evaluation is created
+        for sys_id, documents can then be added one at a time with
+        add_document() and add_counts(). Unless counts_only is False only
+        the per document counts are kept, which print_errors() needs.
+
+        gold_rows is an optional dict, shared by evaluations of several
+        systems against the same gold annotations, in which the tag rows of
+        each gold document are kept so that they are built only once.
+
+        If an output.ResultWriter is given as writer, the records of each
+        document are written to it as soon as the document is added, see
+        write_report(). With overlap the Overlap configurations are added to
+        the report (see get_configurations()).
+        """
         super(PHITrackEvaluation, self).__init__()
 
-        # Tokenized Evaluation
-        self.add_eval(EvaluateTokenizedPHI(annotator_cas, gold_cas, **kwargs),
-                      label="Token")
-
-        # Basic Evaluation
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="Strict")
-
-        # Fuzzy Evaluation
-        PHITag.fuzzy_end_equality(2)
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="Relaxed")
-
-        # Add HIPAA filter to evaluation arguments
-        kwargs['filters'] = [PHITrackEvaluation.HIPAA_predicate_filter]
-
-        # Tokenized Evaluation
-        self.add_eval(EvaluateTokenizedPHI(annotator_cas, gold_cas, **kwargs),
-                      label="HIPPA Token")
-
-        # Change equality back to strict
-        PHITag.strict_equality()
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="HIPAA Strict")
+        if annotator_cas is not None:
+            assert len(set([a.sys_id for a in annotator_cas.values()])) == 1, \
+                "More than one annotator ID in this set of Annotations!"
 
-        # Change equality to fuzzy end
-        PHITag.fuzzy_end_equality(2)
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="HIPAA Relaxed")
+            sys_id = annotator_cas.values()[0].sys_id
 
-        # Change equality back to strict
-        PHITag.strict_equality()
-
-        # Remove HIPAA Filter for now
-        del kwargs['filters']
-
-        # New Request for Start-End only matching (could do
-        # this as a context manager) but we'll just hack it here
-        # Set key's to just start/end.
-
-        _PHI_keys = {}
-        for k, cls in PHITag.tag_types.items():
-            if k != "PHI":
-                _PHI_keys[k] = cls.key
-                cls.key = ['start', 'end']
-
-        # Big hack - PHIToken._get_key hardcodes what it returns
-        # Thats what I get for trying to do it quick and dirty
-        PHIToken._get_key = lambda s: (s.start, s.end)
-
-        # Tokenized Evaluation
-        self.add_eval(EvaluateTokenizedPHI(annotator_cas, gold_cas, **kwargs),
-                      label="Binary Token")
+        self.sys_id = sys_id
+        self.doc_ids = []
+        self.counts_only = counts_only
+        self.gold_rows = gold_rows
+        self.writer = writer
+        self.configurations = self.get_configurations(filters=filters,
+                                                      conjunctive=conjunctive,
+                                                      invert=invert,
+                                                      overlap=overlap)
+        for c in self.configurations:
+            self.add_eval(EvaluationResult(sys_id, counts_only=counts_only),
+                          label=c.label)
+
+        if annotator_cas is not None:
+            for doc_id in list(set(annotator_cas.keys()) &
+                               set(gold_cas.keys())):
+                self.add_document(doc_id, gold_cas[doc_id],
+                                  annotator_cas[doc_id])
 
-        # Basic Evaluation
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="Binary Strict")
+    @classmethod
+    def get_configurations(cls, filters=None, conjunctive=False, invert=False,
+                           overlap=False):
+        """ Returns the list of EvaluationConfiguration tuples making up the
+        PHI track report, in the order they are reported. filters,
+        conjunctive and invert are the user supplied filter arguments. With
+        overlap, Overlap and HIPAA Overlap follow the Relaxed configurations.
+        """
+        C = EvaluationConfiguration
+        hipaa = [cls.HIPAA_predicate_filter]
+
+        configurations = [
+            C("Token", True, "strict", filters, conjunctive, invert),
+            C("Strict", False, "strict", filters, conjunctive, invert),
+            C("Relaxed", False, "relaxed", filters, conjunctive, invert)]
+        if overlap:
+            configurations.append(
+                C("Overlap", False, "overlap", filters, conjunctive, invert))
+        configurations.extend([
+            C("HIPPA Token", True, "strict", hipaa, conjunctive, invert),
+            C("HIPAA Strict", False, "strict", hipaa, conjunctive, invert),
+            C("HIPAA Relaxed", False, "relaxed", hipaa, conjunctive, invert)])
+        if overlap:
+            configurations.append(
+                C("HIPAA Overlap", False, "overlap", hipaa, conjunctive,
+                  invert))
+        configurations.extend([
+            C("Binary Token", True, "binary", None, conjunctive, invert),
+            C("Binary Strict", False, "binary", None, conjunctive, invert),
+            C("Binary HIPPA Token", True, "binary", hipaa, conjunctive, invert),
+            C("Binary HIPAA Strict", False, "binary", hipaa, conjunctive,
+              invert)])
+
+        for name in PHITag.tag_types.keys():
+            if name != "PHI":
+                name_filter = cls.tag_name_filter(name)
+                configurations.extend([
+                    C("{} Token".format(name), True, "strict",
+                      [name_filter], conjunctive, invert),
+                    C("{} Strict".format(name), False, "strict",
+                      [name_filter], conjunctive, invert),
+                    # Make sure the tag has the name passed in as 'name' AND
+                    # passes HIPAA_predicate_filter
+                    C("{} HIPPA Token".format(name), True, "strict",
+                      [name_filter] + hipaa, True, invert),
+                    C("{} Binary HIPAA Strict".format(name), False, "strict",
+                      [name_filter] + hipaa, True, invert)])
+
+        return configurations
+
+    def add_document(self, doc_id, gold_sa, sys_sa):
+        Evaluate.validate_text(gold_sa, sys_sa, doc_id)
+
+        results = self.evaluate_document(gold_sa, sys_sa, doc_id)
+        if self.counts_only:
+            for e, (tp, fp, fn) in zip(self.evaluations, results):
+                e.add_counts(doc_id, len(tp), len(fp), len(fn))
+        else:
+            for e, (tp, fp, fn) in zip(self.evaluations, results):
+                e.add_document(doc_id, tp, fp, fn)
+        self.doc_ids.append(doc_id)
+        self._write_document()
+
+    def add_counts(self, doc_id, counts):
+        """ Add a document by its (tp, fp, fn) counts, one tuple for each
+        configuration, as returned by counts().
+        """
+        for e, (tp, fp, fn) in zip(self.evaluations, counts):
+            e.add_counts(doc_id, tp, fp, fn)
+        self.doc_ids.append(doc_id)
+        self._write_document()
+
+    def _write_document(self):
+        if self.writer is not None:
+            index = len(self.doc_ids) - 1
+            for e in self.evaluations:
+                self.writer.write(e.document_record(index))
+
+    def counts(self):
+        """ Returns a (documents, configurations, 3) integer array of the
+        (tp, fp, fn) counts of every configuration for each document in
+        doc_ids.
+        """
+        return numpy.array([e.counts() for e in self.evaluations]).transpose(
+            1, 0, 2)
 
-        # Add HIPAA filter to evaluation arguments
-        kwargs['filters'] = [PHITrackEvaluation.HIPAA_predicate_filter]
+    def bootstrap(self, resamples=10000, confidence=0.95, seed=None):
+        """ Bootstrap confidence intervals for every configuration at once,
+        all from the same document resamples.
+        """
+        if len(self.doc_ids) > 0:
+            with profiler.stage("bootstrap"):
+                intervals = bootstrap_intervals(self.counts(),
+                                                resamples=resamples,
+                                                confidence=confidence,
+                                                seed=seed)
+            for i, e in enumerate(self.evaluations):
+                e.set_intervals(confidence, intervals, i)
+
+    def print_report(self, verbose=False, errors=False):
+        for c, e in zip(self.configurations, self.evaluations):
+            with profiler.stage("report", c.label):
+                e.print_report(verbose=verbose, errors=errors)
+
+    def write_report(self, writer, verbose=False):
+        """ Like Evaluate.write_report(), document records already written
+        to writer as the documents were added are not written again.
+        """
+        verbose = verbose and writer is not self.writer
+        for c, e in zip(self.configurations, self.evaluations):
+            with profiler.stage("report", c.label):
+                e.write_report(writer, verbose=verbose)
+
+    def evaluate_document(self, gold_sa, sys_sa, doc_id=None):
+        """ Returns a (tp, fp, fn) tuple for each configuration in
+        self.configurations, of lists of tags or tokens or, with counts_only,
+        of arrays of their row indices.
+        """
+        if self.gold_rows is None or doc_id is None:
+            gold = _DocumentRows(gold_sa)
+        else:
+            gold = self.gold_rows.get(doc_id)
+            if gold is None or gold.annotation is not gold_sa:
+                gold = self.gold_rows[doc_id] = _DocumentRows(gold_sa)
+        system = _DocumentRows(sys_sa)
+
+        results = []
+        for c in self.configurations:
+            distance = self.relaxed_distance if c.mode == "relaxed" else 0
+            matcher = self.overlap_matcher if c.mode == "overlap" \
+                else self.matcher
+            with profiler.stage("tagsets", c.label):
+                gold_rows, gold_selected = gold.select(c)
+                system_rows, system_selected = system.select(c)
+            with profiler.stage("matching", c.label):
+                tp, fp, fn = matcher.match(gold_rows, system_rows,
+                                           distance=distance)
+                if not self.counts_only:
+                    tp = gold.items(c, gold_selected[tp])
+                    fp = system.items(c, system_selected[fp])
+                    fn = gold.items(c, gold_selected[fn])
+            results.append((tp, fp, fn))
+
+        return results
+
+    # One filter per tag name, so that the filter masks cached in
+    # _DocumentRows (keyed on the filters) are reused across evaluations
+    _name_filters = {}
 
-        # Tokenized Evaluation
-        self.add_eval(EvaluateTokenizedPHI(annotator_cas, gold_cas, **kwargs),
-                      label="Binary HIPPA Token")
+    @classmethod
+    def tag_name_filter(cls, name):
+        try:
+            return cls._name_filters[name]
+        except KeyError:
+            f = cls._name_filters[name] = Equals("name", name)
+            return f
 
-        # Change equality back to strict
-        PHITag.strict_equality()
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="Binary HIPAA Strict")
+    @staticmethod
+    def is_HIPAA(name, TYPE):
+        return any([n_re.match(name) and t_re.match(TYPE)
+                    for n_re, t_re in PHITrackEvaluation.HIPAA_regexes])
 
-        # Restore Class Keys
-        for k, cls in PHITag.tag_types.items():
-            if k != "PHI":
-                cls.key = _PHI_keys[k]
 
-        # restore dirty dirty hardcoded PHIToken hack
-        PHIToken._get_key = lambda s: (s.name, s.TYPE, s.start, s.end)
+# HIPAA membership only depends on the (name, TYPE) pair of a tag, so
+# is_HIPAA() is resolved once per pair into a lookup table rather than
+# matching HIPAA_regexes against every tag.
+PHITrackEvaluation.HIPAA_predicate_filter = PairLookup(
+    PHITrackEvaluation.is_HIPAA)
 
-        for t in PHITag.tag_types.keys():
-            if t != "PHI":
-                self.add_tag_name_specific_evaluations(t, annotator_cas, gold_cas, kwargs)
 
-    def add_tag_name_specific_evaluations(self, name, annotator_cas, gold_cas, kwargs):
-        kwargs['filters'] = [lambda tag: tag.name == name]
-        # Tokenized Evaluation
-        self.add_eval(EvaluateTokenizedPHI(annotator_cas, gold_cas, **kwargs),
-                      label="{} Token".format(name))
+class _DocumentRows(object):
+    """ The PHI tags of one StandoffAnnotation projected into the
+    (name, TYPE, start, end) rows consumed by SpanMatcher. Every projection
+    (tags or tokens, with or without name and TYPE) and every filter is
+    computed at most once per document no matter how many configurations
+    use it.
+    """
+    def __init__(self, annotation):
+        self.annotation = annotation
+        self.tags = annotation.get_phi()
+        self._columns = None
+        self._token_columns = None
+        self._projections = {}
+        self._filters = {}
+        self._masks = {}
+
+    def columns(self, tokenized=False):
+        """ Returns the TagColumns of the tags, or of the tokens of the tags
+        in projection order if tokenized.
+        """
+        if self._columns is None:
+            self._columns = TagColumns(self.tags)
+        if not tokenized:
+            return self._columns
+
+        if self._token_columns is None:
+            rows, owners, items = self.projection(True, False)
+            self._token_columns = self._columns.pieces(owners, rows[:, 2],
+                                                       rows[:, 3])
+        return self._token_columns
+
+    def projection(self, tokenized, binary):
+        """ Returns the rows of every tag (or of every token of every tag),
+        the index of the tag each row belongs to and the tag or token object
+        each row was made from. Binary rows leave out name and TYPE.
+        """
+        try:
+            return self._projections[(tokenized, binary)]
+        except KeyError:
+            pass
+
+        rows, owners, items = [], [], []
+        for i, tag in enumerate(self.tags):
+            if tokenized:
+                # Tokens compare name and TYPE as they were written
+                name = 0 if binary else PHITag.names.code(tag.name)
+                TYPE = 0 if binary else PHITag.types.code(tag.TYPE)
+                for t in self.annotation.span_tokens(int(tag.start),
+                                                     int(tag.end)):
+                    rows.append((name, TYPE, t.start, t.end))
+                    owners.append(i)
+                    items.append(t)
+            else:
+                if binary:
+                    rows.append((0, 0, int(tag.start), int(tag.end)))
+                else:
+                    rows.append((tag.name_code, tag.TYPE_code,
+                                 int(tag.start), int(tag.end)))
+                owners.append(i)
+                items.append(tag)
 
-        # Basic Evaluation
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="{} Strict".format(name))
+        projection = (SpanMatcher.rows(rows),
+                      numpy.array(owners, dtype=numpy.int64),
+                      items)
+        self._projections[(tokenized, binary)] = projection
+        return projection
 
-        # Add HIPAA filter to evaluation arguments
-        kwargs['filters'].extend([PHITrackEvaluation.HIPAA_predicate_filter])
+    @staticmethod
+    def filter_key(f):
+        # Compiled filters are cached by their expression rather than by
+        # identity, as they are compiled again for every server request
+        return repr(f) if isinstance(f, Filter) else f
+
+    def mask(self, filters, conjunctive, invert, tokenized=False):
+        """ Returns a boolean array, True for each tag (or each token of each
+        tag if tokenized) passing the filters as Evaluate would have applied
+        them. Tokens are filtered on their own offsets, like the PHITokens
+        of EvaluateTokenizedPHI.
+        """
+        columns = self.columns(tokenized)
+        if filters is None:
+            return numpy.ones(len(columns), dtype=bool)
 
-        # Make sure the tag has the name passed in as 'name'  AND passes HIPAA_predicate_filter
-        kwargs['conjunctive'] = True
+        keys = tuple((self.filter_key(f), tokenized) for f in filters)
+        spec = (keys, conjunctive, invert)
+        try:
+            return self._masks[spec]
+        except KeyError:
+            pass
+
+        for f, key in zip(filters, keys):
+            if key not in self._filters:
+                if hasattr(f, "mask"):
+                    # Compiled filters (see filters.py) work on all the tags
+                    # at once
+                    self._filters[key] = f.mask(columns)
+                else:
+                    if tokenized:
+                        rows, owners, items = self.projection(True, False)
+                        objects = [PHIToken.from_token(t, self.tags[o])
+                                   for t, o in zip(items, owners)]
+                    else:
+                        objects = self.tags
+                    self._filters[key] = numpy.array([bool(f(t))
+                                                      for t in objects],
+                                                     dtype=bool)
+
+        results = numpy.array([self._filters[key] for key in keys],
+                              dtype=bool).reshape(len(filters), len(columns))
+        if conjunctive:
+            mask = results.all(axis=0)
+        else:
+            mask = results.any(axis=0)
 
-        # Tokenized Evaluation
-        self.add_eval(EvaluateTokenizedPHI(annotator_cas, gold_cas, **kwargs),
-                      label="{} HIPPA Token".format(name))
+        if invert:
+            mask = ~mask
 
-        # Change equality back to strict
-        PHITag.strict_equality()
-        self.add_eval(EvaluatePHI(annotator_cas, gold_cas, **kwargs),
-                      label="{} Binary HIPAA Strict".format(name))
+        self._masks[spec] = mask
+        return mask
 
+    def select(self, c):
+        """ Returns the rows passing the filters of configuration c and their
+        indices in the projection of c (see items()).
+        """
+        rows, owners, items = self.projection(c.tokenized, c.mode == "binary")
+        if c.filters is None:
+            selected = numpy.arange(len(rows))
+        else:
+            selected = numpy.flatnonzero(
+                self.mask(c.filters, c.conjunctive, c.invert, c.tokenized))
+        return rows[selected], selected
 
-    @staticmethod
-    def HIPAA_predicate_filter(tag):
-        return any([n_re.match(tag.name) and t_re.match(tag.TYPE)
-                    for n_re, t_re in PHITrackEvaluation.HIPAA_regexes])
+    def items(self, c, indices):
+        """ Returns the tag or token objects of the projection rows of
+        configuration c at indices, tokens as PHITokens of their tag.
+        """
+        rows, owners, items = self.projection(c.tokenized, c.mode == "binary")
+        if c.tokenized:
+            return [PHIToken.from_token(items[i], self.tags[owners[i]])
+                    for i in indices]
+        return [items[i] for i in indices]
@@ -31,11 +31,73 @@
 # may also be directories in which case all files in SYSTEM will be compared
 # to files the GOLD directory based on their file names. File names MUST be of
 # the form: XXX-YY.xml where XXX is the patient id,  and YY is the document id.
+# Directories may also be given as .zip, .tar or .tar.gz archives, for both
+# tracks; their XML members are read without extracting them. --stream,
+# --incremental and --watch only read directories.
 # See the README.md file for more details.
 #
 # Basic Flags:
 # -v, --verbose :: Print document by document P/R/F1 for each document instead
 #                  of summary statistics for an entire set of documents.
+# -j, --jobs N :: Parse the GOLD and SYSTEM documents using N worker processes.
+#                 The report is identical to the one produced with a single
+#                 process.
+# --cache-dir DIR :: Keep parsed documents in DIR so that later runs over the
+#                    same files do not parse their XML again. Entries are
+#                    checked against the size and content of each file.
+# --cache-size MB :: Size limit of --cache-dir, least recently used entries are
+#                    removed once it is exceeded (default 1024).
+# --errors :: List the false positives and false negatives of each document in
+#             every report.
+# --incremental STATE :: Keep the per document scores of each run in the STATE
+#                        file and only parse and score again the documents
+#                        whose gold or system file has changed since.
+# --watch :: Keep running and print the report again whenever a GOLD or SYSTEM
+#            file changes, only parsing and scoring the changed documents.
+#            Combines with --incremental to also keep the scores in STATE.
+# --poll-interval SECONDS :: How often --watch looks for changes (default 1).
+# --overlap :: Add Overlap and HIPAA Overlap P/R/F1 to the report, where a
+#              system tag counts as found if it shares a character with a gold
+#              tag of the same name and TYPE. Tags are paired one-to-one.
+# --stream :: Parse, score and drop one gold and system document pair at a
+#             time, keeping only their counts, so that memory use does not
+#             grow with the size of the corpus. The report is the same.
+# --shard INDEX/COUNT :: Only score the documents whose id hashes to shard
+#                        INDEX out of COUNT (see partial.py).
+# --manifest FILE :: Only score the documents listed in FILE, one file name or
+#                    document id per line.
+# --partial FILE :: Save the per document counts to FILE instead of printing a
+#                   report. The partial results of shards covering the whole
+#                   corpus are combined by the merge command:
+#
+# $> python evaluate.py merge [-v] [--format FORMAT] [--bootstrap N] PARTIAL...
+#
+#                   which prints the report a single run would have printed.
+# --leaderboard :: Score every SYSTEM directory given on the command line
+#                  against GOLD and print a table of the systems ranked by
+#                  micro F1. GOLD is only parsed once, with -j the systems
+#                  are scored in parallel.
+# --rank-by LABEL :: Configuration whose micro F1 ranks the leaderboard
+#                    (default "Strict").
+# --significance :: Compare exactly two SYSTEM directories with a paired
+#                   approximate randomization test and print the micro F1 of
+#                   both and the p-value of their difference for each
+#                   sub-evaluation.
+# --permutations N :: Number of permutations of --significance (default
+#                     10000).
+# --bootstrap N :: Add bootstrap confidence intervals of the micro measures to
+#                  each report, computed from N resamples of the documents.
+# --confidence LEVEL :: Confidence level of the intervals (default 0.95).
+# --seed SEED :: Random seed of --bootstrap and --significance, for repeatable
+#                results.
+# --format FORMAT :: Write the report as json, jsonl or csv records instead of
+#                    text (see output.py). With -v a record is written for
+#                    each document as soon as it is scored. Warnings go to
+#                    stderr. Also available for track2.
+# --profile FILE :: Write the wall time, number of calls and peak memory of
+#                   each stage of the run (loading, xml parsing, tokenization,
+#                   matching, report, ...) overall and per sub-evaluation to
+#                   FILE as JSON. Also available for track2.
 #
 # Basic Examples:
 #
@@ -56,142 +118,295 @@
 #
 # Advanced Flags:
 #
-# --filter [TAG ATTRIBUTES] :: run P/R/F1 measures in either summary or verbose
-#                              mode (see -v) for the list of attributes defined
-#                              by TAG ATTRIBUTES. This may be a comma separated
-#                              list of tag names and attribute values. For more
-#                              see Advanced Examples.
+# --filter [EXPRESSIONS] :: run P/R/F1 measures in either summary or verbose
+#                           mode (see -v) for the tags selected by EXPRESSIONS.
+#                           This may be a comma separated list of filter
+#                           expressions over tag names, TYPE values and
+#                           offsets, combined with AND, OR, NOT and
+#                           parentheses (see filters.py). For more see
+#                           Advanced Examples.
 # --conjunctive :: If multiple values are passed to filter as a comma separated
 #                  list, treat them as a series of AND based filters instead of
 #                  a series of OR based filters
-# --invert :: run P/R/F1 on the inverted set of tags defined by TAG ATTRIBUTES
+# --invert :: run P/R/F1 on the inverted set of tags defined by EXPRESSIONS
 #             in the --filter tag (see --filter).
 #
 # Advanced Examples:
 #
-# $> python evaluate.py cr --filter MEDICATION gold/ system/
+# $> python evaluate.py track1 --filter LOCATION gold/ system/
 #
 #   Evaluate system output in system/ folder against gold/ folder considering
-# only MEDICATION tags
+# only LOCATION tags
 #
-# $> python evaluate.py cr --filter CAD,OBESE gold/ system/
+# $> python evaluate.py track1 --filter LOCATION,DATE gold/ system/
 #
 #   Evaluate system output in system/ folder against gold/ folder considering
-# only CAD or OBESE tags. Comma separated lists to the --filter flag are con-
-# joined via OR.
+# only LOCATION or DATE tags. Comma separated lists to the --filter flag are
+# conjoined via OR.
 #
-# $> python evaluate.py cr --filter "CAD,before DCT" gold/ system/
+# $> python evaluate.py track1 --conjunctive --filter "LOCATION,CITY" \
+#                              gold/ system/
 #
 #   Evaluate system output in system/ folder against gold/ folder considering
-# only CAD *OR* tags with a time attribute of before DCT. This is probably
-# not what you want when filtering, see the next example
+# LOCATION tags *AND* tags with a CITY TYPE, the same as --filter LOCATION/CITY
 #
-# $> python evaluate.py cr --conjunctive \
-#                          --filter "CAD,before DCT" gold/ system/
+# $> python evaluate.py track1 --filter "(NAME OR ID) AND NOT start < 100" \
+#                              gold/ system/
 #
 #   Evaluate system output in system/ folder against gold/ folder considering
-# CAD tags *AND* tags with a time attribute of before DCT.
-#
-# $> python evaluate.py cr --invert \
-#                          --filter MEDICATION gold/ system/
-#
-#  Evaluate system output in system/ folder against gold/ folder considering
-# any tag which is NOT a MEDICATION tag.
+# NAME and ID tags that do not start in the first 100 characters.
 #
-# $> python evaluate.py cr --invert \
-#                          --conjunctive \
-#                          --filter "CAD,before DCT" gold/ system/
+# $> python evaluate.py track1 --invert --filter LOCATION gold/ system/
 #
 #  Evaluate system output in system/ folder against gold/ folder considering
-# any tag which is NOT CAD and with a time attribute of 'before DCT'
+# any tag which is NOT a LOCATION tag.
 
 
 import argparse
 from collections import defaultdict
+from contextlib import contextmanager
 import glob
+from io import BytesIO
+import itertools
+import json
+import multiprocessing
 import os
+import sys
+import time
+from StringIO import StringIO
 import xml.etree.cElementTree as etree
 import warnings
 
 import numpy as np
 from scipy.stats import wilcoxon
 
+from archives import archive_members
+from archives import is_archive
+from archives import parse_member
+from cache import AnnotationCache
 from classes import StandoffAnnotation
 from classes import Evaluate
 from classes import CombinedEvaluation
 from classes import PHITrackEvaluation
+from filters import compile_filter
+from filters import FilterError
+from incremental import EvaluationState
+from incremental import same_file
+from instrument import profiler
+from output import FORMATS
+from output import get_writer
+from partial import PartialResult
+from partial import read_manifest
+from partial import shard_of
+from resampling import randomization_test
 from tags import PHITag
 
 
-# This function is 'exterimental' as in it works for my use cases
-# But is not generally well documented or a part of the expected
-# workflow.
-def get_predicate_function(arg, tag):
-    """ This function takes a tag attribute value, determines the attribute(s)
-    of the class(es) this value belongs to,  and then returns a predicate
-    function that returns true if this value is set for the  calculated
-    attribute(s) on the class(es). This allows for overlap - ie. "ACE
-    Inhibitor" is a valid type1 and a valid type2 attribute value.  If arg
-    equals "ACE Inhibitor" our returned predicate function will return true if
-    our tag has "ACE Inhibitor" set for either type1 or type2 attributes.
-    Currently this is implemented to ONLY work with MEDICAL_TAG_CLASSES but
-    could be easily extended to work with PHI tag classes.
+def get_predicate_function(arg, tag=PHITag):
+    """ Compile the filter expression arg (see filters.py) over tags of the
+    tag class into a predicate. The predicate can be called on single tags
+    and PHITrackEvaluation applies it to whole documents at once through its
+    mask() method. Raises filters.FilterError if arg is not a valid
+    expression.
     """
-    attrs = []
+    return compile_filter(arg, tag)
 
-    # Get a list of valid attributes for this argument
-    # If we have a tag name (ie. MEDICATION) add 'name' to the attributes
-    if arg in tag.tag_types.keys():
-        attrs.append("name")
-    else:
-        tag_attributes = ["valid_type1", "valid_type2", "valid_indicator",
-                          "valid_status", "valid_time", "valid_type"]
-        for cls in MEDICAL_TAG_CLASSES:
-            for attr in tag_attributes:
-                try:
-                    if arg in getattr(cls, attr):
-                        # add the attribute,  strip out the "valid_" prefix
-                        # This assumes that classes follow the
-                        # valid_ATTRIBUTE convention
-                        # and will break if they are extended
-                        attrs.append(attr.replace("valid_", ""))
-                except AttributeError:
-                    continue
-        # Delete these so we don't end up carrying around
-        # references in our function
+
+def load_annotation(file_name, cache=None):
+    """Returns the StandoffAnnotation for file_name, going through cache (an
+    AnnotationCache) if one is given."""
+    if cache is None:
+        return StandoffAnnotation(file_name)
+    return cache.load(file_name)
+
+
+class WorkerError(Exception):
+    """Raised in place of an exception of a worker process, naming what the
+    worker was busy with. Exceptions like lxml's XMLSyntaxError cannot be
+    pickled back to the parent process, which then waits forever.
+    """
+    pass
+
+
+def worker_error(what):
+    """Returns a WorkerError for the exception being handled, raised while
+    working on what (a file name, document id, ...)."""
+    exc_type, exc = sys.exc_info()[:2]
+    return WorkerError("{}: {}: {}".format(what, exc_type.__name__, exc))
+
+
+@contextmanager
+def worker_pool(jobs, initializer=None, initargs=()):
+    """Context manager of a pool of jobs worker processes, each started by
+    calling initializer(*initargs). The pool is closed and joined when the
+    block completes and terminated if it raises, say because a worker did,
+    as the remaining workers may never finish their tasks. With jobs of one
+    or less no pool is started: initializer is called in this process and
+    None is given to the block instead.
+    """
+    if jobs is None or jobs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield None
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer, initargs)
+    try:
+        yield pool
+    except BaseException:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+
+
+def _parse_chunk(args):
+    """Parse a chunk of files into StandoffAnnotation objects inside a worker
+    process. Anything printed while parsing (e.g. attribute warnings) is
+    captured and returned alongside each annotation so the parent process can
+    replay it in the same order a sequential run would have printed it.
+    Raises a WorkerError naming the file if one cannot be parsed.
+    """
+    file_names, cache = args
+    parsed = []
+    stdout = sys.stdout
+    try:
+        for fn in file_names:
+            sys.stdout = StringIO()
+            try:
+                sa = load_annotation(fn, cache)
+            except Exception:
+                raise worker_error(fn)
+            parsed.append((sa, sys.stdout.getvalue()))
+    finally:
+        sys.stdout = stdout
+
+    return parsed
+
+
+def chunk_files(file_names, jobs, chunks_per_job=4):
+    """Split file_names into contiguous chunks of roughly equal size in bytes.
+    Each worker receives about chunks_per_job chunks, which keeps the workers
+    busy when document sizes vary while amortising the cost of shipping
+    results back to the parent process over many small files.
+    """
+    sizes = [os.path.getsize(fn) for fn in file_names]
+    n_chunks = max(1, min(len(file_names), jobs * chunks_per_job))
+    target = sum(sizes) / float(n_chunks)
+
+    chunks = [[]]
+    chunk_size = 0
+    for fn, size in zip(file_names, sizes):
+        if chunks[-1] and chunk_size + size > target and \
+           len(chunks) < n_chunks:
+            chunks.append([])
+            chunk_size = 0
+        chunks[-1].append(fn)
+        chunk_size += size
+
+    return chunks
+
+
+def load_annotations(file_names, jobs=1, cache=None):
+    """Returns a list of StandoffAnnotation objects, one for each file in
+    file_names and in the same order. If jobs is greater than one the files
+    are parsed in a pool of that many worker processes. If cache (an
+    AnnotationCache) is given, files are loaded through it.
+    """
+    with profiler.stage("loading"):
+        if jobs is None or jobs <= 1 or len(file_names) < 2:
+            annotations = [load_annotation(fn, cache) for fn in file_names]
+
+        else:
+            with worker_pool(min(jobs, len(file_names))) as pool:
+                results = pool.map(_parse_chunk,
+                                   [(chunk, cache) for chunk in
+                                    chunk_files(file_names, jobs)],
+                                   chunksize=1)
+
+            annotations = []
+            for chunk in results:
+                for sa, output in chunk:
+                    sys.stdout.write(output)
+                    annotations.append(sa)
+
+        if cache is not None:
+            cache.evict()
+
+    return annotations
+
+
+def _parse_member(member):
+    """Parse a (name, content) archive member inside a worker process,
+    returning the annotation and anything printed while parsing it like
+    _parse_chunk() does.
+    """
+    stdout = sys.stdout
+    try:
+        sys.stdout = StringIO()
         try:
-            del tag_attributes
-            del cls
-            del attr
-        except NameError:
-            pass
-
-    attrs = list(set(attrs))
-
-    if len(attrs) == 0:
-        print("WARNING: could not find valid class attribute for " +
-              "\"{}\", + skipping.".format(arg))
-        return lambda t: True
-
-    # Define the predicate function we will use. artrs are scoped into
-    # the closure,  which is sort of the whole point of the
-    # get_predicate_function function.
-    def matchp(t):
-        for attr in attrs:
-            if attr == "name" and t.name == arg:
-                return True
-            else:
-                try:
-                    if getattr(t, attr).lower() == arg.lower():
-                        return True
-                except (AttributeError, KeyError):
-                    pass
-        return False
+            sa = parse_member(*member)
+        except Exception:
+            raise worker_error(member[0])
+        return sa, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def load_archive(path, jobs=1, select=None):
+    """Returns a list of StandoffAnnotation objects, one for each XML document
+    in the archive at path (see archives.py) in the order they are stored.
+    Members are parsed as they are read, without extracting the archive. If
+    jobs is greater than one they are parsed in a pool of that many worker
+    processes. Archive members do not go through the parse cache. select is
+    an optional predicate on member names, only the members it is true for
+    are parsed.
+    """
+    members = (m for m in archive_members(path)
+               if select is None or select(m[0]))
+    with profiler.stage("loading"):
+        if jobs is None or jobs <= 1:
+            return [parse_member(*member) for member in members]
+
+        annotations = []
+        with worker_pool(jobs) as pool:
+            for sa, output in pool.imap(_parse_member, members,
+                                        chunksize=16):
+                sys.stdout.write(output)
+                annotations.append(sa)
+
+    return annotations
+
+
+def is_corpus(path):
+    """Whether path is a directory of documents or an archive of them."""
+    return os.path.isdir(path) or is_archive(path)
+
+
+def corpus_names(path):
+    """Returns the names of the files load_corpus() reads from path, in the
+    order it reads them.
+    """
+    if is_archive(path):
+        return [name for name, _ in archive_members(path)]
+    return os.listdir(path)
 
-    return matchp
+
+def load_corpus(path, jobs=1, cache=None, select=None):
+    """Returns the StandoffAnnotation of every file in the directory path, or
+    of every XML document if path is an archive. select is an optional
+    predicate on file names, only the files it is true for are read.
+    """
+    if is_archive(path):
+        return load_archive(path, jobs=jobs, select=select)
+    return load_annotations([path + fn for fn in os.listdir(path)
+                             if select is None or select(fn)],
+                            jobs=jobs, cache=cache)
 
 
-def get_document_dict_by_system_id(system_dirs):
+def get_document_dict_by_system_id(system_dirs, jobs=1, cache=None,
+                                   select=None):
     """Takes a list of directories and returns all of the StandoffAnnotation's
     as a system id, annotation id indexed dictionary. System id (or
     StandoffAnnotation.sys_id) is whatever values trail the XXX-YY file id.
@@ -202,18 +417,51 @@ def get_document_dict_by_system_id(system_dirs):
        system id:    foo
 
     In the case where there is nothing trailing the document id,  the sys_id
-    is the empty string ('').
+    is the empty string ('').  If jobs is greater than one documents are parsed
+    in parallel, cache is an optional AnnotationCache (see
+    load_annotations()). system_dirs may also hold archives (see
+    load_archive()). select is an optional predicate on file names, only the
+    files it is true for are read.
     """
     documents = defaultdict(lambda: defaultdict(int))
 
+    # Only look at xml files
+    file_names = [d + fn for d in system_dirs if not is_archive(d)
+                  for fn in os.listdir(d) if fn.endswith("xml") and
+                  (select is None or select(fn))]
+
+    annotations = load_annotations(file_names, jobs=jobs, cache=cache)
+    for d in system_dirs:
+        if is_archive(d):
+            annotations.extend(load_archive(d, jobs=jobs, select=select))
+
+    for sa in annotations:
+        documents[sa.sys_id][sa.id] = sa
+
+    return documents
+
+
+def get_file_ids(file_name):
+    """Returns the (sys_id, id) a StandoffAnnotation read from file_name would
+    have, without reading the file."""
+    sa = StandoffAnnotation()
+    sa.parse_file_name(file_name)
+    return sa.sys_id, sa.id
+
+
+def get_file_dict_by_system_id(system_dirs):
+    """Like get_document_dict_by_system_id() but returns the file names of
+    the documents instead of parsing them."""
+    files = defaultdict(dict)
+
     for d in system_dirs:
         for fn in os.listdir(d):
             # Only look at xml files
             if fn.endswith("xml"):
-                sa = StandoffAnnotation(d + fn)
-                documents[sa.sys_id][sa.id] = sa
+                sys_id, doc_id = get_file_ids(d + fn)
+                files[sys_id][doc_id] = d + fn
 
-    return documents
+    return files
 
 
 def evaluate(system, gs, eval_class, **kwargs):
@@ -221,8 +469,10 @@ def evaluate(system, gs, eval_class, **kwargs):
     EvaluateCardiacRisk classes) with an annotation id indexed dict of
     StandoffAnnotation classes for the system(s) and the gold standard outputs.
     'system' will be a list containing either one file,  or one or more
-    directories. 'gs' will be a file or a directory.  This function mostly just
-    handles formatting arguments for the eval_class.
+    directories. 'gs' will be a file or a directory.  Directories may also be
+    .zip, .tar or .tar.gz archives, which are read without being extracted.
+    This function mostly just handles formatting arguments for the
+    eval_class.
     """
     assert issubclass(eval_class, Evaluate) or \
         issubclass(eval_class, CombinedEvaluation), \
@@ -240,6 +490,28 @@ def evaluate(system, gs, eval_class, **kwargs):
     except KeyError:
         verbose = False
 
+    jobs = kwargs.pop('jobs', 1)
+    cache = kwargs.pop('cache', None)
+    # Only score the documents whose file names select is true for
+    select = kwargs.pop('select', None)
+
+    bootstrap = kwargs.pop('bootstrap', 0)
+    confidence = kwargs.pop('confidence', 0.95)
+    seed = kwargs.pop('seed', None)
+
+    # Listing errors needs the tags themselves, not just their counts
+    errors = kwargs.pop('errors', False)
+    if errors:
+        kwargs['counts_only'] = False
+
+    # With an output.ResultWriter the report is written to it rather than
+    # printed. In verbose runs PHITrackEvaluation writes the records of each
+    # document as soon as it is scored.
+    writer = kwargs.pop('writer', None)
+    if writer is not None and verbose and \
+       issubclass(eval_class, PHITrackEvaluation):
+        kwargs['writer'] = writer
+
     assert os.path.exists(gs), "{} does not exist!".format(gs)
 
     for s in system:
@@ -247,11 +519,18 @@ def evaluate(system, gs, eval_class, **kwargs):
 
 
     # Handle if two files were passed on the command line
-    if os.path.isfile(system[0]) and os.path.isfile(gs):
+    if os.path.isfile(system[0]) and os.path.isfile(gs) and \
+       not is_archive(system[0]) and not is_archive(gs):
         gs = StandoffAnnotation(gs)
         s = StandoffAnnotation(system[0])
-        e = eval_class({s.id: s}, {gs.id: gs}, **kwargs)
-        e.print_docs()
+        with profiler.stage("evaluation"):
+            e = eval_class({s.id: s}, {gs.id: gs}, **kwargs)
+        if writer is not None:
+            e.write_report(writer, verbose=True)
+        else:
+            e.print_docs()
+            if errors:
+                e.print_errors()
         evaluations.append(e)
 
     # Handle the case where 'gs' is a directory and 'system' is a
@@ -261,15 +540,22 @@ def evaluate(system, gs, eval_class, **kwargs):
     # for each system output. useful for annotator agreement and final system
     # evaluations. Error checking to ensure consistent files in each directory
     # will be handled by the evaluation class.
-    elif all([os.path.isdir(s) for s in system]) and os.path.isdir(gs):
+    elif all([is_corpus(s) for s in system]) and is_corpus(gs):
         # Get a dict of gold standoff annotation indexed by id
-        for fn in os.listdir(gs):
-            sa = StandoffAnnotation(gs + fn)
+        for sa in load_corpus(gs, jobs=jobs, cache=cache, select=select):
             gold_sa[sa.id] = sa
 
-        for s_id, system_sa in get_document_dict_by_system_id(system).items():
-            e = eval_class(system_sa, gold_sa, **kwargs)
-            e.print_report(verbose=verbose)
+        for s_id, system_sa in get_document_dict_by_system_id(
+                system, jobs=jobs, cache=cache, select=select).items():
+            with profiler.stage("evaluation"):
+                e = eval_class(system_sa, gold_sa, **kwargs)
+            if bootstrap:
+                e.bootstrap(resamples=bootstrap, confidence=confidence,
+                            seed=seed)
+            if writer is not None:
+                e.write_report(writer, verbose=verbose)
+            else:
+                e.print_report(verbose=verbose, errors=errors)
             evaluations.append(e)
 
     else:
@@ -279,29 +565,650 @@ def evaluate(system, gs, eval_class, **kwargs):
     return evaluations[0] if len(evaluations) == 1 else evaluations
 
 
-def evaluate_rdoc(gold_fld, syst_fld, verbose=False):
-    """Evaluates the system's predictions wrt the gold ones.
+def evaluate_partial(system, gs, partial_file, select=None, shard=None,
+                     filter_spec=None, jobs=1, cache=None, **kwargs):
+    """Score the documents of the 'system' list of directories whose file
+    names select is true for against the 'gs' directory, like evaluate()
+    does, and save the per document counts to partial_file as a
+    partial.PartialResult instead of printing a report. shard describes
+    select and filter_spec the filters passed in kwargs (ie. the --shard or
+    --manifest and the --filter arguments). See evaluate_merge().
+    """
+    assert is_corpus(gs), \
+        "{} is neither a directory nor an archive!".format(gs)
+    for s in system:
+        assert is_corpus(s), \
+            "{} is neither a directory nor an archive!".format(s)
+
+    # Every document id in the order evaluate() reads them, system
+    # directories before system archives
+    gold_ids = [get_file_ids(fn)[1] for fn in corpus_names(gs)]
+    system_ids = [get_file_ids(fn) for d in system if not is_archive(d)
+                  for fn in os.listdir(d) if fn.endswith("xml")]
+    system_ids.extend(get_file_ids(fn) for d in system if is_archive(d)
+                      for fn in corpus_names(d))
 
-    Both sources must be in a separate folder.
+    options = {"filter": filter_spec,
+               "conjunctive": kwargs.get("conjunctive", False),
+               "invert": kwargs.get("invert", False),
+               "overlap": kwargs.get("overlap", False)}
+    partial = PartialResult(options,
+                            incremental_configuration(filter_spec, **kwargs),
+                            gold_ids, system_ids, shard)
+
+    gold_sa = {}
+    for sa in load_corpus(gs, jobs=jobs, cache=cache, select=select):
+        gold_sa[sa.id] = sa
+
+    gold_rows = {}
+    for s_id, system_sa in get_document_dict_by_system_id(
+            system, jobs=jobs, cache=cache, select=select).items():
+        with profiler.stage("evaluation"):
+            e = PHITrackEvaluation(system_sa, gold_sa, gold_rows=gold_rows,
+                                   **kwargs)
+        partial.add(s_id, e.doc_ids, e.counts())
+
+    partial.save(partial_file)
+    return partial
+
+
+def evaluate_merge(partial_files, verbose=False, bootstrap=0,
+                   confidence=0.95, seed=None, writer=None):
+    """Print the report of the partial results in partial_files, written by
+    evaluate_partial() for shards that together cover the whole corpus.
+    The report is the one evaluate() prints for the whole corpus with the
+    same options. bootstrap, confidence and seed are passed on to
+    PHITrackEvaluation.bootstrap() if bootstrap is not 0. With an
+    output.ResultWriter as writer the report is written to it instead of
+    being printed. Returns the PHITrackEvaluation of each system.
     """
+    with profiler.stage("loading"):
+        partial = PartialResult.merge([PartialResult.load(fn)
+                                       for fn in partial_files])
 
-    wrong_severity_value = Exception('Unexpected severity value')
-    diff_folders_content = Exception('Folders must contain the same XML files')
-    level2score = {'ABSENT': 0, 'MILD': 1, 'MODERATE': 2, 'SEVERE': 3}
-    score2level = {a: b for b, a in level2score.items()}
+    options = partial.options
+    kwargs = dict(conjunctive=options["conjunctive"],
+                  invert=options["invert"],
+                  overlap=options["overlap"])
+    if options["filter"]:
+        kwargs["filters"] = [get_predicate_function(a, PHITag)
+                             for a in options["filter"].split(",")]
+    assert json.loads(json.dumps(incremental_configuration(
+        options["filter"], **kwargs))) == partial.configuration, \
+        "The partial results were scored with another version of evaluate.py!"
 
-    def get_prediction(file_path):
-        """It returns the positive valence severity score from an XML document.
-        """
-        source = etree.parse(file_path)
-        score = source.findall('./TAGS/POSITIVE_VALENCE')[0].attrib['score']
-        score = score.upper().strip()
-        if score in level2score.keys():
-            return level2score[score]
+    # Build the same dicts evaluate() does, so that documents are added in
+    # the same order
+    gold_sa = {}
+    for doc_id in partial.gold_ids:
+        gold_sa[doc_id] = None
+    documents = defaultdict(lambda: defaultdict(int))
+    for s_id, doc_id in partial.system_ids:
+        documents[s_id][doc_id] = None
+
+    evaluations = []
+    for s_id, system_sa in documents.items():
+        e = PHITrackEvaluation(sys_id=s_id,
+                               writer=writer if verbose else None, **kwargs)
+        with profiler.stage("evaluation"):
+            for doc_id in list(set(system_sa.keys()) & set(gold_sa.keys())):
+                e.add_counts(doc_id, partial.counts(s_id, doc_id))
+        if bootstrap:
+            e.bootstrap(resamples=bootstrap, confidence=confidence, seed=seed)
+        if writer is not None:
+            e.write_report(writer, verbose=verbose)
+        else:
+            e.print_report(verbose=verbose)
+        evaluations.append(e)
+
+    return evaluations[0] if len(evaluations) == 1 else evaluations
+
+
+# Evaluation keyword arguments and cache of the streaming worker processes,
+# set by _init_stream_worker()
+_stream = {}
+
+
+def _init_stream_worker(kwargs, cache):
+    _stream.update(evaluation=PHITrackEvaluation(sys_id="", **kwargs),
+                   cache=cache)
+
+
+def _score_pair(pair):
+    """Parse and score one (doc_id, gold file, system file) document pair.
+    Returns the doc_id, the (tp, fp, fn) counts of every configuration and
+    everything printed while loading the documents. Both documents are
+    dropped as soon as they are scored. Raises a WorkerError naming doc_id
+    if the pair cannot be scored.
+    """
+    doc_id, gold_file, system_file = pair
+    stdout = sys.stdout
+    try:
+        sys.stdout = StringIO()
+        try:
+            gold_sa = load_annotation(gold_file, _stream["cache"])
+            system_sa = load_annotation(system_file, _stream["cache"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        Evaluate.validate_text(gold_sa, system_sa, doc_id)
+        counts = [(len(tp), len(fp), len(fn)) for tp, fp, fn in
+                  _stream["evaluation"].evaluate_document(gold_sa, system_sa)]
+    except Exception:
+        raise worker_error("Document {}".format(doc_id))
+
+    return doc_id, counts, output
+
+
+def evaluate_stream(system, gs, verbose=False, jobs=1, cache=None,
+                    bootstrap=0, confidence=0.95, seed=None, writer=None,
+                    select=None, **kwargs):
+    """Print the report evaluate() prints for the 'system' list of
+    directories against the 'gs' directory, holding no more than one pair of
+    documents in memory at a time. Gold and system files are paired by id
+    from the directory listings; each pair is then parsed, scored and
+    dropped, and only its counts are kept. With jobs greater than one the
+    pairs are parsed and scored in a pool of that many worker processes.
+    select is an optional predicate on file names, as for evaluate().
+    Returns the PHITrackEvaluation of each system.
+    """
+    assert os.path.isdir(gs), "{} is not a directory!".format(gs)
+    for s in system:
+        assert os.path.isdir(s), "{} is not a directory!".format(s)
+
+    gold_files = {}
+    for fn in os.listdir(gs):
+        if select is None or select(fn):
+            gold_files[get_file_ids(gs + fn)[1]] = gs + fn
+
+    # Workers inherit the filters through the initializer
+    evaluations = []
+    with worker_pool(jobs, _init_stream_worker, (kwargs, cache)) as pool:
+        for s_id, system_files in get_file_dict_by_system_id(system).items():
+            # The documents of each system in the order evaluate() would
+            # score them
+            pairs = [(doc_id, gold_files[doc_id], system_files[doc_id])
+                     for doc_id in list(set(system_files.keys()) &
+                                        set(gold_files.keys()))
+                     if select is None or
+                     select(os.path.basename(system_files[doc_id]))]
+
+            e = PHITrackEvaluation(sys_id=s_id,
+                                   writer=writer if verbose else None,
+                                   **kwargs)
+            if pool is None:
+                scored = itertools.imap(_score_pair, pairs)
+            else:
+                scored = pool.imap(_score_pair, pairs, chunksize=4)
+            with profiler.stage("evaluation"):
+                for doc_id, counts, output in scored:
+                    sys.stdout.write(output)
+                    e.add_counts(doc_id, counts)
+
+            if bootstrap:
+                e.bootstrap(resamples=bootstrap, confidence=confidence,
+                            seed=seed)
+            if writer is not None:
+                e.write_report(writer, verbose=verbose)
+            else:
+                e.print_report(verbose=verbose)
+            evaluations.append(e)
+
+    return evaluations[0] if len(evaluations) == 1 else evaluations
+
+
+def shard_argument(value):
+    """Parses the INDEX/COUNT value of --shard."""
+    try:
+        index, count = [int(v) for v in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "shards are given as INDEX/COUNT, eg. 0/4")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            "the shard index must be from 0 to COUNT - 1")
+    return index, count
+
+
+def incremental_configuration(filter_spec=None, filters=None,
+                              conjunctive=False, invert=False, overlap=False):
+    """Describes everything that affects the counts of PHITrackEvaluation with
+    the given keyword arguments, for incremental.EvaluationState. filter_spec
+    is the --filter argument the filters were compiled from.
+    """
+    return {
+        "labels": [c.label for c in PHITrackEvaluation.get_configurations(
+            filters=filters, conjunctive=conjunctive, invert=invert,
+            overlap=overlap)],
+        "filter": filter_spec,
+        "conjunctive": conjunctive,
+        "invert": invert,
+        "relaxed_distance": PHITrackEvaluation.relaxed_distance,
+        "matcher": PHITrackEvaluation.matcher.__class__.__name__}
+
+
+def evaluate_incremental(system, gs, state_file, filter_spec=None, **kwargs):
+    """Run PHITrackEvaluation on the 'system' list of directories against the
+    'gs' directory like evaluate() does, but only parse and score documents
+    whose gold or system file has changed since the last run that used
+    state_file (see incremental.EvaluationState). The scores of every other
+    document are read from state_file, which is then updated. filter_spec
+    describes the filters passed in kwargs (ie. the --filter argument) so
+    that scores computed with different filters are never mixed. See
+    score_changes() for the other keyword arguments.
+    """
+    assert os.path.isdir(gs), "{} is not a directory!".format(gs)
+    for s in system:
+        assert os.path.isdir(s), "{} is not a directory!".format(s)
+
+    state = EvaluationState(state_file, incremental_configuration(
+        filter_spec, kwargs.get("filters"), kwargs.get("conjunctive", False),
+        kwargs.get("invert", False), kwargs.get("overlap", False)))
+    evaluations = score_changes(system, gs, state, **kwargs)
+    state.save()
+
+    return evaluations[0] if len(evaluations) == 1 else evaluations
+
+
+def score_changes(system, gs, state, gold=None, gold_rows=None,
+                  verbose=False, errors=False, jobs=1, cache=None,
+                  bootstrap=0, confidence=0.95, seed=None, writer=None,
+                  **kwargs):
+    """Print the report of each system in the 'system' directories, scoring
+    only the documents whose gold or system file changed since their counts
+    were stored in state (an incremental.EvaluationState), which is updated.
+    Returns the PHITrackEvaluation of each system.
+
+    gold and gold_rows are optional dicts kept between calls (see
+    evaluate_watch()): gold holds the fingerprint and StandoffAnnotation of
+    each gold document parsed so far and gold_rows is passed on to
+    PHITrackEvaluation. Gold documents are parsed again when their file
+    changes. With errors the false positives and false negatives are only
+    listed for the documents that were scored again. bootstrap, confidence
+    and seed are passed on to PHITrackEvaluation.bootstrap() if bootstrap is
+    not 0. With an output.ResultWriter as writer the report is written to it
+    instead of being printed.
+    """
+    if gold is None:
+        gold = {}
+
+    gold_files = {}
+    for fn in os.listdir(gs):
+        gold_files[get_file_ids(gs + fn)[1]] = gs + fn
+
+    evaluations = []
+
+    for s_id, system_files in get_file_dict_by_system_id(system).items():
+        doc_ids = list(set(system_files.keys()) & set(gold_files.keys()))
+
+        fingerprints = {}
+        stored = {}
+        for doc_id in doc_ids:
+            fingerprints[doc_id] = state.fingerprints(s_id, doc_id,
+                                                      gold_files[doc_id],
+                                                      system_files[doc_id])
+            stored[doc_id] = state.lookup(s_id, doc_id,
+                                          *fingerprints[doc_id])
+
+        changed = [doc_id for doc_id in doc_ids if stored[doc_id] is None]
+        missing_gold = [doc_id for doc_id in changed
+                        if doc_id not in gold or
+                        not same_file(gold[doc_id][0],
+                                      fingerprints[doc_id][0])]
+        gold.update(zip(missing_gold, zip(
+            [fingerprints[doc_id][0] for doc_id in missing_gold],
+            load_annotations([gold_files[doc_id] for doc_id in missing_gold],
+                             jobs=jobs, cache=cache))))
+        system_sa = dict(zip(changed, load_annotations(
+            [system_files[doc_id] for doc_id in changed],
+            jobs=jobs, cache=cache)))
+
+        e = PHITrackEvaluation(sys_id=s_id, counts_only=not errors,
+                               gold_rows=gold_rows,
+                               writer=writer if verbose else None, **kwargs)
+        with profiler.stage("evaluation"):
+            for doc_id in doc_ids:
+                if stored[doc_id] is None:
+                    e.add_document(doc_id, gold[doc_id][1],
+                                   system_sa[doc_id])
+                else:
+                    e.add_counts(doc_id, stored[doc_id])
+
+        # Only keep the documents that are still around
+        state.systems[s_id] = {}
+        for doc_id, counts in zip(e.doc_ids, e.counts()):
+            state.update(s_id, doc_id, fingerprints[doc_id][0],
+                         fingerprints[doc_id][1], counts)
+
+        if bootstrap:
+            e.bootstrap(resamples=bootstrap, confidence=confidence, seed=seed)
+        if writer is not None:
+            e.write_report(writer, verbose=verbose)
+        else:
+            e.print_report(verbose=verbose, errors=errors)
+        evaluations.append(e)
+
+    return evaluations
+
+
+def directory_snapshot(directories):
+    """Returns the (size, modification time) of every file in directories,
+    by file name.
+    """
+    snapshot = {}
+    for d in directories:
+        for fn in os.listdir(d):
+            try:
+                stat = os.stat(d + fn)
+            except OSError:
+                # Removed since it was listed
+                continue
+            snapshot[d + fn] = (stat.st_size, stat.st_mtime)
+    return snapshot
+
+
+def evaluate_watch(system, gs, interval=1.0, state_file=None,
+                   filter_spec=None, **kwargs):
+    """Print the report of the 'system' directories against the 'gs'
+    directory, then print it again whenever a file in any of them changes,
+    until interrupted. Like evaluate_incremental() only the documents whose
+    gold or system file changed are parsed and scored again; the per
+    document counts and the parsed gold documents are kept in memory between
+    reports, and in state_file too if one is given.
+
+    Changes are found by polling the size and modification time of the files
+    every interval seconds. Scoring waits until they have stayed the same
+    for an interval, so that a system directory being written out is read
+    once it is complete. A report that fails, for example on a document
+    that was still being written, is given up until the next change.
+    """
+    assert os.path.isdir(gs), "{} is not a directory!".format(gs)
+    for s in system:
+        assert os.path.isdir(s), "{} is not a directory!".format(s)
+
+    state = EvaluationState(state_file, incremental_configuration(
+        filter_spec, kwargs.get("filters"), kwargs.get("conjunctive", False),
+        kwargs.get("invert", False), kwargs.get("overlap", False)))
+    gold, gold_rows = {}, {}
+    directories = [gs] + list(system)
+
+    previous = {}
+    try:
+        while True:
+            current = directory_snapshot(directories)
+            if current == previous:
+                time.sleep(interval)
+                continue
+
+            time.sleep(interval)
+            if directory_snapshot(directories) != current:
+                continue
+
+            changed = [fn for fn in set(current) | set(previous)
+                       if current.get(fn) != previous.get(fn)]
+            previous = current
+            print("==> {} ({} changed file{})".format(
+                time.strftime("%H:%M:%S"), len(changed),
+                "" if len(changed) == 1 else "s"))
+            try:
+                score_changes(system, gs, state, gold=gold,
+                              gold_rows=gold_rows, **kwargs)
+                state.save()
+            # Keep watching whatever went wrong with this set of files
+            except Exception as e:
+                print("ERROR: {}".format(e))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+# Configurations whose micro F1 is shown next to the ranking configuration
+# in the leaderboard
+LEADERBOARD_LABELS = ["Token", "Strict", "Relaxed", "HIPAA Strict",
+                      "HIPAA Relaxed"]
+
+# Gold annotations, evaluation keyword arguments and cache shared by the
+# leaderboard worker processes, set by _init_leaderboard_worker()
+_leaderboard = {}
+
+
+def _init_leaderboard_worker(gold_sa, kwargs, cache):
+    _leaderboard.update(gold_sa=gold_sa, kwargs=kwargs, cache=cache,
+                        gold_rows={})
+
+
+def system_names(system_dirs):
+    """Returns a name for each of the system_dirs: the name of the directory
+    (or archive) if they are all different, otherwise its path relative to
+    the deepest directory holding all of them.
+    """
+    paths = [os.path.abspath(s) for s in system_dirs]
+    for i, p in enumerate(paths):
+        assert p not in paths[:i], "{} is given twice!".format(system_dirs[i])
+
+    names = [os.path.basename(p) for p in paths]
+    if len(set(names)) == len(names):
+        return names
+
+    common = os.path.commonprefix([os.path.dirname(p) + os.sep
+                                   for p in paths])
+    common = common[:common.rindex(os.sep) + 1]
+    return [p[len(common):] for p in paths]
+
+
+def _score_system(args):
+    """Score every system id found in the system_dir of the (system_dir,
+    name) pair against the shared gold annotations. Returns a list of (name,
+    doc_ids, counts) tuples, one for each system id, and everything printed
+    while loading the documents. Raises a WorkerError naming system_dir if
+    it cannot be scored.
+    """
+    system_dir, name = args
+    stdout = sys.stdout
+    try:
+        sys.stdout = StringIO()
+        try:
+            systems = get_document_dict_by_system_id(
+                [system_dir], cache=_leaderboard["cache"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        scores = []
+        for sys_id, system_sa in sorted(systems.items()):
+            e = PHITrackEvaluation(system_sa, _leaderboard["gold_sa"],
+                                   gold_rows=_leaderboard["gold_rows"],
+                                   **_leaderboard["kwargs"])
+            scores.append((name + " ({})".format(sys_id) if sys_id else name,
+                           e.doc_ids, e.counts()))
+    except Exception:
+        raise worker_error(system_dir)
+
+    return scores, output
+
+
+def evaluate_leaderboard(system, gs, rank_by="Strict", jobs=1, cache=None,
+                         **kwargs):
+    """Score each directory in the 'system' list against the 'gs' directory
+    and print a leaderboard ranked by the micro F1 of the rank_by
+    configuration. Gold is parsed once and shared by the jobs worker
+    processes, each of which scores whole system directories. Systems are
+    named by system_names() (and system id, if the file names have one).
+    Returns the PHITrackEvaluation of every system in leaderboard order.
+    """
+    assert is_corpus(gs), \
+        "{} is neither a directory nor an archive!".format(gs)
+    for s in system:
+        assert is_corpus(s), \
+            "{} is neither a directory nor an archive!".format(s)
+
+    labels = [c.label for c in PHITrackEvaluation.get_configurations(**kwargs)]
+    assert rank_by in labels, "Unknown configuration {}!".format(rank_by)
+
+    gold_sa = {}
+    for sa in load_corpus(gs, jobs=jobs, cache=cache):
+        gold_sa[sa.id] = sa
+
+    # Workers inherit gold through the initializer rather than receiving it
+    # with every task.
+    tasks = zip(system, system_names(system))
+    with worker_pool(min(jobs or 1, len(system)), _init_leaderboard_worker,
+                     (gold_sa, kwargs, cache)) as pool:
+        if pool is None:
+            results = [_score_system(t) for t in tasks]
         else:
-            print 'ERROR: {} contains an invalid severity score ({})'.format(
-                file_path, score)
-            raise wrong_severity_value
+            results = pool.map(_score_system, tasks, chunksize=1)
+
+    evaluations = []
+    for scores, output in results:
+        sys.stdout.write(output)
+        for name, doc_ids, counts in scores:
+            e = PHITrackEvaluation(sys_id=name, **kwargs)
+            for doc_id, c in zip(doc_ids, counts):
+                e.add_counts(doc_id, c)
+            evaluations.append(e)
+
+    ranked = labels.index(rank_by)
+    columns = [l for l in LEADERBOARD_LABELS if l in labels and l != rank_by]
+
+    def f1(e, label):
+        r = e.evaluations[labels.index(label)]
+        return Evaluate.F_beta(r.micro_recall(), r.micro_precision())
+
+    evaluations.sort(key=lambda e: (-f1(e, rank_by), e.sys_id))
+
+    str_fmt = "{:<6}{:<30}{:>6}" + "{:>10}" * 3 + "{:>18}" * len(columns)
+    print("Leaderboard ranked by {} micro F1".format(rank_by))
+    print(str_fmt.format("Rank", "System", "Docs", "Precision", "Recall",
+                         "F1", *["{} F1".format(l) for l in columns]))
+    print("-" * (72 + 18 * len(columns)))
+    for rank, e in enumerate(evaluations, 1):
+        r = e.evaluations[ranked]
+        print(str_fmt.format(rank, e.sys_id, len(e.doc_ids),
+                             "{:.4}".format(r.micro_precision()),
+                             "{:.4}".format(r.micro_recall()),
+                             "{:.4}".format(f1(e, rank_by)),
+                             *["{:.4}".format(f1(e, l)) for l in columns]))
+
+    return evaluations
+
+
+def evaluate_significance(system, gs, permutations=10000, seed=None, jobs=1,
+                          cache=None, **kwargs):
+    """Compare the two system directories in the 'system' list on the
+    documents they share with the 'gs' directory. For every configuration of
+    PHITrackEvaluation the micro F1 of both systems is printed along with the
+    p-value of their difference under a paired approximate randomization
+    test (see resampling.randomization_test()). Returns the two
+    PHITrackEvaluations.
+    """
+    assert len(system) == 2, "Exactly two system directories are needed!"
+    assert is_corpus(gs), \
+        "{} is neither a directory nor an archive!".format(gs)
+    for s in system:
+        assert is_corpus(s), \
+            "{} is neither a directory nor an archive!".format(s)
+
+    gold_sa = {}
+    for sa in load_corpus(gs, jobs=jobs, cache=cache):
+        gold_sa[sa.id] = sa
+
+    systems = []
+    for s in system:
+        by_id = get_document_dict_by_system_id([s], jobs=jobs, cache=cache)
+        assert len(by_id) == 1, "{} holds more than one system!".format(s)
+        systems.append(by_id.values()[0])
+
+    doc_ids = sorted(set(systems[0]) & set(systems[1]) & set(gold_sa))
+    assert len(doc_ids) > 0, "The systems have no gold documents in common!"
+
+    gold_rows = {}
+    evaluations, counts = [], []
+    for name, system_sa in zip(system_names(system), systems):
+        with profiler.stage("evaluation"):
+            e = PHITrackEvaluation(
+                dict((doc_id, system_sa[doc_id]) for doc_id in doc_ids),
+                gold_sa, gold_rows=gold_rows, **kwargs)
+        e.sys_id = name
+        order = dict((doc_id, i) for i, doc_id in enumerate(e.doc_ids))
+        counts.append(e.counts()[[order[doc_id] for doc_id in doc_ids]])
+        evaluations.append(e)
+
+    with profiler.stage("significance"):
+        difference, p_values = randomization_test(
+            counts[0], counts[1], permutations=permutations, seed=seed)
+
+    def f1(r):
+        return Evaluate.F_beta(r.micro_recall(), r.micro_precision())
+
+    a, b = evaluations
+    print("A: {}".format(a.sys_id))
+    print("B: {}".format(b.sys_id))
+    print("Approximate randomization test of micro F1, {} permutations, "
+          "{} documents".format(permutations, len(doc_ids)))
+    str_fmt = "{:<35}{:>10}{:>10}{:>12}{:>12}"
+    print(str_fmt.format("Configuration", "A F1", "B F1", "B - A",
+                         "p-value"))
+    print("-" * 79)
+    for i, c in enumerate(a.configurations):
+        print(str_fmt.format(c.label,
+                             "{:.4}".format(f1(a.evaluations[i])),
+                             "{:.4}".format(f1(b.evaluations[i])),
+                             "{:+.4f}".format(difference[i]),
+                             "{:.4g}".format(p_values[i])))
+
+    return evaluations
+
+
+# Every field of the records written by evaluate_rdoc(), see output.py
+RDOC_RECORD_FIELDS = ["record", "class", "doc_id", "gold", "system", "error",
+                      "gold_support", "system_support", "score", "p_value"]
+
+RDOC_LEVELS = {'ABSENT': 0, 'MILD': 1, 'MODERATE': 2, 'SEVERE': 3}
+
+
+def get_rdoc_prediction(file_path, name=None):
+    """It returns the positive valence severity score from an XML document.
+    file_path may also be a file object, whose name is then given as name.
+    """
+    source = etree.parse(file_path)
+    score = source.findall('./TAGS/POSITIVE_VALENCE')[0].attrib['score']
+    score = score.upper().strip()
+    if score in RDOC_LEVELS.keys():
+        return RDOC_LEVELS[score]
+    else:
+        print 'ERROR: {} contains an invalid severity score ({})'.format(
+            name or file_path, score)
+        raise Exception('Unexpected severity value')
+
+
+def load_rdoc_predictions(folder):
+    """Returns the severity score of every XML document in folder, indexed
+    by file name, as evaluate_rdoc() takes them for the gold folder. folder
+    may also be an archive, whose members are read without extracting it.
+    """
+    with profiler.stage("loading"):
+        if is_archive(folder):
+            return dict((name, get_rdoc_prediction(
+                             BytesIO(content), os.path.join(folder, name)))
+                        for name, content in archive_members(folder))
+        return dict((os.path.basename(f), get_rdoc_prediction(f))
+                    for f in sorted(glob.glob(folder + '/*.xml')))
+
+
+def evaluate_rdoc(gold_fld, syst_fld, verbose=False, writer=None, gold=None):
+    """Evaluates the system's predictions wrt the gold ones.
+
+    Both sources must be in a separate folder, or archive (see
+    archives.py). With an output.ResultWriter as writer the report is written
+    to it instead of being printed. gold may hold the scores of the gold
+    folder, as returned by load_rdoc_predictions(), so that it is not read
+    again.
+    """
+
+    diff_folders_content = Exception('Folders must contain the same XML files')
+    score2level = {a: b for b, a in RDOC_LEVELS.items()}
 
     def mean_absolute_error(gold, system):
         gold, system = np.array(gold), np.array(system)
@@ -346,16 +1253,48 @@ def evaluate_rdoc(gold_fld, syst_fld, verbose=False):
         score = sum(mae_per_score) / len(set(x))
         return stats_per_score, score
 
-    golds = set([os.path.basename(x) for x in glob.glob(gold_fld + '/*.xml')])
-    systs = set([os.path.basename(x) for x in glob.glob(syst_fld + '/*.xml')])
+    # Archives are read in one go, folders one file at a time below
+    if gold is None and is_archive(gold_fld):
+        gold = load_rdoc_predictions(gold_fld)
+    system = None
+    if is_archive(syst_fld):
+        system = load_rdoc_predictions(syst_fld)
+
+    if gold is None:
+        golds = set([os.path.basename(x)
+                     for x in glob.glob(gold_fld + '/*.xml')])
+    else:
+        golds = set(gold.keys())
+    if system is None:
+        systs = set([os.path.basename(x)
+                     for x in glob.glob(syst_fld + '/*.xml')])
+    else:
+        systs = set(system.keys())
     if golds != systs:
         print 'ERROR: Folders must contain the same XML files.'
         raise diff_folders_content
 
-    X = [get_prediction(f) for f in sorted(glob.glob(gold_fld + '/*.xml'))]
-    Y = [get_prediction(f) for f in sorted(glob.glob(syst_fld + '/*.xml'))]
+    names = sorted(golds)
+    with profiler.stage("loading"):
+        if gold is None:
+            X = [get_rdoc_prediction(os.path.join(gold_fld, name))
+                 for name in names]
+        else:
+            X = [gold[name] for name in names]
+        if system is None:
+            Y = [get_rdoc_prediction(os.path.join(syst_fld, name))
+                 for name in names]
+        else:
+            Y = [system[name] for name in names]
+
+    with profiler.stage("evaluation"):
+        stats, score = compute_score(X, Y)
+
+    if writer is not None:
+        write_rdoc_report(writer, names, X, Y, stats, score, score2level,
+                          verbose)
+        return
 
-    stats, score = compute_score(X, Y)
     print
     print 'CLASSES    ( support )  '
     print '           (gold|syst): '
@@ -374,9 +1313,9 @@ def evaluate_rdoc(gold_fld, syst_fld, verbose=False):
         print
         print '{:<12s} {:^6s} {:^6s}   {:<6s}'.format('RECORD NAME', 'GOLD',
                                                       'SYSTEM', 'ERROR')
-        for pos, f in enumerate(sorted(glob.glob(gold_fld + '/*.xml'))):
+        for pos, name in enumerate(names):
             print '{:<12s} {:^6d} {:^6d}   {:<6s}'.format(
-                os.path.basename(f), X[pos], Y[pos], error_bar(X[pos], Y[pos]))
+                name, X[pos], Y[pos], error_bar(X[pos], Y[pos]))
 
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
@@ -384,6 +1323,39 @@ def evaluate_rdoc(gold_fld, syst_fld, verbose=False):
                 wilcoxon(X, Y)[1])
 
 
+def write_rdoc_report(writer, names, X, Y, stats, score, score2level,
+                      verbose=False):
+    """Write the records of evaluate_rdoc(): one for each class, one for the
+    overall score and, if verbose, one for each of the documents in names.
+    """
+    for value in sorted(stats.keys()):
+        gold_support, system_support, class_score = stats[value]
+        writer.write({"record": "class",
+                      "class": score2level[value].lower(),
+                      "gold_support": gold_support,
+                      "system_support": system_support,
+                      "score": float(class_score)})
+
+    summary = {"record": "summary",
+               "gold_support": len(X),
+               "system_support": len(Y),
+               "score": float(score)}
+
+    if verbose:
+        for pos, name in enumerate(names):
+            writer.write({"record": "document",
+                          "doc_id": name,
+                          "gold": X[pos],
+                          "system": Y[pos],
+                          "error": abs(X[pos] - Y[pos])})
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            summary["p_value"] = float(wilcoxon(X, Y)[1])
+
+    writer.write(summary)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="To Write")
 
@@ -399,19 +1371,97 @@ if __name__ == "__main__":
     oneb_parser.add_argument('--invert',
                              help="Invert the list of filters,  match only tags that do not match filter functions",
                              action="store_true")
+    oneb_parser.add_argument('--overlap',
+                             help="also report P/R/F1 of overlapping tags",
+                             action="store_true")
     oneb_parser.add_argument('-v', '--verbose',
                              help="list full document by document scores",
                              action="store_true")
+    oneb_parser.add_argument('--errors',
+                             help="list the false positives and false negatives of each document",
+                             action="store_true")
+    oneb_parser.add_argument('-j', '--jobs',
+                             help="number of worker processes used to parse documents",
+                             type=int, default=1)
+    oneb_parser.add_argument('--cache-dir',
+                             help="directory to cache parsed documents in")
+    oneb_parser.add_argument('--cache-size',
+                             help="size limit of the cache directory in MB",
+                             type=int, default=1024)
+    oneb_parser.add_argument('--incremental', metavar="STATE",
+                             help="file to keep per document scores in, only "
+                                  "changed documents are scored again")
+    oneb_parser.add_argument('--stream',
+                             help="hold one document pair in memory at a time",
+                             action="store_true")
+    oneb_parser.add_argument('--watch',
+                             help="report again whenever a file changes",
+                             action="store_true")
+    oneb_parser.add_argument('--poll-interval', metavar="SECONDS", type=float,
+                             default=1.0,
+                             help="how often --watch looks for changes")
+    oneb_parser.add_argument('--significance',
+                             help="test the difference between two system directories",
+                             action="store_true")
+    oneb_parser.add_argument('--permutations', metavar="N", type=int,
+                             default=10000,
+                             help="number of permutations of --significance")
+    oneb_parser.add_argument('--bootstrap', metavar="N", type=int, default=0,
+                             help="report bootstrap confidence intervals from N document resamples")
+    oneb_parser.add_argument('--confidence', type=float, default=0.95,
+                             help="confidence level of --bootstrap intervals")
+    oneb_parser.add_argument('--seed', type=int,
+                             help="random seed for --bootstrap and --significance")
+    oneb_parser.add_argument('--format', choices=FORMATS, default="text",
+                             help="output format of the report")
+    oneb_parser.add_argument('--profile', metavar="FILE",
+                             help="write per stage timings to FILE as JSON")
     oneb_parser.add_argument("from_dir",
                              help="directories to pull documents from")
-    oneb_parser.add_argument("to_dir",
-                             help="directories to save documents to")
+    oneb_parser.add_argument('--leaderboard',
+                             help="rank several system directories against the gold standard",
+                             action="store_true")
+    oneb_parser.add_argument('--rank-by', metavar="LABEL", default="Strict",
+                             help="configuration whose micro F1 ranks the leaderboard")
+    oneb_parser.add_argument("to_dir", nargs="+",
+                             help="system directories (or file) to evaluate")
+    shard_group = oneb_parser.add_mutually_exclusive_group()
+    shard_group.add_argument('--shard', metavar="INDEX/COUNT",
+                             type=shard_argument,
+                             help="only score the documents of one of COUNT shards")
+    shard_group.add_argument('--manifest', metavar="FILE",
+                             help="only score the documents listed in FILE")
+    oneb_parser.add_argument('--partial', metavar="FILE",
+                             help="save per document counts to FILE for merge "
+                                  "instead of reporting")
+
+    merge_parser = subparsers.add_parser('merge',
+                                         help='Report of partial Track 1 results')
+    merge_parser.add_argument('-v', '--verbose',
+                              help="list full document by document scores",
+                              action="store_true")
+    merge_parser.add_argument('--bootstrap', metavar="N", type=int, default=0,
+                              help="report bootstrap confidence intervals from N document resamples")
+    merge_parser.add_argument('--confidence', type=float, default=0.95,
+                              help="confidence level of --bootstrap intervals")
+    merge_parser.add_argument('--seed', type=int,
+                              help="random seed for --bootstrap")
+    merge_parser.add_argument('--format', choices=FORMATS, default="text",
+                              help="output format of the report")
+    merge_parser.add_argument('--profile', metavar="FILE",
+                              help="write per stage timings to FILE as JSON")
+    merge_parser.add_argument("partials", nargs="+",
+                              help="partial results written with --partial")
 
     two_parser = subparsers.add_parser('track2',
                                        help='Evaluation script for Track 2')
     two_parser.add_argument('-v', '--verbose',
                             help="print more information",
                             action="store_true")
+    two_parser.add_argument('--format', choices=FORMATS, default="text",
+                            help="output format of the report")
+    two_parser.add_argument('--profile', metavar="FILE",
+                            help="write per stage timings to FILE as JSON")
     two_parser.add_argument("gold_dir",
                             help="gold directory")
     two_parser.add_argument("syst_dir",
@@ -419,18 +1469,204 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.profile:
+        profiler.enable()
+
+    if args.track == 'track1' and args.watch:
+        for flag in ("leaderboard", "significance"):
+            if getattr(args, flag):
+                oneb_parser.error("--watch cannot be used with --" + flag)
+        if args.format != "text":
+            oneb_parser.error("--watch has no {} output".format(args.format))
+
+    if args.track == 'track1' and args.leaderboard:
+        # The leaderboard only prints one row of micro scores per system
+        for flag in ("significance", "incremental", "stream", "verbose",
+                     "errors"):
+            if getattr(args, flag):
+                oneb_parser.error("--leaderboard cannot be used with --" +
+                                  flag)
+
+    if args.track == 'track1' and args.significance:
+        # The test only prints the micro F1 and p-value of each configuration
+        for flag in ("leaderboard", "incremental", "partial", "verbose",
+                     "errors"):
+            if getattr(args, flag):
+                oneb_parser.error("--significance cannot be used with --" +
+                                  flag)
+
+    if args.track == 'track1' and args.stream:
+        for flag in ("errors", "leaderboard", "significance", "incremental",
+                     "watch", "partial"):
+            if getattr(args, flag):
+                oneb_parser.error("--stream cannot be used with --" + flag)
+
+    if args.track == 'track1':
+        # These pair or fingerprint individual files by path
+        archives = [p for p in [args.from_dir] + args.to_dir if is_archive(p)]
+        for flag in ("stream", "incremental", "watch"):
+            if getattr(args, flag) and archives:
+                oneb_parser.error("--{} cannot read archives ({}), extract "
+                                  "them first".format(flag,
+                                                      ", ".join(archives)))
+
+    if args.track == 'track1' and \
+       (args.shard or args.manifest or args.partial):
+        for flag in ("leaderboard", "significance", "incremental", "watch"):
+            if getattr(args, flag):
+                oneb_parser.error("--{} cannot be used with sharding".format(
+                    flag))
+
+    if args.track == 'track1' and args.partial:
+        # Partial results only hold counts, merge prints the report
+        if args.errors:
+            oneb_parser.error("--errors cannot be used with --partial")
+        for flag in ("verbose", "bootstrap"):
+            if getattr(args, flag):
+                oneb_parser.error("--{} cannot be used with --partial, pass "
+                                  "it to merge".format(flag))
+        if args.format != "text":
+            oneb_parser.error("--partial has no {} output, pass --format to "
+                              "merge".format(args.format))
+
+    if args.track == 'track1' and args.bootstrap:
+        for flag in ("leaderboard", "significance"):
+            if getattr(args, flag):
+                oneb_parser.error("--bootstrap cannot be used with --" + flag)
+        # A single document pair has no documents to resample
+        if os.path.isfile(args.from_dir) and not is_archive(args.from_dir):
+            oneb_parser.error("--bootstrap needs gold and system directories")
+
+    writer = None
+    if args.format != "text":
+        if args.track == 'track1':
+            for flag in ("errors", "leaderboard", "significance"):
+                if getattr(args, flag):
+                    oneb_parser.error("--{} has no {} output".format(
+                        flag, args.format))
+            fields = Evaluate.record_fields
+        elif args.track == 'merge':
+            fields = Evaluate.record_fields
+        else:
+            fields = RDOC_RECORD_FIELDS
+        writer = get_writer(args.format, sys.stdout, fields)
+        # Keep warnings and anything else printed out of the records
+        sys.stdout = sys.stderr
+
     if args.track == 'track1':
+        cache = None
+        if args.cache_dir:
+            cache = AnnotationCache(args.cache_dir,
+                                    max_size=args.cache_size * 1024 * 1024)
+
+        kwargs = {}
         if args.filter:
-            evaluate([args.to_dir], args.from_dir,
-                     PHITrackEvaluation,
-                     verbose=args.verbose,
-                     invert=args.invert,
-                     conjunctive=args.conjunctive,
-                     filters=[get_predicate_function(a, PHITag)
-                              for a in args.filter.split(",")])
+            try:
+                filters = [get_predicate_function(a, PHITag)
+                           for a in args.filter.split(",")]
+            except FilterError as e:
+                oneb_parser.error(str(e))
+            kwargs = dict(invert=args.invert,
+                          conjunctive=args.conjunctive,
+                          filters=filters)
+        if args.overlap:
+            kwargs["overlap"] = True
+
+        select = shard = None
+        if args.shard:
+            index, count = args.shard
+            select = lambda fn: shard_of(get_file_ids(fn)[1], count) == index
+            shard = "{}/{}".format(index, count)
+        elif args.manifest:
+            listed = set(get_file_ids(name)[1]
+                         for name in read_manifest(args.manifest))
+            select = lambda fn: get_file_ids(fn)[1] in listed
+            shard = args.manifest
+
+        if args.leaderboard:
+            evaluate_leaderboard(args.to_dir, args.from_dir,
+                                 rank_by=args.rank_by,
+                                 jobs=args.jobs,
+                                 cache=cache,
+                                 **kwargs)
+        elif args.significance:
+            evaluate_significance(args.to_dir, args.from_dir,
+                                  permutations=args.permutations,
+                                  seed=args.seed,
+                                  jobs=args.jobs,
+                                  cache=cache,
+                                  **kwargs)
+        elif args.watch:
+            evaluate_watch(args.to_dir, args.from_dir,
+                           interval=args.poll_interval,
+                           state_file=args.incremental,
+                           filter_spec=args.filter,
+                           verbose=args.verbose,
+                           errors=args.errors,
+                           bootstrap=args.bootstrap,
+                           confidence=args.confidence,
+                           seed=args.seed,
+                           jobs=args.jobs,
+                           cache=cache,
+                           **kwargs)
+        elif args.incremental:
+            evaluate_incremental(args.to_dir, args.from_dir,
+                                 args.incremental,
+                                 filter_spec=args.filter,
+                                 verbose=args.verbose,
+                                 errors=args.errors,
+                                 bootstrap=args.bootstrap,
+                                 confidence=args.confidence,
+                                 seed=args.seed,
+                                 jobs=args.jobs,
+                                 cache=cache,
+                                 writer=writer,
+                                 **kwargs)
+        elif args.stream:
+            evaluate_stream(args.to_dir, args.from_dir,
+                            verbose=args.verbose,
+                            bootstrap=args.bootstrap,
+                            confidence=args.confidence,
+                            seed=args.seed,
+                            jobs=args.jobs,
+                            cache=cache,
+                            writer=writer,
+                            select=select,
+                            **kwargs)
+        elif args.partial:
+            evaluate_partial(args.to_dir, args.from_dir, args.partial,
+                             select=select,
+                             shard=shard,
+                             filter_spec=args.filter,
+                             jobs=args.jobs,
+                             cache=cache,
+                             **kwargs)
         else:
-            evaluate([args.to_dir], args.from_dir, PHITrackEvaluation,
-                     verbose=args.verbose)
+            evaluate(args.to_dir, args.from_dir, PHITrackEvaluation,
+                     verbose=args.verbose,
+                     errors=args.errors,
+                     bootstrap=args.bootstrap,
+                     confidence=args.confidence,
+                     seed=args.seed,
+                     jobs=args.jobs,
+                     cache=cache,
+                     writer=writer,
+                     select=select,
+                     **kwargs)
+    elif args.track == 'merge':
+        evaluate_merge(args.partials,
+                       verbose=args.verbose,
+                       bootstrap=args.bootstrap,
+                       confidence=args.confidence,
+                       seed=args.seed,
+                       writer=writer)
     else:
         evaluate_rdoc(os.path.abspath(args.gold_dir),
-                      os.path.abspath(args.syst_dir), verbose=args.verbose)
+                      os.path.abspath(args.syst_dir), verbose=args.verbose,
+                      writer=writer)
+
+    if writer is not None:
+        writer.close()
+
+    if args.profile:
+        profiler.save(args.profile)
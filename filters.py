@@ -0,0 +1,367 @@
+###############################################################################
+#
+#    Filter expressions for the --filter flag. An expression selects PHI
+#    tags by tag name, TYPE and offsets:
+#
+#        LOCATION                  tags named LOCATION
+#        CITY                      tags with TYPE CITY
+#        LOCATION/CITY             both at once
+#        name = DATE, TYPE = ZIP   explicit name or TYPE
+#        start >= 100, end < 500   offset ranges (also length, end - start)
+#        NOT, AND, OR, ( )         combinations, also written !, &, |
+#
+#    for example "(NAME OR LOCATION/CITY) AND NOT start < 100". Names, TYPEs
+#    and keywords are case insensitive. A bare word that is both a tag name
+#    and a TYPE (eg. DATE, AGE) is taken as the tag name, as --filter always
+#    did, write "TYPE = DATE" for the TYPE.
+#
+#    compile_filter() parses an expression once into a Filter. Filters are
+#    predicates, filter(tag) tells whether a single tag or token passes, and
+#    filter.mask(columns) evaluates the expression over the TagColumns of a
+#    whole document in a handful of vectorized numpy operations. Token
+#    configurations filter every token on its own offsets, with the name and
+#    TYPE of its tag (TagColumns.pieces()).
+
+import re
+
+import numpy
+
+from tags import PHITag
+
+
+class FilterError(ValueError):
+    pass
+
+
+class TagColumns(object):
+    """ The name code, TYPE code, start and end of a list of PHI tags as
+    numpy arrays, the columnar form Filter.mask() works on. respelled is
+    True for the tags whose name or TYPE is not written the way its code
+    stands for (in upper case).
+    """
+    def __init__(self, tags):
+        self.size = len(tags)
+        self.tags = tags
+        self.name = numpy.array([t.name_code for t in tags],
+                                dtype=numpy.int64)
+        self.TYPE = numpy.array([t.TYPE_code for t in tags],
+                                dtype=numpy.int64)
+        names, types = PHITag.names, PHITag.types
+        self.respelled = numpy.array(
+            [t.name != names[t.name_code] or t.TYPE != types[t.TYPE_code]
+             for t in tags], dtype=bool)
+        self.start = numpy.array([int(t.start) for t in tags],
+                                 dtype=numpy.int64)
+        self.end = numpy.array([int(t.end) for t in tags], dtype=numpy.int64)
+
+    def pieces(self, owners, start, end):
+        """ Returns the TagColumns of pieces of the tags, such as their
+        tokens: piece i carries the name and TYPE of tag owners[i] and spans
+        start[i] to end[i].
+        """
+        columns = TagColumns([])
+        columns.size = len(owners)
+        columns.tags = [self.tags[i] for i in owners]
+        columns.name = self.name[owners]
+        columns.TYPE = self.TYPE[owners]
+        columns.respelled = self.respelled[owners]
+        columns.start = numpy.asarray(start, dtype=numpy.int64)
+        columns.end = numpy.asarray(end, dtype=numpy.int64)
+        return columns
+
+    def __len__(self):
+        return self.size
+
+
+class Filter(object):
+    """ A compiled filter expression. The repr() of a filter spells out the
+    expression in full, filters with the same repr select the same tags.
+    """
+    def mask(self, columns):
+        raise NotImplementedError
+
+    def __call__(self, tag):
+        raise NotImplementedError
+
+
+class Everything(Filter):
+    def mask(self, columns):
+        return numpy.ones(len(columns), dtype=bool)
+
+    def __call__(self, tag):
+        return True
+
+    def __repr__(self):
+        return "TRUE"
+
+
+class Equals(Filter):
+    """ Tags whose name or TYPE (field) is value. """
+    vocabularies = {"name": PHITag.names, "TYPE": PHITag.types}
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+        self.code = self.vocabularies[field].code(value)
+
+    def mask(self, columns):
+        return getattr(columns, self.field) == self.code
+
+    def __call__(self, tag):
+        return getattr(tag, self.field).upper() == self.value
+
+    def __repr__(self):
+        return "{} = {}".format(self.field, self.value)
+
+
+class PairLookup(Filter):
+    """ Tags whose (name, TYPE) pair passes predicate(name, TYPE). There are
+    only a few dozen such pairs, so the predicate runs once per pair and
+    mask() costs one index into a (name code, TYPE code) table per tag.
+    Codes stand for upper case values; the few tags written otherwise are
+    passed to the predicate as written.
+    """
+    def __init__(self, predicate):
+        self.predicate = predicate
+        self.table = numpy.zeros((0, 0), dtype=bool)
+        self.pairs = {}
+
+    def lookup_table(self):
+        # Vocabularies grow with unexpected values in system output, the
+        # table is rebuilt when they do
+        names, types = PHITag.names, PHITag.types
+        if self.table.shape != (len(names), len(types)):
+            self.table = numpy.array(
+                [[bool(self.predicate(n, t)) for t in types.values]
+                 for n in names.values],
+                dtype=bool).reshape(len(names), len(types))
+        return self.table
+
+    def mask(self, columns):
+        mask = self.lookup_table()[columns.name, columns.TYPE]
+        for i in numpy.flatnonzero(columns.respelled):
+            mask[i] = self(columns.tags[i])
+        return mask
+
+    def __call__(self, tag):
+        pair = (tag.name, tag.TYPE)
+        try:
+            return self.pairs[pair]
+        except KeyError:
+            passes = self.pairs[pair] = bool(self.predicate(*pair))
+            return passes
+
+    def __repr__(self):
+        return "PairLookup({})".format(self.predicate.__name__)
+
+
+class Compare(Filter):
+    """ Tags whose start, end or length compares to value. """
+    operators = {"<": numpy.less, "<=": numpy.less_equal,
+                 ">": numpy.greater, ">=": numpy.greater_equal,
+                 "=": numpy.equal, "==": numpy.equal,
+                 "!=": numpy.not_equal}
+
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.operator = operator
+        self.value = value
+        self.function = self.operators[operator]
+
+    def column(self, columns):
+        if self.field == "length":
+            return columns.end - columns.start
+        return getattr(columns, self.field)
+
+    def mask(self, columns):
+        return self.function(self.column(columns), self.value)
+
+    def __call__(self, tag):
+        if self.field == "length":
+            value = int(tag.end) - int(tag.start)
+        else:
+            value = int(getattr(tag, self.field))
+        return bool(self.function(value, self.value))
+
+    def __repr__(self):
+        return "{} {} {}".format(self.field, self.operator, self.value)
+
+
+class Not(Filter):
+    def __init__(self, operand):
+        self.operand = operand
+
+    def mask(self, columns):
+        return ~self.operand.mask(columns)
+
+    def __call__(self, tag):
+        return not self.operand(tag)
+
+    def __repr__(self):
+        return "NOT ({!r})".format(self.operand)
+
+
+class And(Filter):
+    def __init__(self, operands):
+        self.operands = operands
+
+    def mask(self, columns):
+        mask = self.operands[0].mask(columns)
+        for operand in self.operands[1:]:
+            mask = mask & operand.mask(columns)
+        return mask
+
+    def __call__(self, tag):
+        return all(operand(tag) for operand in self.operands)
+
+    def __repr__(self):
+        return " AND ".join("({!r})".format(o) for o in self.operands)
+
+
+class Or(Filter):
+    def __init__(self, operands):
+        self.operands = operands
+
+    def mask(self, columns):
+        mask = self.operands[0].mask(columns)
+        for operand in self.operands[1:]:
+            mask = mask | operand.mask(columns)
+        return mask
+
+    def __call__(self, tag):
+        return any(operand(tag) for operand in self.operands)
+
+    def __repr__(self):
+        return " OR ".join("({!r})".format(o) for o in self.operands)
+
+
+class _Parser(object):
+    """ Recursive descent parser for filter expressions:
+
+        expression := term (OR term)*
+        term       := factor (AND factor)*
+        factor     := NOT factor | ( expression ) | atom
+        atom       := WORD | WORD/WORD | (name | TYPE) = WORD
+                    | (start | end | length) OPERATOR NUMBER
+    """
+    token_re = re.compile(r"\s*(?:(?P<number>\d+)|"
+                          r"(?P<word>[A-Za-z_][A-Za-z0-9_-]*)|"
+                          r"(?P<operator><=|>=|==|!=|<|>|=)|"
+                          r"(?P<symbol>[()&|!/]))")
+
+    keywords = {"AND": "&", "OR": "|", "NOT": "!"}
+    offsets = ("START", "END", "LENGTH")
+
+    def __init__(self, expression, tag_cls):
+        self.expression = expression
+        self.names = set(n.upper() for n in tag_cls.tag_types.keys())
+        self.types = set(t.upper() for t in tag_cls.valid_TYPE)
+        self.tokens = self.tokenize(expression)
+        self.position = 0
+
+    def tokenize(self, expression):
+        tokens = []
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = self.token_re.match(expression, position)
+            if match is None:
+                raise FilterError("Unexpected '{}' in filter '{}'".format(
+                    expression[position:].strip()[0], expression))
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == "word" and value.upper() in self.keywords:
+                kind, value = "symbol", self.keywords[value.upper()]
+            tokens.append((kind, value))
+            position = match.end()
+        return tokens
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind is not None and token[0] != kind) or \
+           (value is not None and token[1] != value):
+            raise FilterError("Expected {} in filter '{}'{}".format(
+                value or kind, self.expression,
+                " before '{}'".format(token[1]) if token[1] else ""))
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise FilterError("Empty filter")
+        result = self.parse_expression()
+        if self.position != len(self.tokens):
+            raise FilterError("Unexpected '{}' in filter '{}'".format(
+                self.peek()[1], self.expression))
+        return result
+
+    def parse_expression(self):
+        operands = [self.parse_term()]
+        while self.peek() == ("symbol", "|"):
+            self.take()
+            operands.append(self.parse_term())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def parse_term(self):
+        operands = [self.parse_factor()]
+        while self.peek() == ("symbol", "&"):
+            self.take()
+            operands.append(self.parse_factor())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def parse_factor(self):
+        if self.peek() == ("symbol", "!"):
+            self.take()
+            return Not(self.parse_factor())
+        if self.peek() == ("symbol", "("):
+            self.take()
+            result = self.parse_expression()
+            self.take("symbol", ")")
+            return result
+        return self.parse_atom()
+
+    def parse_atom(self):
+        word = self.take("word").upper()
+
+        if word in self.offsets and self.peek()[0] == "operator":
+            operator = self.take("operator")
+            return Compare(word.lower(), operator, int(self.take("number")))
+
+        if word in ("NAME", "TYPE") and self.peek() == ("operator", "="):
+            self.take()
+            value = self.take("word").upper()
+            if word == "NAME":
+                return self.name(value)
+            return self.TYPE(value)
+
+        if self.peek() == ("symbol", "/"):
+            self.take()
+            return And([self.name(word), self.TYPE(self.take("word").upper())])
+
+        if word in self.names:
+            return Equals("name", word)
+        if word in self.types:
+            return Equals("TYPE", word)
+        raise FilterError("'{}' is neither a tag name nor a TYPE".format(word))
+
+    def name(self, value):
+        if value not in self.names:
+            raise FilterError("'{}' is not a tag name".format(value))
+        return Equals("name", value)
+
+    def TYPE(self, value):
+        if value not in self.types:
+            raise FilterError("'{}' is not a TYPE".format(value))
+        return Equals("TYPE", value)
+
+
+def compile_filter(expression, tag_cls=PHITag):
+    """ Parse expression into a Filter over tags of tag_cls, raises
+    FilterError if it is not a valid expression.
+    """
+    return _Parser(expression, tag_cls).parse()
@@ -0,0 +1,97 @@
+###############################################################################
+#
+#    Incremental re-evaluation. EvaluationState keeps the per document,  per
+#    configuration (tp, fp, fn) counts of the last run in a JSON file together
+#    with a fingerprint of the gold and system file each document was scored
+#    from. On the next run only the documents where either fingerprint has
+#    changed need to be parsed and scored again, the scores of every other
+#    document are taken from the state file.
+#
+#    A fingerprint is the size, modification time and SHA-1 digest of a file.
+#    Files whose size and modification time have not changed are not read
+#    again, otherwise their digest decides whether they have changed.
+
+import hashlib
+import json
+import os
+
+
+def file_fingerprint(file_name, previous=None):
+    """ Returns the [size, mtime, sha1] fingerprint of file_name, previous is
+    the last known fingerprint of the file, if any.
+    """
+    stat = os.stat(file_name)
+    if previous is not None and \
+       previous[:2] == [stat.st_size, stat.st_mtime]:
+        return previous
+
+    with open(file_name, "rb") as handle:
+        digest = hashlib.sha1(handle.read()).hexdigest()
+
+    return [stat.st_size, stat.st_mtime, digest]
+
+
+def same_file(a, b):
+    return a is not None and b is not None and \
+        (a[0], a[2]) == (b[0], b[2])
+
+
+class EvaluationState(object):
+    # Bump whenever the layout of the state file changes
+    version = 1
+
+    def __init__(self, path, configuration):
+        """ path is the state file and configuration a JSON serialisable
+        description of everything that affects the counts (configuration
+        labels, filters, matching distance). A state file written for a
+        different configuration is ignored. With no path the state is only
+        kept in memory.
+        """
+        self.path = path
+        self.configuration = configuration
+        self.systems = {}
+
+        if path is None:
+            return
+
+        try:
+            with open(path, "r") as handle:
+                state = json.load(handle)
+        except (IOError, ValueError):
+            return
+
+        if state.get("version") == self.version and \
+           state.get("configuration") == json.loads(json.dumps(configuration)):
+            self.systems = state["systems"]
+
+    def fingerprints(self, sys_id, doc_id, gold_file, system_file):
+        """ Returns the current (gold, system) fingerprints of a document. """
+        previous = self.systems.get(sys_id, {}).get(doc_id, {})
+        return (file_fingerprint(gold_file, previous.get("gold")),
+                file_fingerprint(system_file, previous.get("system")))
+
+    def lookup(self, sys_id, doc_id, gold, system):
+        """ Returns the stored counts of a document if they were computed from
+        files with the gold and system fingerprints, None otherwise.
+        """
+        entry = self.systems.get(sys_id, {}).get(doc_id)
+        if entry is not None and same_file(entry["gold"], gold) and \
+           same_file(entry["system"], system):
+            return [tuple(c) for c in entry["counts"]]
+        return None
+
+    def update(self, sys_id, doc_id, gold, system, counts):
+        self.systems.setdefault(sys_id, {})[doc_id] = {
+            "gold": gold, "system": system,
+            "counts": [[int(v) for v in c] for c in counts]}
+
+    def save(self):
+        if self.path is None:
+            return
+
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as handle:
+            json.dump({"version": self.version,
+                       "configuration": self.configuration,
+                       "systems": self.systems}, handle)
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,123 @@
+###############################################################################
+#
+#    Per stage timing of evaluation runs. Code paths worth measuring are
+#    wrapped in 'with profiler.stage(name, label):' blocks, which record the
+#    wall time, number of calls and peak memory of each stage and, when a
+#    label is given, of the stage for that sub-evaluation label ("Strict",
+#    "HIPAA Relaxed", ...).
+#
+#    The profiler is disabled unless enable() is called (evaluate.py does so
+#    for --profile), stage() then returns a shared no-op context manager so
+#    the instrumented code pays for a single attribute check.
+#
+#    Peak memory is the maximum resident set size of the process as reported
+#    by getrusage(), it is not available on platforms without the resource
+#    module. Work done in --jobs worker processes only shows up in the wall
+#    time of the stage that waits for it.
+
+import json
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_memory_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class StageStats(object):
+    __slots__ = ("calls", "seconds", "peak_kb", "growth_kb")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.peak_kb = None
+        self.growth_kb = 0
+
+    def add(self, seconds, before_kb, after_kb):
+        self.calls += 1
+        self.seconds += seconds
+        if after_kb is not None:
+            self.peak_kb = max(self.peak_kb, after_kb)
+            self.growth_kb += after_kb - before_kb
+
+    def toDict(self):
+        return {"calls": self.calls,
+                "seconds": self.seconds,
+                "peak_memory_kb": self.peak_kb,
+                "memory_growth_kb": self.growth_kb}
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Stage(object):
+    __slots__ = ("stats", "start", "before_kb")
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.before_kb = peak_memory_kb()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        for stats in self.stats:
+            stats.add(elapsed, self.before_kb, peak_memory_kb())
+        return False
+
+
+class Profiler(object):
+    _null_stage = _NullStage()
+
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.stages = {}
+        self.labels = {}
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+
+    def stage(self, name, label=None):
+        """ Returns a context manager recording one call of stage name, also
+        recorded under label if one is given.
+        """
+        if not self.enabled:
+            return self._null_stage
+
+        stats = [self.stages.setdefault(name, StageStats())]
+        if label is not None:
+            stats.append(self.labels.setdefault(label, {}).setdefault(
+                name, StageStats()))
+        return _Stage(stats)
+
+    def report(self):
+        return {"elapsed": time.time() - self.started,
+                "peak_memory_kb": peak_memory_kb(),
+                "stages": dict((name, s.toDict())
+                               for name, s in self.stages.items()),
+                "labels": dict((label, dict((name, s.toDict())
+                                            for name, s in stages.items()))
+                               for label, stages in self.labels.items())}
+
+    def save(self, file_name):
+        with open(file_name, "w") as handle:
+            json.dump(self.report(), handle, indent=2, sort_keys=True)
+
+
+# The profiler used by every instrumented module
+profiler = Profiler()
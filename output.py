@@ -0,0 +1,111 @@
+###############################################################################
+#
+#    Machine readable reports for the --format flag. Instead of printing
+#    their report, evaluations write it as flat records: dicts whose "record"
+#    field tells what they describe ("document", "summary", "class") and
+#    whose other fields are plain numbers and strings. A writer turns them
+#    into one of
+#
+#        jsonl   one JSON object per line, written as each record comes in
+#        csv     a header row with every field of the track, then one row
+#                per record, written as each record comes in
+#        json    a single JSON object holding a list of records for each kind
+#                of record ("documents", "summaries", ...). Document records
+#                are written as they come in, the others (a few per
+#                evaluation) are kept until the writer is closed.
+#
+#    so that per document records, by far the most numerous, never have to
+#    be held in memory.
+
+import csv
+import json
+
+
+class ResultWriter(object):
+    """ Writes records to stream. fields lists every field records of the
+    track may have, in the order they should be written.
+    """
+    def __init__(self, stream, fields):
+        self.stream = stream
+        self.fields = fields
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        self.stream.flush()
+
+
+class JSONLinesWriter(ResultWriter):
+    def write(self, record):
+        self.stream.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class CSVWriter(ResultWriter):
+    """ Fields a record does not have are left empty. """
+    def __init__(self, stream, fields):
+        super(CSVWriter, self).__init__(stream, fields)
+        self.writer = csv.DictWriter(stream, fields, restval="",
+                                     lineterminator="\n")
+        self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+
+class JSONWriter(ResultWriter):
+    # The key of the list holding each kind of record
+    groups = {"document": "documents",
+              "summary": "summaries",
+              "class": "classes"}
+
+    def __init__(self, stream, fields):
+        super(JSONWriter, self).__init__(stream, fields)
+        self.documents = 0
+        self.pending = []
+        self.stream.write('{"documents": [')
+
+    def write(self, record):
+        record = dict(record)
+        kind = record.pop("record")
+        if kind == "document":
+            self.stream.write(",\n" if self.documents else "\n")
+            self.stream.write(json.dumps(record, sort_keys=True))
+            self.documents += 1
+        else:
+            self.pending.append((kind, record))
+
+    def close(self):
+        self.stream.write("]")
+        for kind in sorted(set(kind for kind, _ in self.pending)):
+            records = [r for k, r in self.pending if k == kind]
+            self.stream.write(",\n{}: {}".format(
+                json.dumps(self.groups.get(kind, kind)),
+                json.dumps(records, sort_keys=True)))
+        self.stream.write("}\n")
+        super(JSONWriter, self).close()
+
+
+class RecordList(ResultWriter):
+    """ Keeps the records in a list instead of writing them anywhere. """
+    def __init__(self, fields=None):
+        super(RecordList, self).__init__(None, fields)
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+WRITERS = {"json": JSONWriter,
+           "jsonl": JSONLinesWriter,
+           "csv": CSVWriter}
+
+# Values of the --format flag, "text" is the usual printed report
+FORMATS = ["text"] + sorted(WRITERS.keys())
+
+
+def get_writer(output_format, stream, fields):
+    return WRITERS[output_format](stream, fields)
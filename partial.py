@@ -0,0 +1,150 @@
+###############################################################################
+#
+#    Sharded evaluation. Large track 1 sweeps are split into shards, each
+#    scoring a share of the documents on its own machine:
+#
+#        evaluate.py track1 --shard 0/4 --partial part0 gold/ system/
+#        ...
+#        evaluate.py track1 --shard 3/4 --partial part3 gold/ system/
+#        evaluate.py merge part0 part1 part2 part3
+#
+#    A shard holds the documents whose id hashes to it (shard_of()), or those
+#    listed in a --manifest file. Instead of a report it writes a
+#    PartialResult: the (tp, fp, fn) counts of every configuration for each
+#    of its documents, gzip compressed JSON. Merging any number of partial
+#    results that together cover every document prints exactly the report a
+#    single run over the whole corpus would have printed.
+#
+#    Documents are reported in an order that depends on the order they were
+#    read in, so every partial result also lists the ids of the whole corpus
+#    in that order, which is cheap to find out for every shard.
+
+import gzip
+import json
+import os
+import zlib
+
+
+def shard_of(doc_id, shards):
+    """ Returns the shard, out of shards, that the document doc_id belongs
+    to. The same on every machine and Python version.
+    """
+    return (zlib.crc32(doc_id) & 0xffffffff) % shards
+
+
+def read_manifest(path):
+    """ Returns the file names or document ids listed in the manifest file at
+    path, one per line. Empty lines and lines starting with # are left out.
+    """
+    with open(path, "r") as handle:
+        return [line.strip() for line in handle
+                if line.strip() and not line.startswith("#")]
+
+
+class PartialResult(object):
+    # Bump whenever the layout of partial result files changes
+    version = 1
+
+    def __init__(self, options, configuration, gold_ids, system_ids,
+                 shard=None):
+        """ options are the PHITrackEvaluation keyword arguments the counts
+        were computed with (with the filter expression rather than compiled
+        filters) and configuration describes them as for
+        incremental.EvaluationState. gold_ids lists the id of every gold
+        document and system_ids the [sys_id, id] of every system document of
+        the whole corpus, in the order evaluate() reads them. shard describes
+        the documents scored, for error messages.
+        """
+        self.options = options
+        self.configuration = configuration
+        self.gold_ids = gold_ids
+        self.system_ids = system_ids
+        self.shard = shard
+        self.systems = {}
+
+    def add(self, sys_id, doc_ids, counts):
+        """ Add the counts of documents scored for sys_id, as returned by
+        PHITrackEvaluation.counts().
+        """
+        documents = self.systems.setdefault(sys_id, {})
+        for doc_id, c in zip(doc_ids, counts):
+            documents[doc_id] = [int(v) for v in c.ravel()]
+
+    def counts(self, sys_id, doc_id):
+        """ Returns the (tp, fp, fn) tuple of each configuration. """
+        flat = self.systems[sys_id][doc_id]
+        return [tuple(flat[i:i + 3]) for i in range(0, len(flat), 3)]
+
+    def expected(self):
+        """ Returns the set of (sys_id, doc_id) documents a run over the whole
+        corpus scores, those of a system with a gold document.
+        """
+        gold = set(self.gold_ids)
+        return set((s, d) for s, d in self.system_ids if d in gold)
+
+    def save(self, path):
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        handle = gzip.open(tmp_path, "wb")
+        try:
+            json.dump({"version": self.version,
+                       "options": self.options,
+                       "configuration": self.configuration,
+                       "gold_ids": self.gold_ids,
+                       "system_ids": self.system_ids,
+                       "shard": self.shard,
+                       "systems": self.systems}, handle,
+                      separators=(",", ":"))
+        finally:
+            handle.close()
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        handle = gzip.open(path, "rb")
+        try:
+            data = json.load(handle)
+        except (IOError, ValueError):
+            raise AssertionError("{} is not a partial result!".format(path))
+        finally:
+            handle.close()
+
+        assert data.get("version") == cls.version, \
+            "{} was written by another version of evaluate.py!".format(path)
+
+        partial = cls(data["options"], data["configuration"],
+                      data["gold_ids"], [tuple(s) for s in data["system_ids"]],
+                      data["shard"])
+        partial.systems = data["systems"]
+        return partial
+
+    @classmethod
+    def merge(cls, partials):
+        """ Returns a PartialResult holding the counts of all the partials,
+        which must come from the same corpus and options and must not score
+        any document twice.
+        """
+        first = partials[0]
+        merged = cls(first.options, first.configuration, first.gold_ids,
+                     first.system_ids)
+        for p in partials:
+            assert (p.options, p.configuration) == \
+                (first.options, first.configuration), \
+                "Shard {} was scored with different options!".format(p.shard)
+            assert (p.gold_ids, p.system_ids) == \
+                (first.gold_ids, first.system_ids), \
+                "Shard {} was scored on another corpus!".format(p.shard)
+            for sys_id, documents in p.systems.items():
+                target = merged.systems.setdefault(sys_id, {})
+                twice = set(target) & set(documents)
+                assert not twice, "Shard {} scores {} again!".format(
+                    p.shard, sorted(twice)[0])
+                target.update(documents)
+
+        missing = merged.expected() - set(
+            (s, d) for s, documents in merged.systems.items()
+            for d in documents)
+        assert not missing, \
+            "{} documents are in none of the partial results, eg. {}".format(
+                len(missing), sorted(missing)[0][1])
+
+        return merged
@@ -0,0 +1,108 @@
+###############################################################################
+#
+#    Resampling statistics over per document (tp, fp, fn) counts, as returned
+#    by Evaluate.counts() and PHITrackEvaluation.counts(). Counts are arrays
+#    of shape (documents, ..., 3); every function works on all trailing
+#    configurations at once so a whole PHI track report is handled in a
+#    single vectorized pass.
+
+import numpy
+
+# Upper bound on the number of entries of the (resamples, documents) matrices
+# built at once, resamples are processed in chunks below it.
+MAX_CHUNK_ENTRIES = 1 << 22
+
+
+def micro_scores(sums):
+    """ Returns the micro (precision, recall, F1) arrays of an array of summed
+    (tp, fp, fn) counts of shape (..., 3). Undefined ratios are 0.0, as in
+    Evaluate.
+    """
+    sums = numpy.asarray(sums, dtype=float)
+    tp, fp, fn = sums[..., 0], sums[..., 1], sums[..., 2]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        precision = numpy.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = numpy.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = numpy.where(precision + recall > 0,
+                         2 * precision * recall / (precision + recall), 0.0)
+    return precision, recall, f1
+
+
+def chunks(total, documents):
+    size = max(1, MAX_CHUNK_ENTRIES // max(1, documents))
+    for start in range(0, total, size):
+        yield min(size, total - start)
+
+
+def bootstrap_intervals(counts, resamples=10000, confidence=0.95, seed=None):
+    """ Percentile bootstrap confidence intervals of micro precision, recall
+    and F1. Documents are drawn with replacement as a (resamples, documents)
+    index matrix, which is turned into per resample document multiplicities
+    so that the counts of every resample and configuration are summed by a
+    single matrix product.
+
+    Returns a dict mapping "precision", "recall" and "F1" to a (lower, upper)
+    pair of arrays of shape counts.shape[1:-1].
+    """
+    counts = numpy.asarray(counts, dtype=float)
+    documents = counts.shape[0]
+    flat = counts.reshape(documents, -1)
+    rng = numpy.random.RandomState(seed)
+
+    sums = []
+    for size in chunks(resamples, documents):
+        index = rng.randint(0, documents, size=(size, documents))
+        index += numpy.arange(size)[:, None] * documents
+        weights = numpy.bincount(index.ravel(), minlength=size * documents)
+        sums.append(weights.reshape(size, documents).astype(float).dot(flat))
+
+    sums = numpy.concatenate(sums).reshape((resamples,) + counts.shape[1:])
+    alpha = (1 - confidence) / 2.0
+    bounds = [100 * alpha, 100 * (1 - alpha)]
+
+    intervals = {}
+    for measure, values in zip(("precision", "recall", "F1"),
+                               micro_scores(sums)):
+        lower, upper = numpy.percentile(values, bounds, axis=0)
+        intervals[measure] = (lower, upper)
+    return intervals
+
+
+def randomization_test(a, b, permutations=10000, seed=None):
+    """ Paired approximate randomization test of the difference in micro F1
+    between two systems scored on the same documents. a and b are their
+    per document counts, with documents in the same order. Each permutation
+    swaps the counts of the two systems on a random half of the documents;
+    with S the (permutations, documents) 0/1 swap matrix and D = b - a, the
+    permuted sums of a are sum(a) + S.D and those of b are sum(b) - S.D.
+
+    Returns the observed F1 differences (b - a) and their two sided
+    p-values, (r + 1) / (permutations + 1) where r is the number of
+    permutations with an absolute difference at least as large, both as
+    arrays of shape a.shape[1:-1].
+    """
+    a = numpy.asarray(a, dtype=float)
+    b = numpy.asarray(b, dtype=float)
+    assert a.shape == b.shape, "Both systems must have the same documents!"
+
+    documents = a.shape[0]
+    difference = (b - a).reshape(documents, -1)
+    a_sums = a.sum(axis=0).reshape(-1)
+    b_sums = b.sum(axis=0).reshape(-1)
+    shape = a.shape[1:]
+
+    observed = micro_scores(b_sums.reshape(shape))[2] - \
+        micro_scores(a_sums.reshape(shape))[2]
+    # Allow for rounding when comparing permuted and observed differences
+    threshold = numpy.abs(observed) - 1e-12
+
+    rng = numpy.random.RandomState(seed)
+    extreme = numpy.zeros(observed.shape, dtype=numpy.int64)
+    for size in chunks(permutations, documents):
+        swaps = rng.randint(0, 2, size=(size, documents)).astype(float)
+        shift = swaps.dot(difference)
+        permuted = micro_scores((b_sums - shift).reshape((size,) + shape))[2] \
+            - micro_scores((a_sums + shift).reshape((size,) + shape))[2]
+        extreme += (numpy.abs(permuted) >= threshold).sum(axis=0)
+
+    return observed, (extreme + 1.0) / (permutations + 1.0)
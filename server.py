@@ -0,0 +1,373 @@
+###############################################################################
+#
+#   Resident evaluation server. Every evaluate.py run pays for importing
+# numpy, scipy and lxml and for parsing the whole gold standard again. The
+# server does both once and then scores any number of system outputs against
+# the gold standard it keeps in memory, over HTTP on localhost:
+#
+# $> python server.py --gold gold/ --rdoc-gold rdoc_gold/ --jobs 4
+#
+#   Requests are JSON objects POSTed to /track1 or /track2. They name either
+# a system directory on the same machine or carry the system documents
+# themselves, by file name:
+#
+#   {"system": "/path/to/system/"}
+#   {"documents": {"100-01.xml": "<?xml ...", ...}}
+#
+# Track 1 requests may also set "verbose", "filter", "conjunctive", "invert",
+# "overlap", "bootstrap", "confidence" and "seed", like the evaluate.py flags
+# of the same name, and track 2 requests "verbose". The response holds the records
+# evaluate.py --format jsonl writes (see output.py) and the warnings printed
+# while reading the system documents:
+#
+#   {"records": [{"record": "summary", "label": "Strict", ...}, ...],
+#    "warnings": ["WARNING: ...", ...]}
+#
+#   Requests that cannot be evaluated (a missing directory, documents whose
+# text differs from the gold standard, a bad filter, ...) get a 400 response
+# with an "error" message instead of records. GET /status describes the gold
+# standards loaded.
+#
+#   Evaluations run in a pool of --jobs worker processes, which share the
+# gold standard parsed before they were started. At most --max-pending
+# requests are taken at once, running or waiting for a worker; any more are
+# turned away with 503 until one of them is done. An evaluation that does
+# not finish within --timeout seconds, say because its worker was killed,
+# gets a 500 response and the pool is replaced by a new one, as the task of
+# a dead worker is never finished. The gold standard is not read again while
+# the server runs, restart it when the gold standard changes.
+
+import argparse
+import BaseHTTPServer
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+from StringIO import StringIO
+
+from classes import PHITrackEvaluation
+from evaluate import evaluate_rdoc
+from evaluate import get_document_dict_by_system_id
+from evaluate import get_predicate_function
+from evaluate import load_annotations
+from evaluate import load_rdoc_predictions
+from output import RecordList
+
+# Request fields passed on to the evaluation of each track
+OPTIONS = {"track1": ["verbose", "filter", "conjunctive", "invert",
+                      "overlap", "bootstrap", "confidence", "seed"],
+           "track2": ["verbose"]}
+
+# Number of different filter expressions whose masks a worker keeps with the
+# gold tag rows before dropping them all
+MAX_CACHED_FILTERS = 64
+
+# Gold standards shared by the worker processes, set by _init_worker()
+_gold = {}
+
+
+def _init_worker(gold_sa, rdoc_gold_dir, rdoc_gold):
+    _gold.update(gold_sa=gold_sa, rdoc_gold_dir=rdoc_gold_dir,
+                 rdoc_gold=rdoc_gold, gold_rows={}, filters=set())
+
+
+def evaluate_track1(system_dir, options):
+    kwargs = {}
+    if options.get("filter"):
+        kwargs = dict(invert=bool(options.get("invert")),
+                      conjunctive=bool(options.get("conjunctive")),
+                      filters=[get_predicate_function(a)
+                               for a in options["filter"].split(",")])
+
+        # The gold tag rows cache a mask for every filter expression they
+        # have seen, which would grow with every new expression requested
+        expressions = set(repr(f) for f in kwargs["filters"])
+        if len(_gold["filters"] | expressions) > MAX_CACHED_FILTERS:
+            _gold["gold_rows"].clear()
+            _gold["filters"].clear()
+        _gold["filters"].update(expressions)
+    if options.get("overlap"):
+        kwargs["overlap"] = True
+
+    systems = get_document_dict_by_system_id([system_dir])
+    assert len(systems) > 0, "No XML documents to evaluate!"
+
+    verbose = bool(options.get("verbose"))
+    writer = RecordList()
+    for sys_id, system_sa in sorted(systems.items()):
+        e = PHITrackEvaluation(system_sa, _gold["gold_sa"],
+                               gold_rows=_gold["gold_rows"],
+                               writer=writer if verbose else None, **kwargs)
+        if options.get("bootstrap"):
+            e.bootstrap(resamples=int(options["bootstrap"]),
+                        confidence=float(options.get("confidence", 0.95)),
+                        seed=options.get("seed"))
+        e.write_report(writer, verbose=verbose)
+    return writer.records
+
+
+def evaluate_track2(system_dir, options):
+    writer = RecordList()
+    evaluate_rdoc(_gold["rdoc_gold_dir"], system_dir,
+                  verbose=bool(options.get("verbose")), writer=writer,
+                  gold=_gold["rdoc_gold"])
+    return writer.records
+
+
+EVALUATORS = {"track1": evaluate_track1, "track2": evaluate_track2}
+
+
+def _run(track, system_dir, options):
+    """ Evaluate system_dir in a worker process. Returns the HTTP status and
+    the response.
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        try:
+            response = {"records": EVALUATORS[track](system_dir, options)}
+            status = 200
+        # The evaluation code reports bad input through assertions and plain
+        # Exceptions, so anything raised is the request's fault.
+        except Exception as e:
+            response = {"error": str(e) or e.__class__.__name__}
+            status = 400
+        response["warnings"] = sys.stdout.getvalue().splitlines()
+    finally:
+        sys.stdout = stdout
+
+    return status, response
+
+
+class RequestError(Exception):
+    pass
+
+
+class EvaluationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"error": "Unknown path {}".format(self.path)})
+        else:
+            self.send_json(200, self.server.status())
+
+    def do_POST(self):
+        track = self.path.strip("/")
+        if track not in EVALUATORS:
+            self.send_json(404, {"error": "Unknown path {}".format(self.path)})
+            return
+
+        try:
+            length = int(self.headers.getheader("content-length", 0))
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise ValueError
+        except ValueError:
+            self.send_json(400, {"error": "Requests must be JSON objects"})
+            return
+
+        self.send_json(*self.server.evaluate(track, request))
+
+    def send_json(self, status, response):
+        body = json.dumps(response, sort_keys=True)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class EvaluationServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ HTTP server scoring system outputs against the gold standards in
+    gold_dir (track 1) and rdoc_gold_dir (track 2), either of which may be
+    None. Each request is handled in its own thread, which hands the
+    evaluation over to a pool of jobs worker processes and waits at most
+    timeout seconds for it.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, gold_dir=None, rdoc_gold_dir=None, jobs=1,
+                 max_pending=None, timeout=600):
+        BaseHTTPServer.HTTPServer.__init__(self, address, EvaluationHandler)
+
+        self.gold_dir = gold_dir
+        self.rdoc_gold_dir = rdoc_gold_dir
+
+        gold_sa = {}
+        if gold_dir is not None:
+            for sa in load_annotations([os.path.join(gold_dir, fn)
+                                        for fn in os.listdir(gold_dir)],
+                                       jobs=jobs):
+                gold_sa[sa.id] = sa
+        self.gold_documents = len(gold_sa)
+
+        rdoc_gold = None
+        if rdoc_gold_dir is not None:
+            rdoc_gold = load_rdoc_predictions(rdoc_gold_dir)
+
+        self.jobs = jobs
+        self.max_pending = max_pending or 2 * jobs
+        self.pending = threading.BoundedSemaphore(self.max_pending)
+        self.timeout = timeout
+        self.pool_args = (jobs, _init_worker,
+                          (gold_sa, rdoc_gold_dir, rdoc_gold))
+        self.pool_lock = threading.Lock()
+        self.pool = multiprocessing.Pool(*self.pool_args)
+        self.rdoc_documents = len(rdoc_gold or {})
+
+    def status(self):
+        tracks = {}
+        if self.gold_dir is not None:
+            tracks["track1"] = {"gold": self.gold_dir,
+                                "documents": self.gold_documents}
+        if self.rdoc_gold_dir is not None:
+            tracks["track2"] = {"gold": self.rdoc_gold_dir,
+                                "documents": self.rdoc_documents}
+        return {"tracks": tracks, "jobs": self.jobs,
+                "max_pending": self.max_pending}
+
+    def system_dir(self, request, temporary):
+        """ Returns the directory holding the system documents of request,
+        uploaded documents are written to the temporary directory.
+        """
+        if "documents" in request:
+            documents = request["documents"]
+            if not isinstance(documents, dict) or not documents:
+                raise RequestError("documents must map file names to XML")
+            for name, content in documents.items():
+                name = os.path.basename(name)
+                if not name.endswith(".xml"):
+                    raise RequestError("{} is not an XML file name".format(
+                        name))
+                if not isinstance(content, basestring):
+                    raise RequestError("The content of {} is not a "
+                                       "string".format(name))
+                with open(os.path.join(temporary, name), "w") as handle:
+                    handle.write(content.encode("utf8"))
+            return temporary
+
+        if "system" in request:
+            directory = request["system"]
+            if not isinstance(directory, basestring) or \
+               not os.path.isdir(directory):
+                raise RequestError("{} is not a directory".format(directory))
+            return directory
+
+        raise RequestError("Requests need a system directory or documents")
+
+    def evaluate(self, track, request):
+        """ Returns the HTTP status and response of an evaluation request. """
+        if getattr(self, "gold_dir" if track == "track1"
+                   else "rdoc_gold_dir") is None:
+            return 404, {"error": "No gold standard loaded for " + track}
+
+        if not self.pending.acquire(False):
+            return 503, {"error": "Too many pending requests"}
+
+        temporary = tempfile.mkdtemp(prefix="cegs-server-")
+        try:
+            system_dir = os.path.join(self.system_dir(request, temporary), "")
+            options = dict((k, request[k]) for k in OPTIONS[track]
+                           if k in request)
+            with self.pool_lock:
+                pool = self.pool
+                result = pool.apply_async(_run, (track, system_dir, options))
+            deadline = time.time() + self.timeout
+            # Wait in short steps to notice the pool being replaced because
+            # of another request
+            while True:
+                try:
+                    return result.get(max(0, min(1, deadline - time.time())))
+                except multiprocessing.TimeoutError:
+                    if self.pool is not pool:
+                        return 500, {"error": "The evaluation was lost when "
+                                              "the workers were restarted"}
+                    if time.time() >= deadline:
+                        self.restart_pool(pool)
+                        return 500, {"error": "The evaluation did not finish "
+                                              "within {} seconds".format(
+                                                  self.timeout)}
+        except RequestError as e:
+            return 400, {"error": str(e)}
+        finally:
+            shutil.rmtree(temporary)
+            self.pending.release()
+
+    def restart_pool(self, pool):
+        """ Replace pool, which holds a task that did not finish, by a new
+        pool. A worker that died is replaced by the pool, but its task is
+        never finished, and the remaining workers may be stuck as well. The
+        other evaluations running in pool are lost.
+        """
+        with self.pool_lock:
+            if self.pool is not pool:
+                # Another request already replaced it
+                return
+            self.pool = multiprocessing.Pool(*self.pool_args)
+        pool.terminate()
+        pool.join()
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up before reading their response are not errors
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident evaluation server")
+    parser.add_argument("--gold", metavar="DIR",
+                        help="track 1 gold standard directory")
+    parser.add_argument("--rdoc-gold", metavar="DIR",
+                        help="track 2 gold standard directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes running evaluations")
+    parser.add_argument("--max-pending", type=int,
+                        help="number of requests taken at once "
+                             "(default twice --jobs)")
+    parser.add_argument("--timeout", metavar="SECONDS", type=float,
+                        default=600,
+                        help="time an evaluation may take before its workers "
+                             "are restarted (default 600)")
+    args = parser.parse_args()
+
+    if args.gold is None and args.rdoc_gold is None:
+        parser.error("at least one of --gold and --rdoc-gold is needed")
+    for directory in (args.gold, args.rdoc_gold):
+        if directory is not None and not os.path.isdir(directory):
+            parser.error("{} is not a directory".format(directory))
+
+    server = EvaluationServer((args.host, args.port),
+                              gold_dir=args.gold and os.path.abspath(args.gold),
+                              rdoc_gold_dir=args.rdoc_gold and
+                              os.path.abspath(args.rdoc_gold),
+                              jobs=args.jobs, max_pending=args.max_pending,
+                              timeout=args.timeout)
+    # Stop cleanly on SIGTERM as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print("Serving on http://{}:{}/".format(*server.server_address))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
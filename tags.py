@@ -15,6 +15,10 @@
 #    which may be dynamically changed at run time (see strict_equality() and
 #    fuzzy_end_equality() class methods for examples of what this looks like)
 #
+#    Tags use __slots__ rather than a per instance __dict__. PHI tags parse their
+#    offsets into ints once and intern their name and TYPE into small integer
+#    codes (see Vocabulary) so that hashing and comparing them is cheap.
+#
 #    Class hierarchy reference
 #
 #    [+]Tag
@@ -31,15 +35,57 @@
 #             [+]OtherTag
 
 from lxml import etree
+from collections import namedtuple
 from collections import OrderedDict
 
 
+# Lightweight stand in for an lxml element. It carries just enough to build
+# a Tag from attributes that have already been read, once the element itself
+# has been freed.
+TagElement = namedtuple("TagElement", ["tag", "attrib"])
+
+
+class Vocabulary(object):
+    """ Interns strings into small integer codes. Codes are handed out in order
+    of first appearance, so only the values the vocabulary is created with
+    are guaranteed to have the same code in every process.
+    """
+    def __init__(self, values=()):
+        self.codes = {}
+        self.values = []
+        for v in values:
+            self.code(v)
+
+    def code(self, value):
+        try:
+            return self.codes[value]
+        except KeyError:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+            return self.codes[value]
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+def attribute_string(value):
+    """ Return value as it should be written out to an XML attribute. """
+    if isinstance(value, basestring):
+        return value
+    return unicode(value)
+
+
 class Tag(object):
     """ Base Tag object,  implements conversion of lxml element.tag to self.name
     implements 'magic' functions like __eq__ and __hash__ based on the _get_key
     function. Also defines functions for converting tags to different formats
     like back to lxml Element classes and to just plain attribute dictionaries.
     """
+    __slots__ = ("_name", "id")
+
     attributes = OrderedDict()
 
     def __init__(self, element):
@@ -49,6 +95,26 @@ class Tag(object):
         except KeyError:
             self.id = ""
 
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+
+    def __getstate__(self):
+        state = {"name": self.name}
+        for cls in type(self).__mro__:
+            for slot in cls.__dict__.get("__slots__", ()):
+                if not slot.startswith("_") and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def _get_key(self):
         key = []
         for k in self.key:
@@ -97,9 +163,9 @@ class Tag(object):
         for k, validp in self.attributes.items():
             try:
                 if validp(getattr(self, k)):
-                    element.attrib[k] = getattr(self, k)
+                    element.attrib[k] = attribute_string(getattr(self, k))
                 else:
-                    element.attrib[k] = getattr(self, k)
+                    element.attrib[k] = attribute_string(getattr(self, k))
                     print("WARNING: Expected attribute '%s' for tag %s was "
                           "not valid ('%s')" % (k, "<%s (%s)>" % (self.name,
                                                                   self.id),
@@ -114,7 +180,8 @@ class Tag(object):
 
     def __repr__(self):
         return "<{0}: {1}>".format(self.__class__.__name__,
-                                   ", ".join(self._get_key()))
+                                   ", ".join(attribute_string(getattr(self, k))
+                                             for k in self.key))
 
     def toXML(self):
         return etree.tostring(self.toElement(), encoding='unicode')
@@ -133,6 +200,21 @@ class Tag(object):
         return d
 
 
+class DocumentTag(Tag):
+    """ Document level annotation made by
+    AnnotatorTag.get_document_annotation(). It carries the key attributes
+    of the annotator tag it was made from, and tags with the same key
+    attributes (whatever their case) are equal. The annotator tags it stands
+    for are kept in annotator_tags.
+    """
+    def __init__(self, element):
+        super(DocumentTag, self).__init__(element)
+        self.key = list(element.attrib.keys())
+        for k in self.key:
+            setattr(self, k, element.attrib[k])
+        self.annotator_tags = []
+
+
 def isint(x):
     try:
         int(x)
@@ -147,6 +229,8 @@ class AnnotatorTag(Tag):
     to a DocumentTag - a tag designed to annotate document level information
     rather than specific positional information.
     """
+    __slots__ = ("docid", "start", "end", "text")
+
     attributes = OrderedDict()
     attributes["id"] = lambda v: True
     attributes["docid"] = lambda v: True
@@ -156,36 +240,46 @@ class AnnotatorTag(Tag):
 
     key = ["name"]
 
+    offsets = ("start", "end")
+
     def __repr__(self):
         try:
-            return "<{0}: {1} s:{2} e:{3}>".format(self.__class__.__name__,
-                                                   ", ".join(self._get_key()),
-                                                   self.start, self.end)
+            return "<{0}: {1} s:{2} e:{3}>".format(
+                self.__class__.__name__,
+                ", ".join(attribute_string(getattr(self, k))
+                          for k in self.key),
+                self.start, self.end)
         except AttributeError:
             return super(Tag, self).__repr__()
 
     def __init__(self, element):
         super(AnnotatorTag, self).__init__(element)
         self.id = None
-
-        for k, validp in self.attributes.items():
-            if k in element.attrib.keys():
-                if validp(element.attrib[k]):
-                    setattr(self, k, element.attrib[k])
+        attrib = element.attrib
+
+        for k, validp in self.attributes.iteritems():
+            if k in attrib:
+                value = attrib[k]
+                if validp(value):
+                    # Offsets are parsed once here rather than every time
+                    # they are compared.
+                    if k in self.offsets:
+                        setattr(self, k, int(value))
+                    else:
+                        setattr(self, k, value)
                 else:
                     fstr = "WARNING: Expected attribute '{}' for xml element "
                     fstr += "<{} ({})>  was not valid ('{}')"
                     print(fstr.format(k, element.tag,
-                                      element.attrib['id']
-                                      if 'id' in element.attrib.keys() else '',
-                                      element.attrib[k]))
-                    setattr(self, k, element.attrib[k])
+                                      attrib['id'] if 'id' in attrib else '',
+                                      value))
+                    setattr(self, k, value)
 
             elif k in self.key:
                 fstr = "WARNING: Expected attribute '{}' for xml element "
                 fstr += "<{} ('{}')>, setting to ''"
-                print(fstr.format(k, element.tag, element.attrib['id']
-                                  if 'id' in element.attrib.keys() else ''))
+                print(fstr.format(k, element.tag,
+                                  attrib['id'] if 'id' in attrib else ''))
 
                 setattr(self, k, '')
 
@@ -243,8 +337,10 @@ class AnnotatorTag(Tag):
 
     def get_document_annotation(self):
         element = etree.Element(self.name)
-        for k, v in zip(self.key, self._get_key()):
-            element.attrib[k] = v
+        # _get_key() holds interned codes for some attributes (see PHITag),
+        # the document annotation is written with the values as written
+        for k in self.key:
+            element.attrib[k] = attribute_string(getattr(self, k))
         return DocumentTag(element)
 
     def get_start(self):
@@ -261,6 +357,8 @@ class AnnotatorTag(Tag):
 
 
 class PHITag(AnnotatorTag):
+    __slots__ = ("_TYPE", "comment", "name_code", "TYPE_code")
+
     valid_TYPE = ["PATIENT", "DOCTOR", "USERNAME", "PROFESSION", "ROOM",
                   "DEPARTMENT", "HOSPITAL", "ORGANIZATION", "STREET", "CITY",
                   "STATE", "COUNTRY", "ZIP", "OTHER", "LOCATION-OTHER", "AGE",
@@ -272,10 +370,42 @@ class PHITag(AnnotatorTag):
 
     key = AnnotatorTag.key + ["start", "end", "TYPE"]
 
+    # Key attributes that are compared through their interned (upper case)
+    # code rather than their string value.
+    key_codes = {"name": "name_code", "TYPE": "TYPE_code"}
+
+    @AnnotatorTag.name.setter
+    def name(self, value):
+        self._name = value
+        self.name_code = PHITag.names.code(value.upper())
+
+    @property
+    def TYPE(self):
+        return self._TYPE
+
+    @TYPE.setter
+    def TYPE(self, value):
+        self._TYPE = value
+        self.TYPE_code = PHITag.types.code(value.upper())
+
+    def __getstate__(self):
+        state = super(PHITag, self).__getstate__()
+        # Codes are process local, they are recomputed when TYPE is set again
+        del state["name_code"]
+        state.pop("TYPE_code", None)
+        try:
+            state["TYPE"] = self.TYPE
+        except AttributeError:
+            pass
+        return state
+
     def _get_key(self):
         key = []
         for k in self.key:
-            key.append(getattr(self, k).upper())
+            value = getattr(self, self.key_codes.get(k, k))
+            if isinstance(value, basestring):
+                value = value.upper()
+            key.append(value)
         return tuple(key)
 
     def exact_equals(self, other):
@@ -286,18 +416,24 @@ class PHITag(AnnotatorTag):
 
 
 class NameTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = ['PATIENT', 'DOCTOR', 'USERNAME']
     attributes = OrderedDict(PHITag.attributes.items())
     attributes['TYPE'] = lambda v: v.upper() in NameTag.valid_TYPE
 
 
 class ProfessionTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = ["PROFESSION"]
     attributes = OrderedDict(PHITag.attributes.items())
     attributes['TYPE'] = lambda v: v.upper() in ProfessionTag.valid_TYPE
 
 
 class LocationTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = ['ROOM', 'DEPARTMENT', 'HOSPITAL', 'ORGANIZATION', 'STREET',
                   'CITY', 'STATE', 'COUNTRY', 'ZIP', 'LOCATION-OTHER']
     attributes = OrderedDict(PHITag.attributes.items())
@@ -305,24 +441,32 @@ class LocationTag(PHITag):
 
 
 class AgeTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = ['AGE']
     attributes = OrderedDict(PHITag.attributes.items())
     attributes['TYPE'] = lambda v: v.upper() in AgeTag.valid_TYPE
 
 
 class DateTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = ['DATE']
     attributes = OrderedDict(PHITag.attributes.items())
     attributes['TYPE'] = lambda v: v.upper() in DateTag.valid_TYPE
 
 
 class ContactTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = ['PHONE', 'FAX', 'EMAIL', 'URL', 'IPADDR']
     attributes = OrderedDict(PHITag.attributes.items())
     attributes['TYPE'] = lambda v: v.upper() in ContactTag.valid_TYPE
 
 
 class IDTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = ['SSN', 'MEDICALRECORD', 'HEALTHPLAN', 'ACCOUNT',
                   'LICENSE', 'VEHICLE', 'DEVICE', 'BIOID', 'IDNUM']
     attributes = OrderedDict(PHITag.attributes.items())
@@ -330,6 +474,8 @@ class IDTag(PHITag):
 
 
 class OtherTag(PHITag):
+    __slots__ = ()
+
     valid_TYPE = 'OTHER'
     attributes = OrderedDict(PHITag.attributes.items())
     attributes['TYPE'] = lambda v: v.upper() in OtherTag.valid_TYPE
@@ -346,6 +492,11 @@ PHITag.tag_types = {
     "ID": IDTag,
     "OTHER": OtherTag}
 
+# Seed the vocabularies with every known value so these get the same code in
+# every process.
+PHITag.names = Vocabulary(sorted(PHITag.tag_types.keys()))
+PHITag.types = Vocabulary(PHITag.valid_TYPE)
+
 
 PHI_TAG_CLASSES = [NameTag,
                    ProfessionTag,
@@ -0,0 +1,90 @@
+###############################################################################
+#
+#   Helpers shared by the tests: synthetic corpora (see benchmarks/corpus.py)
+# and running evaluate.py as a separate process, killed if it does not finish
+# in time so that a hanging run fails its test instead of the whole suite.
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from StringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import corpus
+
+
+class quiet(object):
+    """ Swallows everything printed to stdout. """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        return sys.stdout
+
+    def __exit__(self, *exc_info):
+        sys.stdout = self.stdout
+
+
+class CorpusTestCase(object):
+    """ Mixin giving each test a synthetic track 1 corpus in self.gold and
+    self.system (directory names end with a slash, as evaluate.py expects)
+    inside the temporary directory self.directory.
+    """
+    docs = 24
+    seed = 0
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="cegs-test-")
+        corpus.generate_track1(self.directory, docs=self.docs, words=200,
+                               seed=self.seed)
+        self.gold = os.path.join(self.directory, "gold", "")
+        self.system = os.path.join(self.directory, "system", "")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def break_file(self, file_name):
+        """ Replace file_name with a file that is not well formed XML. """
+        with open(file_name, "w") as handle:
+            handle.write("<?xml version='1.0'?>\n<deIdi2b2><TEXT>")
+
+
+def run_evaluate(args, timeout=120):
+    """ Runs evaluate.py with the list of args. Returns its exit status,
+    stdout and stderr; the exit status is None if it was killed after
+    timeout seconds.
+    """
+    process = subprocess.Popen([sys.executable,
+                                os.path.join(ROOT, "evaluate.py")] + args,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               cwd=ROOT, preexec_fn=os.setsid)
+    killed = []
+
+    def kill():
+        # Worker processes are in the same process group
+        killed.append(True)
+        os.killpg(process.pid, signal.SIGKILL)
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        timer.cancel()
+
+    return (None if killed else process.returncode), stdout, stderr
+
+
+def report(output):
+    """ output without the warnings printed while parsing. """
+    return "\n".join(line for line in output.splitlines()
+                     if not line.startswith("WARNING"))
@@ -0,0 +1,133 @@
+###############################################################################
+#
+#   Staleness of the parse cache (--cache-dir) and of incremental state
+# (--incremental): a file that changed after it was cached or scored must be
+# parsed and scored again.
+
+import os
+import re
+import shutil
+import unittest
+
+import support
+from cache import AnnotationCache
+from classes import StandoffAnnotation
+
+
+def shift_first_tag(file_name):
+    """ Move the start of the first tag of file_name one character back
+    without changing the size of the file.
+    """
+    with open(file_name, "r") as handle:
+        content = handle.read()
+    changed = re.sub(r'start="(\d*[1-9])"',
+                     lambda m: 'start="{}"'.format(int(m.group(1)) - 1),
+                     content, count=1)
+    assert len(changed) == len(content) and changed != content
+    stat = os.stat(file_name)
+    with open(file_name, "w") as handle:
+        handle.write(changed)
+    # Make sure the change is seen even on coarse grained file systems
+    os.utime(file_name, (stat.st_atime, stat.st_mtime + 5))
+
+
+def drop_first_tag(file_name):
+    with open(file_name, "r") as handle:
+        lines = handle.readlines()
+    first = next(i for i, line in enumerate(lines)
+                 if line.startswith("<") and " start=" in line)
+    with open(file_name, "w") as handle:
+        handle.writelines(lines[:first] + lines[first + 1:])
+
+
+def tags(sa):
+    return [(t.name, t.TYPE, t.start, t.end) for t in sa.get_phi()]
+
+
+class AnnotationCacheTest(support.CorpusTestCase, unittest.TestCase):
+    def setUp(self):
+        super(AnnotationCacheTest, self).setUp()
+        self.cache = AnnotationCache(self.path("cache"))
+        self.file_name = os.path.join(self.system,
+                                      sorted(os.listdir(self.system))[0])
+
+    def load(self):
+        with support.quiet():
+            return self.cache.load(self.file_name), \
+                StandoffAnnotation(self.file_name)
+
+    def test_cached_equals_parsed(self):
+        self.load()
+        cached, parsed = self.load()
+        self.assertEqual(tags(cached), tags(parsed))
+        self.assertEqual(cached.text_digest, parsed.text_digest)
+        self.assertEqual(cached.id, parsed.id)
+
+    def test_changed_file_of_same_size(self):
+        before = self.load()[0]
+        shift_first_tag(self.file_name)
+        cached, parsed = self.load()
+        self.assertNotEqual(tags(cached), tags(before))
+        self.assertEqual(tags(cached), tags(parsed))
+
+    def test_changed_file(self):
+        self.load()
+        drop_first_tag(self.file_name)
+        cached, parsed = self.load()
+        self.assertEqual(tags(cached), tags(parsed))
+
+    def test_broken_entry(self):
+        self.load()
+        with open(self.cache.entry_path(self.file_name), "w") as handle:
+            handle.write("not an entry")
+        cached, parsed = self.load()
+        self.assertEqual(tags(cached), tags(parsed))
+
+
+class IncrementalTest(support.CorpusTestCase, unittest.TestCase):
+    def evaluate(self, *args):
+        status, stdout, stderr = support.run_evaluate(
+            ["track1", "-v"] + list(args) + [self.gold, self.system])
+        self.assertEqual(status, 0, stderr)
+        return support.report(stdout)
+
+    def incremental(self):
+        return self.evaluate("--incremental", self.path("state.json"))
+
+    def system_file(self, i):
+        return os.path.join(self.system, sorted(os.listdir(self.system))[i])
+
+    def test_unchanged(self):
+        expected = self.evaluate()
+        self.assertEqual(self.incremental(), expected)
+        self.assertEqual(self.incremental(), expected)
+
+    def test_changed_documents(self):
+        before = self.incremental()
+        drop_first_tag(self.system_file(0))
+        shift_first_tag(self.system_file(1))
+        shift_first_tag(os.path.join(self.gold, os.path.basename(
+            self.system_file(2))))
+        after = self.incremental()
+        self.assertNotEqual(after, before)
+        self.assertEqual(after, self.evaluate())
+
+    def test_added_and_removed_documents(self):
+        self.incremental()
+        removed = self.system_file(0)
+        shutil.move(removed, self.path("removed.xml"))
+        self.assertEqual(self.incremental(), self.evaluate())
+        shutil.move(self.path("removed.xml"), removed)
+        self.assertEqual(self.incremental(), self.evaluate())
+
+    def test_other_options(self):
+        # State written for other filters is not used
+        self.incremental()
+        self.assertEqual(
+            self.evaluate("--incremental", self.path("state.json"),
+                          "--filter", "NAME OR start < 400"),
+            self.evaluate("--filter", "NAME OR start < 400"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+###############################################################################
+#
+#   The --filter expression parser and the agreement of Filter.mask() over
+# whole documents with filters applied one tag or token at a time.
+
+import os
+import unittest
+
+import support
+from classes import EvaluationConfiguration
+from classes import EvaluateTokenizedPHI
+from classes import PHITrackEvaluation
+from classes import StandoffAnnotation
+from classes import _DocumentRows
+from filters import FilterError
+from filters import TagColumns
+from filters import compile_filter
+
+EXPRESSIONS = ["NAME", "DATE", "LOCATION/CITY", "TYPE = DATE",
+               "NAME OR LOCATION AND NOT TYPE = CITY",
+               "(NAME OR LOCATION) AND start >= 100",
+               "NOT length < 5", "end <= 300 | AGE & !ID",
+               "length = 4 OR length != 10"]
+
+
+class ParserTest(unittest.TestCase):
+    def parsed(self, expression):
+        return repr(compile_filter(expression))
+
+    def test_precedence(self):
+        # NOT binds tighter than AND, which binds tighter than OR
+        self.assertEqual(self.parsed("NAME OR DATE AND TYPE = ZIP"),
+                         "(name = NAME) OR ((name = DATE) AND (TYPE = ZIP))")
+        self.assertEqual(self.parsed("NAME AND DATE OR AGE"),
+                         "((name = NAME) AND (name = DATE)) OR (name = AGE)")
+        self.assertEqual(self.parsed("NOT NAME AND DATE"),
+                         "(NOT (name = NAME)) AND (name = DATE)")
+        self.assertEqual(self.parsed("NOT NOT NAME"),
+                         "NOT (NOT (name = NAME))")
+
+    def test_parentheses(self):
+        self.assertEqual(self.parsed("NOT (NAME OR DATE)"),
+                         "NOT ((name = NAME) OR (name = DATE))")
+        self.assertEqual(self.parsed("(NAME OR DATE) AND AGE"),
+                         "((name = NAME) OR (name = DATE)) AND (name = AGE)")
+        self.assertEqual(self.parsed("((NAME))"), "name = NAME")
+
+    def test_symbols_and_case(self):
+        self.assertEqual(self.parsed("!NAME | DATE & AGE"),
+                         self.parsed("NOT NAME OR DATE AND AGE"))
+        self.assertEqual(self.parsed("name or not location/city"),
+                         self.parsed("NAME OR NOT LOCATION/CITY"))
+
+    def test_atoms(self):
+        # A bare word that is both a tag name and a TYPE is the tag name
+        self.assertEqual(self.parsed("DATE"), "name = DATE")
+        self.assertEqual(self.parsed("TYPE = DATE"), "TYPE = DATE")
+        self.assertEqual(self.parsed("CITY"), "TYPE = CITY")
+        self.assertEqual(self.parsed("name = location"), "name = LOCATION")
+        self.assertEqual(self.parsed("LOCATION/CITY"),
+                         "(name = LOCATION) AND (TYPE = CITY)")
+        self.assertEqual(self.parsed("start >= 100 AND length<5"),
+                         "(start >= 100) AND (length < 5)")
+
+    def test_errors(self):
+        for expression in ["", "   ", "NAME OR", "(NAME", "NAME)",
+                           "NAME DATE", "FOO", "name = CITY", "TYPE = NAME",
+                           "LOCATION/NAME", "start < DATE", "NAME $",
+                           "AND NAME"]:
+            self.assertRaises(FilterError, compile_filter, expression)
+
+
+class MaskTest(support.CorpusTestCase, unittest.TestCase):
+    def annotations(self):
+        with support.quiet():
+            return [StandoffAnnotation(os.path.join(d, fn))
+                    for d in (self.gold, self.system)
+                    for fn in sorted(os.listdir(d))]
+
+    def test_tag_masks(self):
+        for sa in self.annotations():
+            tags = sa.get_phi()
+            columns = TagColumns(tags)
+            for expression in EXPRESSIONS:
+                f = compile_filter(expression)
+                self.assertEqual(f.mask(columns).tolist(),
+                                 [f(t) for t in tags], expression)
+
+    def test_hipaa_lookup(self):
+        f = PHITrackEvaluation.HIPAA_predicate_filter
+        for sa in self.annotations():
+            tags = sa.get_phi()
+            # Tags written in lower case are looked up as written
+            for t in tags[::3]:
+                t.TYPE = t.TYPE.lower()
+            columns = TagColumns(tags)
+            self.assertEqual(columns.respelled.tolist(),
+                             [t.TYPE != t.TYPE.upper() for t in tags])
+            self.assertEqual(f.mask(columns).tolist(),
+                             [PHITrackEvaluation.is_HIPAA(t.name, t.TYPE)
+                              for t in tags])
+
+    def test_token_selection(self):
+        # Token configurations select the tokens EvaluateTokenizedPHI
+        # filter_tagset() keeps, filtering each token on its own offsets
+        for sa in self.annotations():
+            tokens = EvaluateTokenizedPHI.get_tagset.__func__(None, sa)
+            rows = _DocumentRows(sa)
+            for expression in EXPRESSIONS:
+                filters = [compile_filter(e) for e in expression.split(",")]
+                for conjunctive in (False, True):
+                    for invert in (False, True):
+                        combine = all if conjunctive else any
+                        expected = sorted(
+                            (t.start, t.end) for t in tokens
+                            if combine([f(t) for f in filters]) != invert)
+                        selected, indices = rows.select(
+                            EvaluationConfiguration("Token", True, "strict",
+                                                    filters, conjunctive,
+                                                    invert))
+                        self.assertEqual(sorted(map(tuple,
+                                                    selected[:, 2:].tolist())),
+                                         expected, expression)
+
+    def test_masks_cached_by_expression(self):
+        rows = _DocumentRows(self.annotations()[0])
+        first = rows.mask([compile_filter("NAME OR start < 50")], False, False)
+        again = rows.mask([compile_filter("NAME OR start < 50")], False, False)
+        self.assertIs(first, again)
+        self.assertEqual(len(rows._filters), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
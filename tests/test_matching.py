@@ -0,0 +1,147 @@
+###############################################################################
+#
+#   SpanMatcher, OverlapMatcher and _MinTree against brute force references:
+# the largest one-to-one pairing of compatible rows (found by augmenting
+# paths) and, for exact matching, the set intersection of PHITags the
+# original Evaluate computed.
+
+import random
+import unittest
+
+import numpy
+
+import support
+from bench_matching import set_counts
+from bench_matching import synthetic_document
+from classes import OverlapMatcher
+from classes import SpanMatcher
+from classes import _MinTree
+
+
+def random_rows(rng, n):
+    rows = []
+    for i in range(n):
+        start = rng.randint(0, 40)
+        rows.append((rng.randint(0, 2), rng.randint(0, 1), start,
+                     start + rng.randint(1, 8)))
+    # Repeat some rows, which are counted once
+    rows.extend(rng.sample(rows, rng.randint(0, min(2, len(rows)))))
+    rng.shuffle(rows)
+    return SpanMatcher.rows(rows)
+
+
+def first_rows(rows):
+    """ Index of the first occurrence of every distinct row. """
+    first = {}
+    for i, row in enumerate(map(tuple, rows)):
+        first.setdefault(row, i)
+    return sorted(first.values())
+
+
+def maximum_pairing(gold, system, compatible):
+    """ Size of the largest one-to-one pairing of distinct gold and system
+    rows for which compatible(gold row, system row) is true.
+    """
+    gold = [tuple(gold[i]) for i in first_rows(gold)]
+    system = [tuple(system[i]) for i in first_rows(system)]
+    paired = {}
+
+    def augment(g, seen):
+        for s in range(len(system)):
+            if s not in seen and compatible(gold[g], system[s]):
+                seen.add(s)
+                if s not in paired or augment(paired[s], seen):
+                    paired[s] = g
+                    return True
+        return False
+
+    return sum(1 for g in range(len(gold)) if augment(g, set()))
+
+
+def within(distance):
+    def compatible(g, s):
+        return g[:3] == s[:3] and abs(g[3] - s[3]) <= distance
+    return compatible
+
+
+def overlapping(g, s):
+    return g[:2] == s[:2] and g[2] < s[3] and s[2] < g[3]
+
+
+class MatcherTest(unittest.TestCase):
+    cases = 600
+
+    def check(self, matcher, gold, system, distance, compatible):
+        tp, fp, fn = matcher.match(gold, system, distance=distance)
+        gold_first, system_first = first_rows(gold), first_rows(system)
+
+        self.assertEqual(sorted(tp.tolist() + fn.tolist()), gold_first)
+        self.assertTrue(set(fp.tolist()) <= set(system_first))
+        self.assertEqual(len(tp) + len(fp), len(system_first))
+        self.assertEqual(len(tp), maximum_pairing(gold, system, compatible))
+
+    def test_span_matcher(self):
+        rng = random.Random(1)
+        for _ in range(self.cases):
+            gold = random_rows(rng, rng.randint(0, 10))
+            system = random_rows(rng, rng.randint(0, 10))
+            for distance in (0, 1, 3):
+                self.check(SpanMatcher(), gold, system, distance,
+                           within(distance))
+
+    def test_overlap_matcher(self):
+        rng = random.Random(2)
+        for _ in range(self.cases):
+            gold = random_rows(rng, rng.randint(0, 10))
+            system = random_rows(rng, rng.randint(0, 10))
+            self.check(OverlapMatcher(), gold, system, 0, overlapping)
+
+    def test_empty_sides(self):
+        rows = SpanMatcher.rows([(0, 0, 5, 9), (1, 0, 7, 8)])
+        empty = SpanMatcher.rows([])
+        for matcher in (SpanMatcher(), OverlapMatcher()):
+            tp, fp, fn = matcher.match(rows, empty)
+            self.assertEqual((len(tp), len(fp), fn.tolist()), (0, 0, [0, 1]))
+            tp, fp, fn = matcher.match(empty, rows)
+            self.assertEqual((len(tp), fp.tolist(), len(fn)), (0, [0, 1], 0))
+
+    def test_strict_matches_tag_sets(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            gold, system = synthetic_document(rng.randint(0, 30), rng)
+            tp, fp, fn = SpanMatcher().match(
+                SpanMatcher.rows([(t.name_code, t.TYPE_code, int(t.start),
+                                   int(t.end)) for t in gold]),
+                SpanMatcher.rows([(t.name_code, t.TYPE_code, int(t.start),
+                                   int(t.end)) for t in system]))
+            self.assertEqual((len(tp), len(fp), len(fn)),
+                             set_counts(gold, system))
+
+
+class MinTreeTest(unittest.TestCase):
+    def test_first_below(self):
+        rng = random.Random(4)
+        for _ in range(200):
+            values = [rng.randint(0, 50) for _ in range(rng.randint(1, 40))]
+            tree = _MinTree(values)
+            present = list(values)
+            for _ in range(30):
+                lo, bound = rng.randint(0, len(values)), rng.randint(0, 60)
+                expected = next((i for i in range(lo, len(values))
+                                 if present[i] is not None and
+                                 present[i] < bound), -1)
+                self.assertEqual(tree.first_below(lo, bound), expected)
+                if expected >= 0 and rng.random() < 0.5:
+                    tree.remove(expected)
+                    present[expected] = None
+
+    def test_numpy_values(self):
+        tree = _MinTree(numpy.array([7, 3, 9], dtype=numpy.int64))
+        self.assertEqual(tree.first_below(0, 4), 1)
+        tree.remove(1)
+        self.assertEqual(tree.first_below(0, 4), -1)
+        self.assertEqual(tree.first_below(0, 8), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
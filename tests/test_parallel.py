@@ -0,0 +1,124 @@
+###############################################################################
+#
+#   Parallel runs (-j) must print the report of a single process, and a
+# document that cannot be parsed must make them fail, naming the document,
+# rather than hang. Runs are killed after TIMEOUT seconds.
+
+import os
+import pickle
+import tarfile
+import unittest
+
+import support
+from evaluate import WorkerError
+from evaluate import system_names
+from evaluate import worker_error
+from evaluate import worker_pool
+
+TIMEOUT = 120
+
+
+def _fail(value):
+    raise ValueError(value)
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def test_worker_error_pickles(self):
+        try:
+            raise ValueError("bad value")
+        except ValueError:
+            error = worker_error("100-01.xml")
+        self.assertIsInstance(error, WorkerError)
+        self.assertEqual(str(pickle.loads(pickle.dumps(error))),
+                         "100-01.xml: ValueError: bad value")
+
+    def test_pool_terminated_on_error(self):
+        with self.assertRaises(ValueError):
+            with worker_pool(2) as pool:
+                pool.map(_fail, [1, 2, 3])
+        self.assertEqual([p.exitcode for p in pool._pool
+                          if p.exitcode is None], [])
+
+    def test_single_job(self):
+        initialized = []
+        with worker_pool(1, initialized.append, (True,)) as pool:
+            self.assertIs(pool, None)
+        self.assertEqual(initialized, [True])
+
+
+class SystemNamesTest(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(system_names(["/a/x/", "/a/y"]), ["x", "y"])
+        self.assertEqual(system_names(["/runs/a/system/", "/runs/b/system"]),
+                         ["a/system", "b/system"])
+        self.assertEqual(system_names(["/r/ab/s", "/r/ac/s", "/r/t"]),
+                         ["ab/s", "ac/s", "t"])
+        self.assertRaises(AssertionError, system_names, ["/a/x/", "/a/x"])
+
+
+class ParallelTest(support.CorpusTestCase, unittest.TestCase):
+    def run_evaluate(self, args):
+        status, stdout, stderr = support.run_evaluate(args, timeout=TIMEOUT)
+        self.assertIsNotNone(status, "evaluate.py {} hangs".format(
+            " ".join(args)))
+        return status, stdout, stderr
+
+    def broken(self):
+        """ Breaks a system document, returns its file name. """
+        name = sorted(os.listdir(self.system))[3]
+        self.break_file(os.path.join(self.system, name))
+        return name
+
+    def assertFailsNaming(self, args, name):
+        status, stdout, stderr = self.run_evaluate(args)
+        self.assertNotEqual(status, 0)
+        self.assertIn("WorkerError", stderr)
+        self.assertIn(name, stderr)
+
+    def archive(self):
+        path = self.path("system.tar.gz")
+        with tarfile.open(path, "w:gz") as archive:
+            archive.add(self.system, arcname="system")
+        return path
+
+    def test_same_report(self):
+        for args in ([], ["--stream"], ["--overlap", "--filter", "NAME"]):
+            reports = []
+            for jobs in ("1", "3"):
+                status, stdout, stderr = self.run_evaluate(
+                    ["track1", "-v", "-j", jobs] + args +
+                    [self.gold, self.system])
+                self.assertEqual(status, 0, stderr)
+                reports.append(stdout)
+            self.assertEqual(reports[0], reports[1])
+
+    def test_broken_document(self):
+        name = self.broken()
+        self.assertFailsNaming(["track1", "-j", "2", self.gold, self.system],
+                               name)
+
+    def test_broken_archive_member(self):
+        name = self.broken()
+        self.assertFailsNaming(["track1", "-j", "2", self.gold,
+                                self.archive()], name)
+
+    def test_broken_stream(self):
+        name = self.broken()
+        self.assertFailsNaming(["track1", "--stream", "-j", "4", self.gold,
+                                self.system], name.split(".")[0])
+
+    def test_broken_leaderboard_system(self):
+        self.broken()
+        self.assertFailsNaming(["track1", "--leaderboard", "-j", "2",
+                                self.gold, self.gold, self.system],
+                               self.system)
+
+    def test_broken_gold(self):
+        name = sorted(os.listdir(self.gold))[0]
+        self.break_file(os.path.join(self.gold, name))
+        self.assertFailsNaming(["track1", "--leaderboard", "-j", "2",
+                                self.gold, self.system], name)
+
+
+if __name__ == "__main__":
+    unittest.main()
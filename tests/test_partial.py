@@ -0,0 +1,91 @@
+###############################################################################
+#
+#   Sharded evaluation: the partial results of shards covering the corpus,
+# merged, must print exactly the report of a single run.
+
+import os
+import unittest
+
+import support
+
+
+class PartialTest(support.CorpusTestCase, unittest.TestCase):
+    def run_ok(self, args):
+        status, stdout, stderr = support.run_evaluate(args)
+        self.assertEqual(status, 0, stderr)
+        return stdout
+
+    def single_run(self, report_args, options=()):
+        return support.report(self.run_ok(["track1"] + report_args +
+                                           list(options) +
+                                           [self.gold, self.system]))
+
+    def partials(self, shards, options=(), prefix="part"):
+        files = []
+        for index in range(shards):
+            files.append(self.path("{}{}".format(prefix, index)))
+            self.run_ok(["track1", "--shard", "{}/{}".format(index, shards),
+                         "--partial", files[-1]] + list(options) +
+                        [self.gold, self.system])
+        return files
+
+    def merged(self, report_args, files):
+        return support.report(self.run_ok(["merge"] + report_args + files))
+
+    def test_merge_equals_single_run(self):
+        files = self.partials(3)
+        for report_args in ([], ["-v"], ["--format", "jsonl", "-v"],
+                            ["--bootstrap", "50", "--seed", "1"]):
+            self.assertEqual(self.merged(report_args, files),
+                             self.single_run(report_args))
+
+    def test_merge_with_options(self):
+        options = ["--filter", "NAME OR start < 400,DATE", "--invert",
+                   "--overlap"]
+        self.assertEqual(self.merged(["-v"], self.partials(2, options)),
+                         self.single_run(["-v"], options))
+
+    def test_manifests(self):
+        names = sorted(os.listdir(self.system))
+        files = []
+        for i, listed in enumerate((names[:5], names[5:])):
+            manifest = self.path("manifest{}".format(i))
+            with open(manifest, "w") as handle:
+                handle.write("# documents of shard {}\n".format(i))
+                handle.write("\n".join(listed) + "\n")
+            files.append(self.path("part{}".format(i)))
+            self.run_ok(["track1", "--manifest", manifest, "--partial",
+                         files[-1], self.gold, self.system])
+        self.assertEqual(self.merged(["-v"], files), self.single_run(["-v"]))
+
+    def test_incomplete_or_overlapping_shards(self):
+        files = self.partials(3)
+        status, stdout, stderr = support.run_evaluate(["merge"] + files[:2])
+        self.assertNotEqual(status, 0)
+        self.assertIn("in none of the partial results", stderr)
+
+        status, stdout, stderr = support.run_evaluate(
+            ["merge"] + files + files[:1])
+        self.assertNotEqual(status, 0)
+        self.assertIn("again", stderr)
+
+    def test_other_options(self):
+        files = self.partials(2)
+        overlap = self.partials(2, ["--overlap"], prefix="overlap")
+        status, stdout, stderr = support.run_evaluate(
+            ["merge", files[0], overlap[1]])
+        self.assertNotEqual(status, 0)
+        self.assertIn("different options", stderr)
+
+    def test_report_options_rejected(self):
+        for args in (["-v"], ["--bootstrap", "10"], ["--format", "json"],
+                     ["--errors"]):
+            status, stdout, stderr = support.run_evaluate(
+                ["track1", "--partial", self.path("part")] + args +
+                [self.gold, self.system])
+            self.assertEqual(status, 2, args)
+            self.assertFalse(os.path.exists(self.path("part")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+###############################################################################
+#
+#   A worker process of the evaluation server that dies must not leave its
+# request waiting forever: the request times out, its permit is given back
+# and the pool is replaced, so that later requests are still scored.
+
+import os
+import unittest
+
+import support
+import server
+
+evaluate_track1 = server.evaluate_track1
+
+
+def _evaluate_or_die(system_dir, options):
+    if options.get("verbose") == "die":
+        os._exit(1)
+    return evaluate_track1(system_dir, options)
+
+
+class ServerTest(support.CorpusTestCase, unittest.TestCase):
+    docs = 4
+
+    def setUp(self):
+        super(ServerTest, self).setUp()
+        # Workers are forked from this process and see the patched evaluator
+        server.EVALUATORS["track1"] = _evaluate_or_die
+        with support.quiet():
+            self.server = server.EvaluationServer(
+                ("127.0.0.1", 0), gold_dir=self.gold, jobs=1, max_pending=1,
+                timeout=2)
+
+    def tearDown(self):
+        self.server.server_close()
+        server.EVALUATORS["track1"] = evaluate_track1
+        super(ServerTest, self).tearDown()
+
+    def test_dead_worker(self):
+        for _ in range(2):
+            status, response = self.server.evaluate(
+                "track1", {"system": self.system, "verbose": "die"})
+            self.assertEqual(status, 500)
+            self.assertIn("did not finish", response["error"])
+
+        status, response = self.server.evaluate("track1",
+                                                {"system": self.system})
+        self.assertEqual(status, 200, response)
+        self.assertTrue(response["records"])
+
+
+if __name__ == "__main__":
+    unittest.main()